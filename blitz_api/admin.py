@@ -9,7 +9,8 @@ from modeltranslation.admin import TranslationAdmin
 from simple_history.admin import SimpleHistoryAdmin
 
 from .models import (AcademicField, AcademicLevel, ActionToken, Domain,
-                     Organization, TemporaryToken, User)
+                     Organization, ScheduledTask, TemporaryToken,
+                     TicketTransaction, User)
 from .resources import (AcademicFieldResource, AcademicLevelResource,
                         OrganizationResource, UserResource)
 
@@ -38,6 +39,9 @@ class CustomUserAdmin(UserAdmin, SimpleHistoryAdmin, ExportActionModelAdmin):
     """ Required to display extra fields of users in Django Admin """
     resource_class = UserResource
     form = CustomUserChangeForm
+    # Tickets are only changed through the ledger, with the tickets action of
+    # the users endpoint (services.adjust_tickets)
+    readonly_fields = ('tickets',)
 
     def __init__(self, *args, **kwargs):
         super(CustomUserAdmin, self).__init__(*args, **kwargs)
@@ -89,6 +93,16 @@ class TemporaryTokenAdmin(SimpleHistoryAdmin):
     )
 
 
+class TicketTransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'amount', 'reason', 'created',)
+    search_fields = ('user__email',)
+    list_filter = (
+        'reason',
+        'created',
+    )
+    readonly_fields = ('user', 'amount', 'reason', 'created',)
+
+
 class AcademicFieldAdmin(SimpleHistoryAdmin, TranslationAdmin,
                          ExportActionModelAdmin):
     resource_class = AcademicFieldResource
@@ -99,10 +113,22 @@ class AcademicLevelAdmin(SimpleHistoryAdmin, TranslationAdmin,
     resource_class = AcademicLevelResource
 
 
+class ScheduledTaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'execution_date', 'status', 'executed_at',)
+    list_filter = (
+        'name',
+        'status',
+        'execution_date',
+    )
+    readonly_fields = ('executed_at', 'error', 'created',)
+
+
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Organization, CustomOrganizationAdmin)
 admin.site.register(Domain, SimpleHistoryAdmin)
 admin.site.register(ActionToken, ActionTokenAdmin)
 admin.site.register(TemporaryToken, TemporaryTokenAdmin)
+admin.site.register(TicketTransaction, TicketTransactionAdmin)
+admin.site.register(ScheduledTask, ScheduledTaskAdmin)
 admin.site.register(AcademicField, AcademicFieldAdmin)
 admin.site.register(AcademicLevel, AcademicLevelAdmin)
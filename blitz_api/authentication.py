@@ -6,6 +6,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
 
 from .models import TemporaryToken
+from .services import save_fields
 
 
 class TemporaryTokenAuthentication(TokenAuthentication):
@@ -37,6 +38,7 @@ class TemporaryTokenAuthentication(TokenAuthentication):
                 minutes=settings.REST_FRAMEWORK_TEMPORARY_TOKENS['MINUTES']
             )
             token.expires = expires
-            token.save()
+            # Renewed on every request: not worth a history entry
+            save_fields(token, history=False)
 
         return token.user, token
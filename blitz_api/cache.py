@@ -0,0 +1,162 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+
+VERSION_KEY = 'response_cache:version:{0}'
+RESPONSE_KEY = 'response_cache:response:{0}'
+
+
+def get_versions(labels):
+    """
+    Returns the current version of each model label, as a list of
+    (token, timestamp of the last change), creating the missing ones.
+    """
+    keys = [VERSION_KEY.format(label) for label in sorted(labels)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = (uuid.uuid4().hex, time.time())
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def invalidate_cached_responses(*models):
+    """
+    Invalidates the cached responses depending on the given models.
+
+    This is done when instances are saved or deleted and when many-to-many
+    relations change, but queryset update() and bulk_create() don't send
+    these signals: call this function after using them.
+    """
+    labels = {
+        model._meta.label for model in models
+        if model._meta.label in settings.RESPONSE_CACHE['MODELS']
+    }
+    if not labels:
+        return
+
+    def new_versions():
+        cache.set_many(
+            {
+                VERSION_KEY.format(label): (uuid.uuid4().hex, time.time())
+                for label in labels
+            },
+            None,
+        )
+
+    new_versions()
+    # A request made before the commit could otherwise cache the previous
+    # data under the new version.
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(new_versions)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_on_change(sender, **kwargs):
+    invalidate_cached_responses(sender)
+
+
+@receiver(m2m_changed)
+def invalidate_on_m2m_change(sender, instance, action, model, **kwargs):
+    if action.startswith('post_'):
+        invalidate_cached_responses(type(instance), model)
+
+
+class CachedResponseMixin(object):
+    """
+    Viewset mixin caching the rendered responses of the list and retrieve
+    actions, for resources that are the same for every user.
+
+    Responses are cached by host, path, query string, language, staff flag
+    and version of the models listed in cache_models ("app_label.ModelName"),
+    which must also be listed in settings.RESPONSE_CACHE['MODELS']. Changing
+    an instance of one of these models creates a new version, leaving the
+    previous responses unused until they expire.
+
+    Responses have an ETag and a Last-Modified header: clients revalidating
+    them get a 304 response if they didn't change.
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super(CachedResponseMixin, self).list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super(CachedResponseMixin, self).retrieve,
+            request, *args, **kwargs
+        )
+
+    def use_cached_response(self, request):
+        """
+        Whether the response of the request can be cached, for responses
+        depending on more than the models of cache_models.
+        """
+        return settings.RESPONSE_CACHE['ENABLED']
+
+    def get_cached_response(self, view, request, *args, **kwargs):
+        if not self.use_cached_response(request):
+            return view(request, *args, **kwargs)
+
+        versions = get_versions(self.cache_models)
+        key = RESPONSE_KEY.format(hashlib.md5(repr((
+            request.get_host(),
+            request.get_full_path(),
+            get_language(),
+            request.user.is_staff,
+            request.accepted_media_type,
+            versions,
+        )).encode()).hexdigest())
+
+        cached = cache.get(key)
+        if cached is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+
+            cached = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': quote_etag(hashlib.md5(response.content).hexdigest()),
+                'last_modified': int(max(
+                    [timestamp for token, timestamp in versions] or
+                    [time.time()]
+                )),
+            }
+            cache.set(key, cached, settings.RESPONSE_CACHE['TIMEOUT'])
+        else:
+            response = HttpResponse(
+                cached['content'],
+                content_type=cached['content_type'],
+            )
+
+        response['ETag'] = cached['etag']
+        response['Last-Modified'] = http_date(cached['last_modified'])
+        patch_vary_headers(response, ('Accept-Language', 'Authorization'))
+
+        return get_conditional_response(
+            request,
+            etag=cached['etag'],
+            last_modified=cached['last_modified'],
+            response=response,
+        )
@@ -0,0 +1,150 @@
+import random
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.timezone import now
+
+from simple_history.models import HistoricalRecords
+from simple_history.signals import (post_create_historical_record,
+                                    pre_create_historical_record)
+
+_local = threading.local()
+
+
+def _get_buffer(using):
+    return getattr(_local, 'buffers', {}).get(using or DEFAULT_DB_ALIAS)
+
+
+class BufferedHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords writing historical rows with a single bulk insert per
+    model at the end of a history.atomic() block instead of one INSERT per
+    save. Outside of such a block, rows are written immediately.
+
+    Recording rules are read from settings.HISTORY_RECORDING:
+        EXCLUDE:  models ("app_label.ModelName") never recorded.
+        SAMPLING: {"app_label.ModelName": rate} fraction of updates
+                  recorded. Creations and deletions are always recorded.
+    """
+
+    def should_record(self, instance, history_type):
+        rules = getattr(settings, 'HISTORY_RECORDING', {})
+        label = instance._meta.label
+
+        if label in rules.get('EXCLUDE', []):
+            return False
+        if history_type == '~':
+            rate = rules.get('SAMPLING', {}).get(label, 1)
+            return rate >= 1 or random.random() < rate
+        return True
+
+    def create_historical_record(self, instance, history_type, using=None):
+        if not self.should_record(instance, history_type):
+            return
+
+        buffer = _get_buffer(using)
+        if buffer is None:
+            return super(
+                BufferedHistoricalRecords, self
+            ).create_historical_record(instance, history_type, using=using)
+
+        history_date = getattr(instance, '_history_date', now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = getattr(instance, 'changeReason', None)
+        manager = getattr(instance, self.manager_name)
+
+        attrs = {}
+        for field in self.fields_included(instance):
+            attrs[field.attname] = getattr(instance, field.attname)
+
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs
+        )
+
+        signal_kwargs = dict(
+            sender=manager.model,
+            instance=instance,
+            history_date=history_date,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            history_instance=history_instance,
+            using=using,
+        )
+        pre_create_historical_record.send(**signal_kwargs)
+
+        buffer.setdefault(manager.model, []).append(signal_kwargs)
+
+
+class atomic(ContextDecorator):
+    """
+    Same as django.db.transaction.atomic, but historical rows created in the
+    block are buffered and written with one bulk_create per model just
+    before the outermost block commits. Nothing is written on rollback.
+
+    NOTE: Rows buffered inside a plain transaction.atomic() savepoint that is
+    rolled back are still written. Nest history.atomic() blocks instead.
+    """
+
+    def __init__(self, using=None):
+        self.using = using or DEFAULT_DB_ALIAS
+
+    # The state of each entered block is kept on a thread-local stack, not
+    # on the instance: a decorator instance is shared by every call, from
+    # every thread, and can be re-entered.
+
+    def __enter__(self):
+        buffers = _local.__dict__.setdefault('buffers', {})
+        stack = _local.__dict__.setdefault('stacks', {}).setdefault(
+            self.using, []
+        )
+        if self.using not in buffers:
+            buffers[self.using] = OrderedDict()
+            # None marks the outermost block
+            marks = None
+        else:
+            # Remember the size of the buffer to forget the rows of this
+            # block if it is rolled back.
+            marks = {
+                model: len(records) for model, records in
+                buffers[self.using].items()
+            }
+        atomic = transaction.atomic(using=self.using)
+        try:
+            atomic.__enter__()
+        except Exception:
+            if marks is None:
+                del buffers[self.using]
+            raise
+        stack.append((atomic, marks))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        atomic, marks = _local.stacks[self.using].pop()
+        if marks is None:
+            buffer = _local.buffers.pop(self.using)
+            if exc_type is None:
+                try:
+                    self.flush(buffer)
+                except Exception:
+                    atomic.__exit__(*sys.exc_info())
+                    raise
+        elif exc_type is not None:
+            buffer = _local.buffers[self.using]
+            for model in list(buffer):
+                del buffer[model][marks.get(model, 0):]
+        return atomic.__exit__(exc_type, exc_value, traceback)
+
+    def flush(self, buffer):
+        for model, records in buffer.items():
+            model._default_manager.using(self.using).bulk_create(
+                [record['history_instance'] for record in records]
+            )
+            for record in records:
+                post_create_historical_record.send(**record)
@@ -0,0 +1,37 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from blitz_api.services import create_image_derivatives, save_fields
+
+PICTURE_MODELS = ('workplace.Picture', 'retirement.Picture')
+
+
+class Command(BaseCommand):
+    help = 'Create the resized copies of pictures uploaded without them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            help='Recreate the copies of every picture',
+        )
+
+    def handle(self, *args, **options):
+        for label in PICTURE_MODELS:
+            created = 0
+            for picture in apps.get_model(label).objects.iterator():
+                if (not options['all'] and picture.derivatives.get('source')
+                        == picture.picture.name):
+                    continue
+                picture.derivatives = create_image_derivatives(
+                    picture.picture
+                )
+                save_fields(picture, history=False)
+                created += 1
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    'Created the copies of %s %s(s)' % (created, label)
+                )
+            )
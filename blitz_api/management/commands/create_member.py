@@ -2,7 +2,8 @@ import datetime
 from datetime import timedelta
 
 from blitz_api.exceptions import MailServiceError
-from blitz_api.models import AcademicField, AcademicLevel, Organization, User
+from blitz_api.models import (AcademicField, AcademicLevel, Organization,
+                              TicketTransaction, User)
 from blitz_api.services import notify_user_of_new_account
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
@@ -61,6 +62,11 @@ class Command(BaseCommand):
                 is_active=True,
                 tickets=1,
             )
+            TicketTransaction.objects.create(
+                user=user,
+                amount=1,
+                reason='signup',
+            )
             user.set_password(options['password'])
 
             try:
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blitz_api.services import run_scheduled_tasks
+
+
+class Command(BaseCommand):
+    help = 'Execute the scheduled tasks whose execution date is reached'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            dest='interval',
+            help='Keep running, checking for due tasks every INTERVAL '
+                 'seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            executed, failed = run_scheduled_tasks()
+
+            if executed:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        'Executed %s scheduled task(s), %s failed' %
+                        (executed, failed)
+                    )
+                )
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
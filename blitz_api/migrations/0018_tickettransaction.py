@@ -0,0 +1,29 @@
+# Generated by Django 2.0.8 on 2026-10-18 20:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0017_actiontoken_data_change_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.SmallIntegerField(verbose_name='Amount')),
+                ('reason', models.CharField(choices=[('signup', 'Free ticket on signup'), ('package_purchase', 'Package purchase'), ('timeslot_reservation', 'Timeslot reservation'), ('timeslot_modified', 'Timeslot modified'), ('timeslot_deleted', 'Timeslot deleted'), ('period_deleted', 'Period deleted')], max_length=100, verbose_name='Reason')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_transactions', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Ticket transaction',
+                'verbose_name_plural': 'Ticket transactions',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.0.8 on 2026-10-18 21:35
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0018_tickettransaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('retirement_reminder', 'Retirement 7-days reminder'), ('retirement_recap', 'Retirement post-event recap'), ('wait_queue_notification', 'Wait queue notification')], max_length=100, verbose_name='Name')),
+                ('arguments', jsonfield.fields.JSONField(blank=True, default=dict, verbose_name='Arguments')),
+                ('execution_date', models.DateTimeField(verbose_name='Execution date')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1, verbose_name='Status')),
+                ('executed_at', models.DateTimeField(blank=True, null=True, verbose_name='Executed at')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+            ],
+            options={
+                'verbose_name': 'Scheduled task',
+                'verbose_name_plural': 'Scheduled tasks',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='scheduledtask',
+            index_together={('status', 'execution_date')},
+        ),
+    ]
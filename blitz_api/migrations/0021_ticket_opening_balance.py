@@ -0,0 +1,50 @@
+# Generated by Django 2.0.8 on 2026-10-18 22:39
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def create_opening_balances(apps, schema_editor):
+    """
+    Balances existing before the ledger are recorded as one opening entry
+    per user, so the sum of the ledger matches User.tickets.
+    """
+    User = apps.get_model('blitz_api', 'User')
+    TicketTransaction = apps.get_model('blitz_api', 'TicketTransaction')
+
+    ledger_balances = dict(
+        TicketTransaction.objects.values('user').annotate(
+            balance=Sum('amount'),
+        ).values_list('user', 'balance')
+    )
+
+    TicketTransaction.objects.bulk_create([
+        TicketTransaction(
+            user_id=user_id,
+            amount=(tickets or 0) - ledger_balances.get(user_id, 0),
+            reason='opening_balance',
+        )
+        for user_id, tickets in User.objects.values_list('id', 'tickets')
+        if (tickets or 0) != ledger_balances.get(user_id, 0)
+    ], batch_size=1000)
+
+
+def delete_opening_balances(apps, schema_editor):
+    TicketTransaction = apps.get_model('blitz_api', 'TicketTransaction')
+    TicketTransaction.objects.filter(reason='opening_balance').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0020_scheduledtask_refund'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tickettransaction',
+            name='reason',
+            field=models.CharField(choices=[('opening_balance', 'Balance before the ledger'), ('signup', 'Free ticket on signup'), ('package_purchase', 'Package purchase'), ('timeslot_reservation', 'Timeslot reservation'), ('timeslot_modified', 'Timeslot modified'), ('timeslot_deleted', 'Timeslot deleted'), ('period_deleted', 'Period deleted')], max_length=100, verbose_name='Reason'),
+        ),
+        migrations.RunPython(create_opening_balances, delete_opening_balances),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-18 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0023_scheduledtask_retirement_exchange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tickettransaction',
+            name='reason',
+            field=models.CharField(choices=[('opening_balance', 'Balance before the ledger'), ('signup', 'Free ticket on signup'), ('package_purchase', 'Package purchase'), ('timeslot_reservation', 'Timeslot reservation'), ('timeslot_modified', 'Timeslot modified'), ('timeslot_deleted', 'Timeslot deleted'), ('period_deleted', 'Period deleted'), ('admin_adjustment', 'Adjusted by an admin')], max_length=100, verbose_name='Reason'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-18 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0024_tickettransaction_admin_adjustment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scheduledtask',
+            name='name',
+            field=models.CharField(choices=[('retirement_reminder', 'Retirement 7-days reminder'), ('retirement_recap', 'Retirement post-event recap'), ('wait_queue_notification', 'Wait queue notification'), ('refund', 'Refund'), ('retirement_exchange', 'Retirement exchange confirmation'), ('coupon_notification', 'Coupon notification')], max_length=100, verbose_name='Name'),
+        ),
+    ]
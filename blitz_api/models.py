@@ -1,4 +1,5 @@
 import binascii
+import copy
 import os
 from django.conf import settings
 from django.db import models
@@ -10,14 +11,77 @@ from jsonfield import JSONField
 from rest_framework.authtoken.models import Token
 
 from simple_history import register
-from simple_history.models import HistoricalRecords
+from .history import BufferedHistoricalRecords
 
 from django.utils.translation import ugettext_lazy as _
 
 from .managers import ActionTokenManager
 
 
-class User(AbstractUser):
+class DirtyFieldsMixin(object):
+    """
+    Model mixin remembering the values of the fields as they were loaded from
+    the database, so that save() only writes the fields that changed.
+
+    save() without update_fields writes nothing if no field changed. Fields
+    whose value can't be compared, such as deferred fields assigned after
+    loading, are always written.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DirtyFieldsMixin, cls).from_db(
+            db, field_names, values,
+        )
+        instance.remember_values()
+        return instance
+
+    def remember_values(self, fields=None):
+        """
+        Takes a snapshot of the current value of the given fields, or of all
+        the loaded concrete fields, as the values saved in the database.
+        Call it after updating the database by other means than save().
+        """
+        if not hasattr(self, '_loaded_values'):
+            self._loaded_values = dict()
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if fields is None or field.name in fields:
+                self._loaded_values[field.attname] = copy.deepcopy(
+                    self.__dict__[field.attname]
+                )
+
+    def get_dirty_fields(self):
+        """
+        Returns the names of the concrete fields changed since the instance
+        was loaded or saved.
+        """
+        loaded = getattr(self, '_loaded_values', dict())
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and
+            field.attname in self.__dict__ and (
+                field.attname not in loaded or
+                self.__dict__[field.attname] != loaded[field.attname] or
+                getattr(field, 'auto_now', False)
+            )
+        ]
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(DirtyFieldsMixin, self).refresh_from_db(using, fields)
+        self.remember_values(fields)
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and
+                kwargs.get('update_fields') is None and
+                hasattr(self, '_loaded_values')):
+            kwargs['update_fields'] = self.get_dirty_fields()
+        super(DirtyFieldsMixin, self).save(*args, **kwargs)
+        self.remember_values(kwargs.get('update_fields'))
+
+
+class User(DirtyFieldsMixin, AbstractUser):
     """Abstraction of the base User model. Needed to extend in the future."""
 
     GENDER_CHOICES = (
@@ -119,10 +183,151 @@ class User(AbstractUser):
         blank=True,
         null=True,
     )
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
+
+    def save(self, *args, **kwargs):
+        """
+        The ticket balance of an existing user is only changed by
+        services.adjust_tickets: saving a changed balance, or saving it
+        explicitly, raises a ValueError.
+        """
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = self.get_dirty_fields()
+            if 'tickets' in update_fields:
+                raise ValueError(
+                    "The tickets of a user are changed with "
+                    "services.adjust_tickets, not saved."
+                )
+        super(User, self).save(*args, **kwargs)
+
+
+class TicketTransaction(models.Model):
+    """
+    Append-only ledger of the changes made to users' ticket balance.
+
+    The current balance is cached in User.tickets and is always updated
+    in the same transaction as the ledger (see services.adjust_tickets).
+    """
+
+    REASONS = [
+        ('opening_balance', _('Balance before the ledger')),
+        ('signup', _('Free ticket on signup')),
+        ('package_purchase', _('Package purchase')),
+        ('timeslot_reservation', _('Timeslot reservation')),
+        ('timeslot_modified', _('Timeslot modified')),
+        ('timeslot_deleted', _('Timeslot deleted')),
+        ('period_deleted', _('Period deleted')),
+        ('admin_adjustment', _('Adjusted by an admin')),
+    ]
+
+    class Meta:
+        verbose_name = _("Ticket transaction")
+        verbose_name_plural = _("Ticket transactions")
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='ticket_transactions',
+        verbose_name=_("User"),
+    )
+    amount = models.SmallIntegerField(
+        verbose_name=_("Amount"),
+    )
+    reason = models.CharField(
+        verbose_name=_("Reason"),
+        max_length=100,
+        choices=REASONS,
+    )
+    created = models.DateTimeField(
+        verbose_name=_("Creation date"),
+        auto_now_add=True,
+    )
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.user, self.amount)
+
+
+class ScheduledTask(DirtyFieldsMixin, models.Model):
+    """
+    A task executed once its execution date is reached by the
+    run_scheduled_tasks management command.
+
+    "name" identifies the function to call in settings.SCHEDULED_TASKS and
+    "arguments" holds its keyword arguments. Failed tasks are retried as set
+    in settings.SCHEDULED_TASK_RETRIES.
+    """
+
+    TASKS = [
+        ('retirement_reminder', _('Retirement 7-days reminder')),
+        ('retirement_recap', _('Retirement post-event recap')),
+        ('wait_queue_notification', _('Wait queue notification')),
+        ('refund', _('Refund')),
+        ('retirement_exchange', _('Retirement exchange confirmation')),
+        ('coupon_notification', _('Coupon notification')),
+        ('image_derivatives', _('Picture resized copies')),
+    ]
+
+    STATUS = [
+        ('P', _('Pending')),
+        ('R', _('Running')),
+        ('D', _('Done')),
+        ('F', _('Failed')),
+    ]
+
+    class Meta:
+        verbose_name = _("Scheduled task")
+        verbose_name_plural = _("Scheduled tasks")
+        index_together = ('status', 'execution_date')
+
+    name = models.CharField(
+        verbose_name=_("Name"),
+        max_length=100,
+        choices=TASKS,
+    )
+    arguments = JSONField(
+        verbose_name=_("Arguments"),
+        blank=True,
+        default=dict,
+    )
+    execution_date = models.DateTimeField(
+        verbose_name=_("Execution date"),
+    )
+    status = models.CharField(
+        verbose_name=_("Status"),
+        max_length=1,
+        choices=STATUS,
+        default='P',
+    )
+    executed_at = models.DateTimeField(
+        verbose_name=_("Executed at"),
+        blank=True,
+        null=True,
+    )
+    started_at = models.DateTimeField(
+        verbose_name=_("Started at"),
+        blank=True,
+        null=True,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name=_("Attempts"),
+        default=0,
+    )
+    error = models.TextField(
+        verbose_name=_("Error"),
+        blank=True,
+    )
+    created = models.DateTimeField(
+        verbose_name=_("Creation date"),
+        auto_now_add=True,
+    )
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.get_name_display(), self.execution_date)
 
 
-class TemporaryToken(Token):
+class TemporaryToken(DirtyFieldsMixin, Token):
     """Subclass of Token to add an expiration time."""
 
     class Meta:
@@ -134,7 +339,7 @@ class TemporaryToken(Token):
         blank=True,
     )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def save(self, *args, **kwargs):
         if not self.expires:
@@ -152,10 +357,10 @@ class TemporaryToken(Token):
     def expire(self):
         """Expires a token by setting its expiration date to now."""
         self.expires = timezone.now()
-        self.save()
+        self.save(update_fields=['expires'])
 
 
-class ActionToken(models.Model):
+class ActionToken(DirtyFieldsMixin, models.Model):
     """
         Class of Token to allow User to do some action.
 
@@ -205,7 +410,7 @@ class ActionToken(models.Model):
 
     objects = ActionTokenManager()
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def save(self, *args, **kwargs):
         if not self.key:
@@ -228,7 +433,7 @@ class ActionToken(models.Model):
     def expire(self):
         """Expires a token by setting its expiration date to now."""
         self.expires = timezone.now()
-        self.save()
+        self.save(update_fields=['expires'])
 
     def __str__(self):
         return self.key
@@ -281,7 +486,7 @@ class Domain(models.Model):
         related_name="domains",
     )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return self.name
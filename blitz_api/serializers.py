@@ -1,3 +1,4 @@
+import os
 import re
 from rest_framework import serializers, status
 from rest_framework.validators import UniqueValidator
@@ -7,14 +8,16 @@ from django.contrib.auth import (get_user_model, password_validation,
                                  authenticate, )
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
+from django.core import signing
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage
+from django.core.validators import get_available_image_extensions
 from django.db.models.base import ObjectDoesNotExist
 
 from .models import (
     Domain, Organization, ActionToken, AcademicField, AcademicLevel,
 )
-from .services import remove_translation_fields, check_if_translated_field
+from .services import TranslatedSerializerMixin, check_if_translated_field
 from . import services
 from store.serializers import MembershipSerializer
 
@@ -40,7 +43,8 @@ class DomainSerializer(serializers.HyperlinkedModelSerializer):
         fields = '__all__'
 
 
-class OrganizationSerializer(serializers.HyperlinkedModelSerializer):
+class OrganizationSerializer(TranslatedSerializerMixin,
+                             serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(
         max_length=100,
@@ -63,18 +67,13 @@ class OrganizationSerializer(serializers.HyperlinkedModelSerializer):
             })
         return super(OrganizationSerializer, self).validate(attr)
 
-    def to_representation(self, instance):
-        data = super(OrganizationSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
-
     class Meta:
         model = Organization
         fields = '__all__'
 
 
-class AcademicLevelSerializer(serializers.HyperlinkedModelSerializer):
+class AcademicLevelSerializer(TranslatedSerializerMixin,
+                              serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(
         max_length=100,
@@ -96,18 +95,13 @@ class AcademicLevelSerializer(serializers.HyperlinkedModelSerializer):
             })
         return super(AcademicLevelSerializer, self).validate(attr)
 
-    def to_representation(self, instance):
-        data = super(AcademicLevelSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
-
     class Meta:
         model = AcademicLevel
         fields = '__all__'
 
 
-class AcademicFieldSerializer(serializers.HyperlinkedModelSerializer):
+class AcademicFieldSerializer(TranslatedSerializerMixin,
+                              serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(
         max_length=100,
@@ -129,12 +123,6 @@ class AcademicFieldSerializer(serializers.HyperlinkedModelSerializer):
             })
         return super(AcademicFieldSerializer, self).validate(attr)
 
-    def to_representation(self, instance):
-        data = super(AcademicFieldSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
-
     class Meta:
         model = AcademicField
         fields = '__all__'
@@ -379,6 +367,7 @@ class UserUpdateSerializer(serializers.HyperlinkedModelSerializer):
             'groups',
             'user_permissions',
             'reservations',
+            'tickets',
         )
 
 
@@ -483,11 +472,11 @@ class UserSerializer(UserUpdateSerializer):
         # Put user inactive by default
         user.is_active = False
 
-        # Free ticket for new users
-        user.tickets = 1
-
         user.save()
 
+        # Free ticket for new users
+        services.adjust_tickets(user, 1, 'signup')
+
         # Create an ActivationToken to activate user in the future
         ActionToken.objects.create(
             user=user,
@@ -586,7 +575,102 @@ class ResetPasswordSerializer(serializers.Serializer):
         return User.objects.get(email=attrs['email'])
 
 
+class TicketAdjustmentSerializer(serializers.Serializer):
+    # Tickets to add, or to remove if negative
+    amount = serializers.IntegerField()
+
+    def validate_amount(self, value):
+        if not value:
+            raise serializers.ValidationError(_(
+                "The amount can't be zero."
+            ))
+        return value
+
+
 class ChangePasswordSerializer(serializers.Serializer):
 
     token = serializers.CharField(required=True)
     new_password = serializers.CharField(required=True)
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    period = serializers.ChoiceField(
+        choices=services.ANALYTICS_PERIODS,
+        default='month',
+    )
+
+    def validate(self, attrs):
+        validated_data = super(AnalyticsQuerySerializer, self).validate(attrs)
+        if validated_data['start_date'] > validated_data['end_date']:
+            raise serializers.ValidationError({
+                'end_date': [_("End date must be later than start_date.")],
+            })
+        return validated_data
+
+
+class ImageUploadSerializer(serializers.Serializer):
+    filename = serializers.CharField(
+        max_length=253,
+        help_text=_("Name of the image file to upload."),
+    )
+
+    def validate_filename(self, value):
+        extension = os.path.splitext(value)[1][1:].lower()
+        if extension not in get_available_image_extensions():
+            raise serializers.ValidationError(_(
+                "Only image files can be uploaded."
+            ))
+        return value
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    key = serializers.CharField()
+    policy = serializers.CharField()
+    file = serializers.FileField()
+
+    def validate(self, attrs):
+        validated_data = super(DirectUploadSerializer, self).validate(attrs)
+        config = settings.DIRECT_UPLOADS
+        try:
+            policy = signing.loads(
+                validated_data['policy'],
+                salt=services.DIRECT_UPLOAD_SALT + '.policy',
+                max_age=config['EXPIRES'],
+            )
+        except signing.BadSignature:
+            policy = {}
+        if policy.get('key') != validated_data['key']:
+            raise serializers.ValidationError({
+                'policy': [_("Invalid or expired upload policy.")],
+            })
+        validated_data['field'] = services.get_direct_upload_field(
+            policy['field'],
+        )
+        if validated_data['file'].size > config['MAX_SIZE']:
+            raise serializers.ValidationError({
+                'file': [_("The file is too large.")],
+            })
+        return validated_data
+
+
+class DirectUploadTokenField(serializers.CharField):
+    """
+    Token returned by blitz_api.services.create_direct_upload, validated
+    into the name of the uploaded file.
+    """
+    default_error_messages = {
+        'invalid_upload': _("Invalid or expired upload, or file not sent."),
+    }
+
+    def __init__(self, model_field, **kwargs):
+        self.model_field = model_field
+        super(DirectUploadTokenField, self).__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        token = super(DirectUploadTokenField, self).to_internal_value(data)
+        name = services.get_direct_upload_name(self.model_field, token)
+        if name is None:
+            self.fail('invalid_upload')
+        return name
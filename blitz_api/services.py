@@ -1,18 +1,40 @@
-from datetime import datetime
+import os
+import posixpath
+import uuid
+from collections import defaultdict, OrderedDict
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from io import BytesIO
 
 import pytz
 import re
+import traceback
 
 from django.apps import apps
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.contrib.contenttypes.models import ContentType
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.mail import EmailMessage, mail_admins
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
 from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.html import format_html
+from django.utils.module_loading import import_string
 from django.utils.translation import ugettext_lazy as _
 from django.template.loader import render_to_string
+from django.urls import reverse
 
+from modeltranslation.translator import NotRegistered, translator
+from PIL import Image
 from rest_framework.pagination import PageNumberPagination
 
 from .exceptions import MailServiceError
+from .models import ScheduledTask, TicketTransaction, User
 from django.core.mail import send_mail as django_send_mail
 
 from rest_framework.utils.urls import remove_query_param, replace_query_param
@@ -51,6 +73,9 @@ def send_mail(users, context, template):
     return failed_emails
 
 
+LANGUAGE_FIELD = re.compile('[a-z0-9_]+_[a-z]{2}$')
+
+
 def remove_translation_fields(data_dict):
     """
     Used to removed translation fields.
@@ -58,14 +83,85 @@ def remove_translation_fields(data_dict):
     ie:
         name_fr (matches)
         reservation_date (doesn't match)
+
+    Serializers use TranslatedSerializerMixin instead, which doesn't
+    serialize these fields at all.
     """
-    language_field = re.compile('[a-z0-9_]+_[a-z]{2}$')
     data = {
-        k: v for k, v in data_dict.items() if not language_field.match(k)
+        k: v for k, v in data_dict.items() if not LANGUAGE_FIELD.match(k)
     }
     return data
 
 
+@lru_cache(maxsize=None)
+def get_translation_field_names(model):
+    """
+    Returns the names of the translation fields (name_en, name_fr, ...)
+    added to a model by modeltranslation.
+    """
+    try:
+        options = translator.get_options_for_model(model)
+    except NotRegistered:
+        return frozenset()
+    return frozenset(
+        field.name for fields in options.fields.values() for field in fields
+    )
+
+
+class TranslatedSerializerMixin(object):
+    """
+    Serializer mixin leaving the translation fields of the model (name_en,
+    name_fr, ...) and the fields listed in staff_only_fields out of the
+    representations made for non-staff users. They get the fields in the
+    active language (name) instead.
+
+    The omitted fields are computed once per serializer class for staff and
+    non-staff users. The represented fields are then chosen once per
+    serializer instance, and thus once for all the items of a list, instead
+    of serializing every field and filtering each representation.
+
+    Set translation_fields_for_staff to False to leave the translation
+    fields out for staff users too.
+    """
+    staff_only_fields = ()
+    translation_fields_for_staff = True
+    # Omitted field names by (serializer class, is_staff)
+    _omitted_fields = dict()
+
+    @classmethod
+    def get_omitted_fields(cls, is_staff):
+        try:
+            return cls._omitted_fields[cls, is_staff]
+        except KeyError:
+            pass
+
+        omitted_fields = set()
+        if not (is_staff and cls.translation_fields_for_staff):
+            omitted_fields.update(get_translation_field_names(cls.Meta.model))
+        if not is_staff:
+            omitted_fields.update(cls.staff_only_fields)
+
+        cls._omitted_fields[cls, is_staff] = frozenset(omitted_fields)
+        return cls._omitted_fields[cls, is_staff]
+
+    @property
+    def _readable_fields(self):
+        try:
+            return self._represented_fields
+        except AttributeError:
+            pass
+
+        omitted_fields = self.get_omitted_fields(
+            self.context['request'].user.is_staff
+        )
+        self._represented_fields = [
+            field for field in
+            super(TranslatedSerializerMixin, self)._readable_fields
+            if field.field_name not in omitted_fields
+        ]
+        return self._represented_fields
+
+
 def check_if_translated_field(field_name, data_dict):
     """
     Used to check if a field or one of its translated version is present in a
@@ -84,6 +180,97 @@ def check_if_translated_field(field_name, data_dict):
     return False
 
 
+def save_fields(instance, *fields, history=True):
+    """
+    Saves only the given fields of an existing instance, or the fields that
+    changed since it was loaded for models using DirtyFieldsMixin.
+
+    A bare save() rewrites every column and, for models tracked with
+    HistoricalRecords, inserts a full copy of the row in the history table.
+    Use history=False for bookkeeping changes (counters, expiration dates)
+    that aren't worth a new history entry.
+
+    In DEBUG, changed fields missing from the given fields raise an
+    AssertionError instead of being silently left unsaved.
+    """
+    if hasattr(instance, 'get_dirty_fields'):
+        dirty_fields = instance.get_dirty_fields()
+        if not fields:
+            fields = dirty_fields
+        elif settings.DEBUG:
+            unsaved_fields = set(dirty_fields) - set(fields)
+            assert not unsaved_fields, (
+                "Changed fields of {0} not saved: {1}".format(
+                    instance._meta.label,
+                    ", ".join(sorted(unsaved_fields)),
+                )
+            )
+    if not history:
+        instance.skip_history_when_saving = True
+    try:
+        instance.save(update_fields=fields)
+    finally:
+        if not history:
+            del instance.skip_history_when_saving
+
+
+def adjust_tickets(user, amount, reason):
+    """
+    Adds tickets to a user's balance (or removes them if amount is negative)
+    and records the change in the ticket ledger.
+
+    The balance is updated with an F() expression: concurrent purchases and
+    cancellations can't overwrite each other and no user history is written.
+    A debit is only applied if the balance covers it.
+
+    Returns True if the balance was updated, False otherwise.
+    """
+    with transaction.atomic():
+        queryset = User.objects.filter(pk=user.pk)
+        if amount < 0:
+            queryset = queryset.filter(tickets__gte=-amount)
+        updated = queryset.update(
+            tickets=Coalesce(F('tickets'), 0) + amount
+        )
+        if updated:
+            TicketTransaction.objects.create(
+                user=user,
+                amount=amount,
+                reason=reason,
+            )
+
+    # Keep the instance in sync so a later save() doesn't overwrite the
+    # new balance.
+    user.refresh_from_db(fields=['tickets'])
+
+    return bool(updated)
+
+
+def bulk_credit_tickets(tickets_by_user, reason):
+    """
+    Adds tickets to the balance of many users at once.
+
+    tickets_by_user: dict of {user_id: number of tickets to add}
+
+    Users receiving the same number of tickets are updated with a single
+    query and the ledger rows are inserted with a single query.
+    """
+    users_by_amount = defaultdict(list)
+    for user_id, amount in tickets_by_user.items():
+        if amount:
+            users_by_amount[amount].append(user_id)
+
+    with transaction.atomic():
+        for amount, user_ids in users_by_amount.items():
+            User.objects.filter(pk__in=user_ids).update(
+                tickets=Coalesce(F('tickets'), 0) + amount
+            )
+        TicketTransaction.objects.bulk_create(
+            TicketTransaction(user_id=user_id, amount=amount, reason=reason)
+            for user_id, amount in tickets_by_user.items() if amount
+        )
+
+
 def get_model_from_name(model_name):
     """
     Used to get a model instance when you only have its name.
@@ -100,6 +287,439 @@ def get_model_from_name(model_name):
             continue
 
 
+def prefetch_generic_objects(instances, field_name='content_object'):
+    """
+    Fetches the objects referenced by the generic foreign key "field_name"
+    of many instances with a single query per content type and caches them
+    on the instances. Accessing the field afterwards doesn't query the
+    database.
+
+    Returns the instances as a list.
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+
+    opts = instances[0]._meta
+    field = opts.get_field(field_name)
+    ct_attname = opts.get_field(field.ct_field).get_attname()
+
+    object_ids = defaultdict(set)
+    for instance in instances:
+        content_type_id = getattr(instance, ct_attname)
+        if content_type_id is not None:
+            object_ids[content_type_id].add(getattr(instance, field.fk_field))
+
+    objects = dict()
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        # The base manager is used by GenericForeignKey: deleted objects of
+        # safedelete models are still referenced.
+        objects[content_type_id] = model._base_manager.in_bulk(ids)
+
+    for instance in instances:
+        related_object = objects.get(getattr(instance, ct_attname), {}).get(
+            getattr(instance, field.fk_field)
+        )
+        if related_object is not None:
+            field.set_cached_value(instance, related_object)
+
+    return instances
+
+
+def create_image_derivatives(image):
+    """
+    Stores resized and recompressed copies of a saved picture next to it,
+    one per width of settings.IMAGE_DERIVATIVES smaller than the picture, or
+    a single copy at the width of the picture if it is smaller than all of
+    them.
+
+    image: FieldFile of an ImageField, already saved to its storage.
+
+    Returns {'source': name of the picture, 'sizes': {width: name of the
+    copy}}, to be stored on the instance. "sizes" is empty if the file can't
+    be read as an image.
+    """
+    config = settings.IMAGE_DERIVATIVES
+    derivatives = {'source': image.name, 'sizes': {}}
+
+    try:
+        image.open('rb')
+        try:
+            original = Image.open(image)
+            original.load()
+        finally:
+            image.close()
+    except (IOError, SuspiciousFileOperation, Image.DecompressionBombError):
+        return derivatives
+
+    if original.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in original.mode or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+
+    widths = sorted(
+        width for width in config['WIDTHS'] if width < original.width
+    ) or [original.width]
+    root = os.path.splitext(image.name)[0]
+
+    for width in widths:
+        derivative = original.copy()
+        derivative.thumbnail((width, original.height), Image.LANCZOS)
+        content = BytesIO()
+        derivative.save(content, config['FORMAT'], quality=config['QUALITY'])
+        derivatives['sizes'][str(width)] = image.storage.save(
+            '{0}_{1}w.{2}'.format(root, width, config['FORMAT'].lower()),
+            ContentFile(content.getvalue()),
+        )
+
+    return derivatives
+
+
+def update_image_derivatives(model, pk):
+    """
+    Scheduled task creating the copies of the picture of an instance of model
+    ("app_label.Model", see PictureMixin), unless they were already made
+    from its current file.
+    """
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if (instance is None or not instance.picture or
+            instance.derivatives.get('source') == instance.picture.name):
+        return
+    instance.derivatives = create_image_derivatives(instance.picture)
+    save_fields(instance, history=False)
+
+
+def get_image_srcset(image, derivatives, request=None):
+    """
+    Returns the URLs of the copies made by create_image_derivatives by width
+    descriptor ({'320w': url, ...}), smallest first, as used in an HTML
+    srcset. URLs are absolute if a request is given.
+
+    The map is empty if the copies are missing or were made from another
+    file than the current one.
+    """
+    if not image or derivatives.get('source') != image.name:
+        return OrderedDict()
+
+    srcset = OrderedDict()
+    sizes = derivatives.get('sizes', {})
+    for width in sorted(sizes, key=int):
+        url = image.storage.url(sizes[width])
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        srcset['{0}w'.format(width)] = url
+    return srcset
+
+
+class PictureMixin(object):
+    """
+    Mixin of the models of pictures, with an ImageField "picture" and a
+    JSONField "derivatives" holding its resized copies (see
+    create_image_derivatives).
+
+    The copies are made in the background: saving a new file schedules an
+    "image_derivatives" task. Until it ran, the picture has no srcset.
+    """
+
+    def save(self, *args, **kwargs):
+        super(PictureMixin, self).save(*args, **kwargs)
+        if (self.picture and
+                self.derivatives.get('source') != self.picture.name):
+            schedule_task(
+                'image_derivatives',
+                timezone.now(),
+                unique=True,
+                model=self._meta.label,
+                pk=self.pk,
+            )
+
+    def get_srcset(self, request=None):
+        return get_image_srcset(self.picture, self.derivatives, request)
+
+    # Needed to display in the admin panel
+    def picture_tag(self):
+        # Display the smallest copy if there is one
+        url = next(iter(self.get_srcset().values()), self.picture.url)
+        return format_html(
+            '<img href="{0}" src="{1}" height="150" />'
+            .format(self.picture.url, url)
+        )
+
+    picture_tag.allow_tags = True
+    picture_tag.short_description = 'Picture'
+
+
+DIRECT_UPLOAD_SALT = 'blitz_api.direct_upload'
+
+
+def create_direct_upload(field, filename, request):
+    """
+    Prepares the upload of a file straight to the storage of a FileField,
+    without going through the API.
+
+    Returns {'url', 'fields', 'token'}. The client POSTs "fields" followed
+    by the file, as the "file" field of a multipart form, to "url". "token"
+    is then given back to the API to use the uploaded file (see
+    get_direct_upload_name).
+
+    Storages issuing presigned POST requests (S3MediaStorage) are uploaded to
+    directly. Others, such as the FileSystemStorage used in development and
+    tests, are uploaded to through the DirectUpload view that mimics them.
+    """
+    config = settings.DIRECT_UPLOADS
+    storage = field.storage
+
+    # The random directory keeps names unique without asking the storage
+    directory = field.generate_filename(None, uuid.uuid4().hex)
+    root, extension = os.path.splitext(storage.get_valid_name(filename))
+    root = root[:field.max_length - len(directory) - len(extension) - 1]
+    key = posixpath.join(directory, root + extension)
+
+    if hasattr(storage, 'get_presigned_post'):
+        upload = storage.get_presigned_post(
+            key, config['MAX_SIZE'], config['EXPIRES'],
+        )
+    else:
+        upload = {
+            'url': request.build_absolute_uri(reverse('direct_upload')),
+            'fields': {
+                'key': key,
+                'policy': signing.dumps(
+                    {'field': str(field), 'key': key},
+                    salt=DIRECT_UPLOAD_SALT + '.policy',
+                ),
+            },
+        }
+    upload['token'] = signing.dumps(
+        {'field': str(field), 'key': key}, salt=DIRECT_UPLOAD_SALT,
+    )
+
+    return upload
+
+
+def get_direct_upload_field(label):
+    """
+    Returns the FileField of a label ("app_label.ModelName.field_name") put
+    in the fields of an upload by create_direct_upload.
+    """
+    model_label, field_name = label.rsplit('.', 1)
+    return apps.get_model(model_label)._meta.get_field(field_name)
+
+
+def get_direct_upload_name(field, token):
+    """
+    Returns the name of the file uploaded with a token returned by
+    create_direct_upload, or None if the token wasn't issued for this field,
+    if it expired (see settings.DIRECT_UPLOADS), if the file wasn't uploaded
+    or if it is already used by an instance.
+    """
+    try:
+        data = signing.loads(
+            token,
+            salt=DIRECT_UPLOAD_SALT,
+            max_age=settings.DIRECT_UPLOADS['TOKEN_EXPIRES'],
+        )
+    except signing.BadSignature:
+        return None
+
+    if data['field'] != str(field) or not field.storage.exists(data['key']):
+        return None
+    # Soft-deleted instances are included by the base manager
+    if field.model._base_manager.filter(**{field.name: data['key']}).exists():
+        return None
+    return data['key']
+
+
+ANALYTICS_PERIODS = ('day', 'month')
+# Buckets that are over rarely change, unlike the current ones.
+ANALYTICS_CACHE_TIMEOUT = 60 * 60 * 24
+ANALYTICS_OPEN_BUCKET_CACHE_TIMEOUT = 60 * 5
+
+
+def get_next_bucket(bucket, period):
+    """
+    Returns the first day of the time bucket following "bucket".
+    """
+    if period == 'month':
+        return (bucket.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return bucket + timedelta(days=1)
+
+
+def get_cached_analytics(name, start_date, end_date, period, compute):
+    """
+    Returns the entries of an analytics report between two dates (included)
+    with each entry labeled by the first day of its time bucket ("period").
+
+    compute(start_time, end_time, period) must return a dict of
+    {first day of bucket: list of entries} computed for the buckets starting
+    in [start_time, end_time).
+
+    Entries are cached per bucket. Only the buckets missing from the cache
+    are computed, with a single call to "compute".
+    """
+    buckets = list()
+    bucket = start_date.replace(day=1) if period == 'month' else start_date
+    while bucket <= end_date:
+        buckets.append(bucket)
+        bucket = get_next_bucket(bucket, period)
+
+    keys = OrderedDict(
+        (bucket, 'analytics:{0}:{1}:{2}'.format(name, period, bucket))
+        for bucket in buckets
+    )
+    cached = cache.get_many(keys.values())
+
+    missing = [bucket for bucket, key in keys.items() if key not in cached]
+    if missing:
+        start_time = timezone.make_aware(
+            datetime.combine(missing[0], time.min)
+        )
+        end_time = timezone.make_aware(
+            datetime.combine(get_next_bucket(missing[-1], period), time.min)
+        )
+        computed = compute(start_time, end_time, period)
+        for bucket in missing:
+            bucket_end = timezone.make_aware(
+                datetime.combine(get_next_bucket(bucket, period), time.min)
+            )
+            cached[keys[bucket]] = computed.get(bucket, [])
+            cache.set(
+                keys[bucket],
+                cached[keys[bucket]],
+                ANALYTICS_CACHE_TIMEOUT if bucket_end <= timezone.now()
+                else ANALYTICS_OPEN_BUCKET_CACHE_TIMEOUT,
+            )
+
+    return [
+        OrderedDict(period=bucket, **entry)
+        for bucket, key in keys.items() for entry in cached[key]
+    ]
+
+
+def get_rate(count, total):
+    """
+    Returns count / total rounded to 4 decimals, or None if total is 0.
+    """
+    if not total:
+        return None
+    return round(count / total, 4)
+
+
+def schedule_task(name, execution_date, unique=False, **arguments):
+    """
+    Schedules the execution of a task (see settings.SCHEDULED_TASKS) with the
+    given keyword arguments.
+
+    If unique is True and the same task is already pending, it is returned
+    instead of scheduling a new one.
+    """
+    # Arguments are stored as JSON: sort them so equal arguments are stored,
+    # and can be looked up, as the same text.
+    arguments = OrderedDict(sorted(arguments.items()))
+    if unique:
+        task = ScheduledTask.objects.filter(
+            name=name,
+            status='P',
+            arguments=arguments,
+        ).first()
+        if task:
+            return task
+    return ScheduledTask.objects.create(
+        name=name,
+        execution_date=execution_date,
+        arguments=arguments,
+    )
+
+
+def run_scheduled_tasks():
+    """
+    Executes the pending tasks whose execution date is reached, in order.
+
+    Each task is claimed before its execution so concurrent workers never
+    run it twice. A task still running after the timeout of
+    settings.SCHEDULED_TASK_RETRIES lost its worker and is claimed again.
+
+    A failing task is retried later with an exponential backoff. Once it
+    has been attempted MAX_ATTEMPTS times, it is marked as failed, with its
+    traceback, and the admins are notified.
+
+    Returns the number of tasks executed and the number of failures.
+    """
+    config = settings.SCHEDULED_TASK_RETRIES
+    executed = failed = 0
+    now = timezone.now()
+    due_tasks = ScheduledTask.objects.filter(
+        Q(status='P', execution_date__lte=now) |
+        Q(status='R', started_at__lt=now - timedelta(
+            seconds=config['TIMEOUT']
+        ))
+    ).order_by('execution_date', 'pk')
+
+    for task in due_tasks:
+        started_at = timezone.now()
+        claimed = ScheduledTask.objects.filter(
+            pk=task.pk,
+            status=task.status,
+            started_at=task.started_at,
+        ).update(
+            status='R',
+            started_at=started_at,
+            attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            continue
+        timed_out = task.status == 'R'
+        task.status = 'R'
+        task.started_at = started_at
+        task.attempts += 1
+        # Already saved by the claim
+        task.remember_values(['status', 'started_at', 'attempts'])
+
+        if timed_out and task.attempts > config['MAX_ATTEMPTS']:
+            # The last attempt never finished
+            task.status = 'F'
+            task.error = "Timed out."
+        else:
+            try:
+                function = import_string(settings.SCHEDULED_TASKS[task.name])
+                function(**task.arguments)
+            except Exception:
+                task.error = traceback.format_exc()
+                if task.attempts < config['MAX_ATTEMPTS']:
+                    task.status = 'P'
+                    task.execution_date = timezone.now() + timedelta(
+                        seconds=config['DELAY'] * 2 ** (task.attempts - 1)
+                    )
+                else:
+                    task.status = 'F'
+            else:
+                task.status = 'D'
+
+        if task.status == 'F':
+            failed += 1
+            mail_admins(
+                "Thèsez-vous: scheduled task error",
+                "{0}\nTask:{1}\nException:\n{2}\n".format(
+                    "Scheduled task failed!",
+                    task.__dict__,
+                    task.error,
+                )
+            )
+        task.executed_at = timezone.now()
+        task.save()
+        executed += 1
+
+    return executed, failed
+
+
+def run_scheduled_tasks_event(event, context):
+    """
+    Handler of the scheduled event running the due tasks on AWS Lambda (see
+    the "events" of zappa_settings.json).
+    """
+    run_scheduled_tasks()
+
+
 def notify_user_of_new_account(email, password):
     if settings.LOCAL_SETTINGS['EMAIL_SERVICE'] is False:
         raise MailServiceError(_("Email service is disabled."))
@@ -150,6 +150,17 @@ else:
         )
     }
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/ref/settings/#caches
+# The cache has to be shared by all processes serving the API, since it holds
+# the versions of the cached responses (see blitz_api.cache).
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 # Custom user model
 
 AUTH_USER_MODEL = 'blitz_api.User'
@@ -230,6 +241,60 @@ else:
     MEDIA_ROOT = config('MEDIA_ROOT', default='media/')
     DEFAULT_FILE_STORAGE = config('DEFAULT_FILE_STORAGE', default='django.core.files.storage.FileSystemStorage')
 
+# Resized copies of uploaded pictures (see blitz_api.services)
+IMAGE_DERIVATIVES = {
+    # Widths, in pixels, of the copies. Pictures are never enlarged.
+    'WIDTHS': config('IMAGE_DERIVATIVES_WIDTHS', default='320,640,1280', cast=Csv(int)),
+    'FORMAT': 'WEBP',
+    'QUALITY': config('IMAGE_DERIVATIVES_QUALITY', default=80, cast=int),
+}
+
+# Files uploaded straight to the media storage (see blitz_api.services)
+DIRECT_UPLOADS = {
+    # Maximum size of the files, in bytes
+    'MAX_SIZE': config('DIRECT_UPLOAD_MAX_SIZE', default=20971520, cast=int),
+    # Seconds during which an upload can be started once prepared
+    'EXPIRES': 60 * 60,
+    # Seconds during which an uploaded file can be used once prepared
+    'TOKEN_EXPIRES': 60 * 60 * 24,
+}
+
+# Cached responses of the public catalog endpoints (see blitz_api.cache)
+# Responses are only cached by default with a shared CACHE_BACKEND: the local
+# memory cache isn't invalidated in the other processes.
+RESPONSE_CACHE = {
+    'TIMEOUT': config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int),
+    'ENABLED': config(
+        'RESPONSE_CACHE_ENABLED',
+        default=bool(config('CACHE_BACKEND', default='')),
+        cast=bool,
+    ),
+    # Models the cached responses depend on ("app_label.ModelName"). Saving
+    # one of them invalidates the responses depending on it, in every
+    # process, including management commands.
+    'MODELS': (
+        'blitz_api.AcademicField',
+        'blitz_api.AcademicLevel',
+        'blitz_api.Domain',
+        'blitz_api.Organization',
+        'retirement.Picture',
+        'retirement.Reservation',
+        'retirement.Retirement',
+        'store.Membership',
+        'store.OrderLine',
+        'store.Package',
+        'workplace.Period',
+        'workplace.Picture',
+        'workplace.Reservation',
+        'workplace.TimeSlot',
+        'workplace.Workplace',
+    ),
+}
+# Disable the cache during unittests, it isn't rolled back with the database.
+# Can be overriden in specific tests.
+if len(sys.argv) > 1 and sys.argv[1] == 'test':
+    RESPONSE_CACHE['ENABLED'] = False
+
 # Django Rest Framework
 
 REST_FRAMEWORK = {
@@ -334,9 +399,40 @@ PAYSAFE = {
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
 
-# External scheduler
-EXTERNAL_SCHEDULER = {
-    'URL': config('EXTERNAL_SCHEDULER_URL', default='http://example.com'),
-    'USER': config('EXTERNAL_SCHEDULER_USER', default='user'),
-    'PASSWORD': config('EXTERNAL_SCHEDULER_PASSWORD', default='password'),
+# django-simple-history (see blitz_api/history.py)
+
+HISTORY_RECORDING = {
+    # Models ("app_label.ModelName") for which no history is recorded
+    'EXCLUDE': config('HISTORY_EXCLUDE', default='', cast=Csv()),
+    # Fraction of updates recorded for a model. Creations and deletions are
+    # always recorded.
+    'SAMPLING': {
+        # Tokens are renewed on every authenticated request
+        'blitz_api.TemporaryToken': 0,
+    },
+}
+
+
+# Scheduled tasks
+# Functions called by the run_scheduled_tasks management command, by
+# ScheduledTask name.
+SCHEDULED_TASKS = {
+    'retirement_reminder': 'retirement.services.remind_retirement_users',
+    'retirement_recap': 'retirement.services.recap_retirement_users',
+    'wait_queue_notification':
+        'retirement.services.run_wait_queue_notification',
+    'refund': 'store.services.send_refund',
+    'retirement_exchange':
+        'retirement.services.run_retirement_exchange_confirmation',
+    'coupon_notification': 'store.services.send_coupon_notification',
+    'image_derivatives': 'blitz_api.services.update_image_derivatives',
+}
+SCHEDULED_TASK_RETRIES = {
+    # A failed task is retried until it has been run MAX_ATTEMPTS times,
+    # DELAY seconds after its first failure, the delay doubling each time.
+    'MAX_ATTEMPTS': config('SCHEDULED_TASK_MAX_ATTEMPTS', default=8, cast=int),
+    'DELAY': 15 * 60,
+    # Seconds after which a running task is considered dead (its worker
+    # timed out or crashed) and is run again.
+    'TIMEOUT': 30 * 60,
 }
@@ -12,6 +12,18 @@ class S3MediaStorage(S3Boto3Storage):
     custom_domain = settings.AWS_S3_MEDIA_CUSTOM_DOMAIN
     file_overwrite = False
 
+    def get_presigned_post(self, name, max_size, expires_in):
+        """
+        Returns the URL and form fields letting a client POST a file of at
+        most max_size bytes straight to the bucket, under the given name.
+        """
+        return self.connection.meta.client.generate_presigned_post(
+            self.bucket_name,
+            self._normalize_name(self._clean_name(name)),
+            Conditions=[['content-length-range', 0, max_size]],
+            ExpiresIn=expires_in,
+        )
+
 
 class S3StaticStorage(S3Boto3Storage):
     """
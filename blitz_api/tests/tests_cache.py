@@ -0,0 +1,200 @@
+import json
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from store.models import Membership
+
+from ..cache import CachedResponseMixin, invalidate_cached_responses
+from ..factories import AdminFactory, UserFactory
+from ..models import AcademicLevel, Organization
+
+
+@override_settings(
+    RESPONSE_CACHE=dict(settings.RESPONSE_CACHE, ENABLED=True),
+    ALLOWED_HOSTS=['testserver', 'otherserver'],
+)
+class CachedResponseTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.admin = AdminFactory()
+        self.organization = Organization.objects.create(
+            name_en="organization",
+            name_fr="organisation",
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def get_organizations(self, **extra):
+        return self.client.get(reverse('organization-list'), **extra)
+
+    def test_cached_response(self):
+        """
+        Ensure that a response is served from the cache without querying the
+        database, with the same content as the first one.
+        """
+        response = self.get_organizations()
+
+        with self.assertNumQueries(0):
+            cached_response = self.get_organizations()
+
+        self.assertEqual(cached_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertIn('Last-Modified', cached_response)
+
+    def test_invalidated_on_save(self):
+        """
+        Ensure that the cached responses are replaced when an instance of
+        their models is saved.
+        """
+        self.get_organizations()
+
+        self.organization.name = "renamed organization"
+        self.organization.save()
+
+        response = self.get_organizations()
+
+        self.assertEqual(
+            json.loads(response.content)['results'][0]['name'],
+            "renamed organization",
+        )
+
+    def test_invalidated_on_m2m_change(self):
+        """
+        Ensure that the cached responses are replaced when a many-to-many
+        relation of their models changes.
+        """
+        membership = Membership.objects.create(
+            name="membership",
+            price=50,
+            duration=timedelta(days=365),
+            available=True,
+        )
+        url = reverse('membership-detail', args=[membership.id])
+
+        self.client.get(url)
+
+        membership.academic_levels.add(
+            AcademicLevel.objects.create(name="university")
+        )
+
+        response = self.client.get(url)
+
+        self.assertEqual(len(json.loads(response.content)['academic_levels']),
+                         1)
+
+    def test_invalidated_explicitly(self):
+        """
+        Ensure that the cached responses are replaced after a queryset update
+        once invalidated.
+        """
+        self.get_organizations()
+
+        Organization.objects.update(name="renamed organization")
+        invalidate_cached_responses(Organization)
+
+        response = self.get_organizations()
+
+        self.assertEqual(
+            json.loads(response.content)['results'][0]['name'],
+            "renamed organization",
+        )
+
+    def test_cached_models_declared(self):
+        """
+        Ensure that the models of every cached viewset are declared in the
+        settings, so they are invalidated outside of the API too.
+        """
+        def get_subclasses(cls):
+            for subclass in cls.__subclasses__():
+                yield subclass
+                yield from get_subclasses(subclass)
+
+        # Imports every viewset
+        import_module(settings.ROOT_URLCONF)
+
+        viewsets = list(get_subclasses(CachedResponseMixin))
+
+        self.assertTrue(viewsets)
+
+        for viewset in viewsets:
+            self.assertLessEqual(
+                set(viewset.cache_models),
+                set(settings.RESPONSE_CACHE['MODELS']),
+                viewset,
+            )
+
+    def test_host_responses(self):
+        """
+        Ensure that responses aren't shared between hosts, since they
+        contain absolute URLs.
+        """
+        self.get_organizations()
+
+        response = self.get_organizations(SERVER_NAME='otherserver')
+
+        self.assertEqual(
+            json.loads(response.content)['results'][0]['url'],
+            'http://otherserver/organizations/{0}'.format(
+                self.organization.id,
+            ),
+        )
+
+    def test_not_modified(self):
+        """
+        Ensure that an unchanged response can be revalidated with its ETag.
+        """
+        etag = self.get_organizations()['ETag']
+
+        response = self.get_organizations(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        Organization.objects.create(name="other organization")
+
+        response = self.get_organizations(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_staff_responses(self):
+        """
+        Ensure that admins and other users don't share cached responses.
+        """
+        self.get_organizations()
+
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.get_organizations()
+
+        self.assertEqual(
+            json.loads(response.content)['results'][0]['name_fr'],
+            "organisation",
+        )
+
+        self.client.force_authenticate(user=self.user)
+
+        response = self.get_organizations()
+
+        self.assertNotIn('name_fr', json.loads(response.content)['results'][0])
+
+    def test_error_not_cached(self):
+        """
+        Ensure that error responses aren't cached.
+        """
+        url = reverse('organization-detail', args=[self.organization.id + 1])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
@@ -0,0 +1,119 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework.test import APITestCase
+
+from .. import history
+from ..factories import UserFactory
+from ..models import Organization, TemporaryToken
+
+
+class BufferedHistoryTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+
+    def test_atomic_bulk_insert(self):
+        """
+        Ensure that historical rows created in a history.atomic() block are
+        written with a single query when the block exits.
+        """
+        history_count = self.user.history.count()
+
+        with CaptureQueriesContext(connection) as queries:
+            with history.atomic():
+                for i in range(5):
+                    self.user.first_name = 'name{0}'.format(i)
+                    self.user.save()
+                    Organization.objects.create(name='org{0}'.format(i))
+                self.assertEqual(self.user.history.count(), history_count)
+
+        self.assertEqual(self.user.history.count(), history_count + 5)
+        self.assertEqual(Organization.history.count(), 5)
+
+        history_inserts = [
+            q for q in queries
+            if q['sql'].startswith('INSERT') and 'historical' in q['sql']
+        ]
+        self.assertEqual(len(history_inserts), 2)
+
+    def test_atomic_rollback(self):
+        """
+        Ensure that nothing is written if the block is rolled back, including
+        the rows of a nested block.
+        """
+        history_count = self.user.history.count()
+
+        with history.atomic():
+            try:
+                with history.atomic():
+                    self.user.first_name = 'rolled back'
+                    self.user.save()
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.user.first_name = 'kept'
+            self.user.save()
+
+        self.assertEqual(self.user.history.count(), history_count + 1)
+        self.assertEqual(self.user.history.first().first_name, 'kept')
+
+        try:
+            with history.atomic():
+                Organization.objects.create(name='org')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(Organization.history.count(), 0)
+
+    def test_atomic_decorator_reentered(self):
+        """
+        Ensure that a decorated function can call itself: the rows of a
+        rolled back inner call are forgotten and the others are written
+        when the outermost call exits.
+        """
+        @history.atomic()
+        def create(names):
+            Organization.objects.create(name=names[0])
+            if len(names) > 1:
+                try:
+                    create(names[1:])
+                except ValueError:
+                    pass
+            if names[0] == 'rolled back':
+                raise ValueError()
+
+        create(['org1', 'org2', 'rolled back'])
+
+        self.assertEqual(
+            sorted(Organization.history.values_list('name', flat=True)),
+            ['org1', 'org2'],
+        )
+        self.assertEqual(
+            sorted(Organization.objects.values_list('name', flat=True)),
+            ['org1', 'org2'],
+        )
+
+    @override_settings(HISTORY_RECORDING={'EXCLUDE': ['blitz_api.User']})
+    def test_exclude(self):
+        """
+        Ensure that no history is recorded for excluded models.
+        """
+        history_count = self.user.history.count()
+
+        self.user.save()
+        UserFactory()
+
+        self.assertEqual(self.user.history.count(), history_count)
+
+    def test_sampling(self):
+        """
+        Ensure that updates of a model sampled at 0 are not recorded, while
+        its creation is.
+        """
+        token = TemporaryToken.objects.create(user=self.user)
+        token.save()
+
+        self.assertEqual(token.history.count(), 1)
+        self.assertEqual(token.history.first().history_type, '+')
@@ -0,0 +1,591 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from rest_framework.test import APITestCase
+
+from retirement.models import Picture
+from store.models import Membership, Order, OrderLine, Package
+
+from ..factories import AdminFactory, UserFactory
+from ..models import Organization, ScheduledTask, TicketTransaction, User
+from ..serializers import OrganizationSerializer
+from ..services import (adjust_tickets, bulk_credit_tickets,
+                        create_image_derivatives, get_image_srcset,
+                        get_translation_field_names,
+                        prefetch_generic_objects, run_scheduled_tasks,
+                        save_fields, schedule_task)
+
+
+class TicketServicesTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+
+    def test_adjust_tickets_credit(self):
+        """
+        Ensure that tickets are added to the balance and logged.
+        """
+        self.assertTrue(adjust_tickets(self.user, 3, 'package_purchase'))
+
+        self.assertEqual(self.user.tickets, 4)
+        self.assertEqual(User.objects.get(pk=self.user.pk).tickets, 4)
+
+        transaction = TicketTransaction.objects.get(user=self.user)
+        self.assertEqual(transaction.amount, 3)
+        self.assertEqual(transaction.reason, 'package_purchase')
+
+    def test_adjust_tickets_debit(self):
+        """
+        Ensure that tickets are removed from the balance and logged.
+        """
+        self.assertTrue(adjust_tickets(self.user, -1, 'timeslot_reservation'))
+
+        self.assertEqual(self.user.tickets, 0)
+        self.assertEqual(
+            TicketTransaction.objects.get(user=self.user).amount,
+            -1,
+        )
+
+    def test_adjust_tickets_insufficient_balance(self):
+        """
+        Ensure that a debit is refused if the balance doesn't cover it.
+        """
+        self.assertFalse(adjust_tickets(self.user, -2, 'timeslot_reservation'))
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).tickets, 1)
+        self.assertFalse(
+            TicketTransaction.objects.filter(user=self.user).exists()
+        )
+
+    def test_save_keeps_balance(self):
+        """
+        Ensure that saving a user doesn't overwrite a balance changed since
+        the user was loaded.
+        """
+        stale_user = User.objects.get(pk=self.user.pk)
+        adjust_tickets(self.user, 3, 'package_purchase')
+
+        stale_user.first_name = 'renamed'
+        stale_user.save()
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.tickets, 4)
+        self.assertEqual(user.first_name, 'renamed')
+
+    def test_save_tickets(self):
+        """
+        Ensure that a ticket balance can't be written with save().
+        """
+        self.user.tickets = 10
+
+        with self.assertRaises(ValueError):
+            self.user.save()
+
+        with self.assertRaises(ValueError):
+            self.user.save(update_fields=['tickets'])
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).tickets, 1)
+
+    def test_bulk_credit_tickets(self):
+        """
+        Ensure that tickets are added to the balance of many users at once
+        and that each user gets a ledger entry.
+        """
+        bulk_credit_tickets(
+            {self.user.id: 2, self.user2.id: 1},
+            'period_deleted',
+        )
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).tickets, 3)
+        self.assertEqual(User.objects.get(pk=self.user2.pk).tickets, 2)
+        self.assertEqual(
+            TicketTransaction.objects.filter(reason='period_deleted').count(),
+            2,
+        )
+
+
+class SaveFieldsTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+
+    def test_save_fields(self):
+        """
+        Ensure that only the given fields are written and that the query is
+        smaller than the one of a full save.
+        """
+        all_fields = [
+            field.name for field in User._meta.concrete_fields
+            if not field.primary_key and field.name != 'tickets'
+        ]
+        with CaptureQueriesContext(connection) as full_save:
+            self.user.save(update_fields=all_fields)
+        with CaptureQueriesContext(connection) as partial_save:
+            save_fields(self.user, 'is_active')
+
+        full_update = [
+            q['sql'] for q in full_save if q['sql'].startswith('UPDATE')
+        ][0]
+        partial_update = [
+            q['sql'] for q in partial_save if q['sql'].startswith('UPDATE')
+        ][0]
+
+        self.assertNotIn('"first_name"', partial_update)
+        self.assertLess(len(partial_update), len(full_update) / 5)
+
+    def test_save_fields_without_history(self):
+        """
+        Ensure that no history entry is created if history is disabled.
+        """
+        history_count = self.user.history.count()
+
+        self.user.city = 'Sherbrooke'
+        save_fields(self.user, 'city', history=False)
+
+        self.assertEqual(self.user.history.count(), history_count)
+        self.assertEqual(User.objects.get(pk=self.user.pk).city, 'Sherbrooke')
+
+        save_fields(self.user, 'city')
+
+        self.assertEqual(self.user.history.count(), history_count + 1)
+
+    def test_save_dirty_fields(self):
+        """
+        Ensure that save() only writes the fields changed since the instance
+        was loaded, and nothing if no field changed.
+        """
+        task = ScheduledTask.objects.get(
+            pk=schedule_task('refund', timezone.now(), refund_id=1).pk,
+        )
+
+        with self.assertNumQueries(0):
+            task.save()
+
+        task.status = 'D'
+
+        with CaptureQueriesContext(connection) as queries:
+            task.save()
+
+        update = [
+            q['sql'] for q in queries if q['sql'].startswith('UPDATE')
+        ][0]
+
+        self.assertIn('"status"', update)
+        self.assertNotIn('"arguments"', update)
+        self.assertEqual(ScheduledTask.objects.get(pk=task.pk).status, 'D')
+
+        with self.assertNumQueries(0):
+            task.save()
+
+    def test_save_fields_changed(self):
+        """
+        Ensure that the changed fields are saved if no field is given.
+        """
+        self.user.city = 'Sherbrooke'
+        save_fields(self.user, history=False)
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).city, 'Sherbrooke')
+
+    @override_settings(DEBUG=True)
+    def test_save_fields_unlisted(self):
+        """
+        Ensure that changed fields left out of save_fields are reported in
+        DEBUG.
+        """
+        self.user.city = 'Sherbrooke'
+        self.user.is_active = False
+
+        with self.assertRaises(AssertionError):
+            save_fields(self.user, 'is_active')
+
+
+class TranslatedSerializerTests(APITestCase):
+
+    def setUp(self):
+        self.organizations = [
+            Organization.objects.create(
+                name_en="organization{0}".format(i),
+                name_fr="organisation{0}".format(i),
+            ) for i in range(2)
+        ]
+        OrganizationSerializer._omitted_fields.clear()
+
+    def serialize(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return OrganizationSerializer(
+            self.organizations,
+            many=True,
+            context={'request': request},
+        ).data
+
+    def test_get_translation_field_names(self):
+        """
+        Ensure that the translation fields of a model are found.
+        """
+        self.assertEqual(
+            get_translation_field_names(Organization),
+            {'name_en', 'name_fr'},
+        )
+        self.assertEqual(get_translation_field_names(ScheduledTask), set())
+
+    def test_translation_fields_omitted(self):
+        """
+        Ensure that translation fields are only represented for staff users,
+        and that the omitted fields are computed once per serializer class.
+        """
+        with mock.patch(
+            'blitz_api.services.get_translation_field_names',
+            wraps=get_translation_field_names,
+        ) as get_names:
+            self.serialize(UserFactory())
+            data = self.serialize(UserFactory())
+
+        get_names.assert_called_once_with(Organization)
+
+        for organization in data:
+            self.assertNotIn('name_en', organization)
+            self.assertNotIn('name_fr', organization)
+        self.assertEqual(data[0]['name'], 'organization0')
+
+        data = self.serialize(AdminFactory())
+
+        self.assertEqual(data[0]['name_fr'], 'organisation0')
+
+
+class PrefetchGenericObjectsTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.order = Order.objects.create(
+            user=self.user,
+            transaction_date=timezone.now(),
+            authorization_id=1,
+            settlement_id=1,
+        )
+        self.packages = [
+            Package.objects.create(
+                name="package{0}".format(i),
+                price=40,
+                reservations=10,
+                available=True,
+            ) for i in range(3)
+        ]
+        self.membership = Membership.objects.create(
+            name="basic_membership",
+            price=50,
+            duration=timedelta(days=365),
+            available=True,
+        )
+        for package in self.packages:
+            OrderLine.objects.create(
+                order=self.order,
+                quantity=1,
+                content_type=ContentType.objects.get_for_model(Package),
+                object_id=package.id,
+            )
+        OrderLine.objects.create(
+            order=self.order,
+            quantity=1,
+            content_type=ContentType.objects.get_for_model(Membership),
+            object_id=self.membership.id,
+        )
+
+    def test_prefetch_generic_objects(self):
+        """
+        Ensure that referenced objects are fetched with one query per content
+        type and cached on the instances.
+        """
+        order_lines = OrderLine.objects.filter(
+            order=self.order,
+        ).order_by('pk')
+
+        with self.assertNumQueries(3):
+            order_lines = prefetch_generic_objects(order_lines)
+
+        with self.assertNumQueries(0):
+            names = [
+                order_line.content_object.name for order_line in order_lines
+            ]
+
+        self.assertEqual(
+            names,
+            ['package0', 'package1', 'package2', 'basic_membership'],
+        )
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    IMAGE_DERIVATIVES={'WIDTHS': [640, 320, 1280], 'FORMAT': 'WEBP',
+                       'QUALITY': 80},
+)
+class ImageDerivativesTests(APITestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def save_image(self, size, mode='RGB'):
+        content = BytesIO()
+        Image.new(mode, size).save(content, 'PNG')
+        storage = FileSystemStorage()
+        name = storage.save('pictures/picture.png', ContentFile(
+            content.getvalue()
+        ))
+        return Picture(picture=name).picture
+
+    def test_create_image_derivatives(self):
+        """
+        Ensure that a copy is created for each width smaller than the
+        picture, and that their URLs are listed from the smallest.
+        """
+        image = self.save_image((1000, 500), mode='P')
+
+        derivatives = create_image_derivatives(image)
+
+        self.assertEqual(derivatives['source'], image.name)
+        self.assertEqual(sorted(derivatives['sizes']), ['320', '640'])
+
+        with image.storage.open(derivatives['sizes']['320']) as f:
+            derivative = Image.open(f)
+            self.assertEqual(derivative.format, 'WEBP')
+            self.assertEqual(derivative.size, (320, 160))
+
+        self.assertEqual(
+            list(get_image_srcset(image, derivatives).items()),
+            [
+                ('320w', image.storage.url(derivatives['sizes']['320'])),
+                ('640w', image.storage.url(derivatives['sizes']['640'])),
+            ]
+        )
+
+    def test_create_image_derivatives_small_image(self):
+        """
+        Ensure that a picture smaller than all widths is only recompressed.
+        """
+        image = self.save_image((200, 100))
+
+        derivatives = create_image_derivatives(image)
+
+        self.assertEqual(list(derivatives['sizes']), ['200'])
+
+    def test_create_image_derivatives_invalid_image(self):
+        """
+        Ensure that no copy is created if the file isn't an image.
+        """
+        name = FileSystemStorage().save(
+            'pictures/picture.png', ContentFile(b'invalid'),
+        )
+        image = Picture(picture=name).picture
+
+        self.assertEqual(
+            create_image_derivatives(image),
+            {'source': name, 'sizes': {}},
+        )
+
+    def test_get_image_srcset_outdated(self):
+        """
+        Ensure that copies of another file than the current one are ignored.
+        """
+        image = self.save_image((1000, 500))
+        derivatives = create_image_derivatives(image)
+        derivatives['source'] = 'pictures/other.png'
+
+        self.assertEqual(get_image_srcset(image, derivatives), {})
+
+    def test_picture_derivatives_task(self):
+        """
+        Ensure that saving a picture with a new file schedules the creation
+        of its copies, once.
+        """
+        image = self.save_image((1000, 500))
+
+        picture = Picture.objects.create(name="picture", picture=image.name)
+        picture.name = "renamed"
+        picture.save()
+
+        task = ScheduledTask.objects.get()
+
+        self.assertEqual(task.name, 'image_derivatives')
+        self.assertEqual(
+            task.arguments,
+            {'model': 'retirement.Picture', 'pk': picture.pk},
+        )
+        self.assertEqual(picture.get_srcset(), {})
+
+        run_scheduled_tasks()
+        picture.refresh_from_db()
+
+        self.assertEqual(list(picture.get_srcset()), ['320w', '640w'])
+
+        picture.save()
+
+        self.assertFalse(ScheduledTask.objects.filter(status='P').exists())
+
+
+@override_settings(
+    SCHEDULED_TASKS={
+        'retirement_reminder': 'blitz_api.tests.tests_services.task',
+        'retirement_recap': 'blitz_api.tests.tests_services.failing_task',
+    },
+    SCHEDULED_TASK_RETRIES={'MAX_ATTEMPTS': 2, 'DELAY': 60, 'TIMEOUT': 600},
+    ADMINS=[('admin', 'admin@example.com')],
+)
+class ScheduledTaskTests(APITestCase):
+
+    def setUp(self):
+        task.reset_mock()
+
+    def test_schedule_task_unique(self):
+        """
+        Ensure that a pending task isn't scheduled twice if it is unique.
+        """
+        first = schedule_task(
+            'retirement_reminder', timezone.now(), unique=True,
+            retirement_id=1,
+        )
+        second = schedule_task(
+            'retirement_reminder', timezone.now(), unique=True,
+            retirement_id=1,
+        )
+        other = schedule_task(
+            'retirement_reminder', timezone.now(), unique=True,
+            retirement_id=2,
+        )
+        many = schedule_task(
+            'retirement_reminder', timezone.now(), unique=True,
+            retirement_id=1, user_id=1,
+        )
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(
+            schedule_task(
+                'retirement_reminder', timezone.now(), unique=True,
+                user_id=1, retirement_id=1,
+            ),
+            many,
+        )
+        self.assertEqual(ScheduledTask.objects.count(), 3)
+
+    def test_run_scheduled_tasks(self):
+        """
+        Ensure that only due tasks are executed, once, and that failures are
+        retried later, then recorded and reported to admins.
+        """
+        due = schedule_task(
+            'retirement_reminder',
+            timezone.now() - timedelta(minutes=1),
+            retirement_id=1,
+        )
+        failing = schedule_task(
+            'retirement_recap',
+            timezone.now() - timedelta(minutes=1),
+            retirement_id=1,
+        )
+        later = schedule_task(
+            'retirement_reminder',
+            timezone.now() + timedelta(days=1),
+            retirement_id=2,
+        )
+
+        self.assertEqual(run_scheduled_tasks(), (2, 0))
+        self.assertEqual(run_scheduled_tasks(), (0, 0))
+
+        task.assert_called_once_with(retirement_id=1)
+
+        due.refresh_from_db()
+        failing.refresh_from_db()
+        later.refresh_from_db()
+
+        self.assertEqual(due.status, 'D')
+        self.assertIsNotNone(due.executed_at)
+        self.assertEqual(failing.status, 'P')
+        self.assertEqual(failing.attempts, 1)
+        self.assertGreater(failing.execution_date, timezone.now())
+        self.assertIn('ValueError', failing.error)
+        self.assertEqual(later.status, 'P')
+        self.assertEqual(len(mail.outbox), 0)
+
+        ScheduledTask.objects.filter(pk=failing.pk).update(
+            execution_date=timezone.now(),
+        )
+
+        self.assertEqual(run_scheduled_tasks(), (1, 1))
+
+        failing.refresh_from_db()
+
+        self.assertEqual(failing.status, 'F')
+        self.assertEqual(failing.attempts, 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_run_scheduled_tasks_timed_out(self):
+        """
+        Ensure that a task whose worker died is run again, unless it was its
+        last attempt.
+        """
+        started_at = timezone.now() - timedelta(minutes=20)
+        dead = ScheduledTask.objects.create(
+            name='retirement_reminder',
+            execution_date=started_at,
+            arguments={'retirement_id': 1},
+            status='R',
+            started_at=started_at,
+            attempts=1,
+        )
+        last = ScheduledTask.objects.create(
+            name='retirement_reminder',
+            execution_date=started_at,
+            arguments={'retirement_id': 2},
+            status='R',
+            started_at=started_at,
+            attempts=2,
+        )
+        running = ScheduledTask.objects.create(
+            name='retirement_reminder',
+            execution_date=started_at,
+            arguments={'retirement_id': 3},
+            status='R',
+            started_at=timezone.now(),
+            attempts=1,
+        )
+
+        self.assertEqual(run_scheduled_tasks(), (2, 1))
+
+        task.assert_called_once_with(retirement_id=1)
+
+        dead.refresh_from_db()
+        last.refresh_from_db()
+        running.refresh_from_db()
+
+        self.assertEqual(dead.status, 'D')
+        self.assertEqual(last.status, 'F')
+        self.assertEqual(last.error, 'Timed out.')
+        self.assertEqual(running.status, 'R')
+
+
+task = mock.Mock()
+
+
+def failing_task(**kwargs):
+    raise ValueError()
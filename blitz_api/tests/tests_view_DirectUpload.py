@@ -0,0 +1,91 @@
+import json
+import shutil
+import tempfile
+
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from workplace.models import Picture
+
+from ..services import create_direct_upload
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    DIRECT_UPLOADS={'MAX_SIZE': 10, 'EXPIRES': 60, 'TOKEN_EXPIRES': 600},
+)
+class DirectUploadTests(APITestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.upload = create_direct_upload(
+            Picture._meta.get_field('picture'),
+            'picture.png',
+            RequestFactory().get('/'),
+        )
+
+    def test_upload(self):
+        """
+        Ensure we can store a file with the fields of a prepared upload.
+        """
+        data = dict(
+            self.upload['fields'],
+            file=SimpleUploadedFile('picture.png', b'0123456789'),
+        )
+
+        response = self.client.post(reverse('direct_upload'), data)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        storage = Picture._meta.get_field('picture').storage
+        self.assertTrue(storage.exists(self.upload['fields']['key']))
+
+    def test_upload_invalid_policy(self):
+        """
+        Ensure we can't store a file under another name than the one of the
+        prepared upload.
+        """
+        data = dict(
+            self.upload['fields'],
+            key='workplaces/other.png',
+            file=SimpleUploadedFile('picture.png', b'0123456789'),
+        )
+
+        response = self.client.post(reverse('direct_upload'), data)
+
+        content = {'policy': ['Invalid or expired upload policy.']}
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        storage = Picture._meta.get_field('picture').storage
+        self.assertFalse(storage.exists('workplaces/other.png'))
+
+    def test_upload_too_large(self):
+        """
+        Ensure we can't store a file larger than the maximum size.
+        """
+        data = dict(
+            self.upload['fields'],
+            file=SimpleUploadedFile('picture.png', b'01234567890'),
+        )
+
+        response = self.client.post(reverse('direct_upload'), data)
+
+        content = {'file': ['The file is too large.']}
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -944,3 +944,66 @@ class UsersIdTests(APITestCase):
         self.assertEqual(
             response.status_code, status.HTTP_204_NO_CONTENT
         )
+
+    def test_adjust_tickets(self):
+        """
+        Ensure that an admin can change the ticket balance of a user.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse(
+                'user-tickets',
+                kwargs={'pk': self.user.id},
+            ),
+            {'amount': 2},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {'tickets': 3})
+
+        transaction = models.TicketTransaction.objects.get(user=self.user)
+        self.assertEqual(transaction.amount, 2)
+        self.assertEqual(transaction.reason, 'admin_adjustment')
+
+    def test_adjust_tickets_not_enough(self):
+        """
+        Ensure that an admin can't remove more tickets than the user has.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse(
+                'user-tickets',
+                kwargs={'pk': self.user.id},
+            ),
+            {'amount': -2},
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.tickets, 1)
+        self.assertFalse(
+            models.TicketTransaction.objects.filter(user=self.user).exists()
+        )
+
+    def test_adjust_tickets_without_permission(self):
+        """
+        Ensure that a user can't change his own ticket balance.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(
+            reverse(
+                'user-tickets',
+                kwargs={'pk': self.user.id},
+            ),
+            {'amount': 2},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -1,6 +1,8 @@
 import simple_history
 from modeltranslation.translator import TranslationOptions, register
 
+from .history import BufferedHistoricalRecords
+
 from . import models
 
 
@@ -19,6 +21,12 @@ class OrganizationTranslationOptions(TranslationOptions):
     fields = ('name', )
 
 
-simple_history.register(models.AcademicLevel, inherit=True)
-simple_history.register(models.AcademicField, inherit=True)
-simple_history.register(models.Organization, inherit=True)
+simple_history.register(
+    models.AcademicLevel, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.AcademicField, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.Organization, inherit=True, records_class=BufferedHistoricalRecords
+)
@@ -87,6 +87,11 @@ urlpatterns = [
         views.ChangePassword.as_view(),
         name='change_password'
     ),
+    path(
+        'direct_upload',
+        views.DirectUpload.as_view(),
+        name='direct_upload'
+    ),
     path(
         'admin/', admin.site.urls
     ),
@@ -11,19 +11,21 @@ from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import status, viewsets, mixins, filters
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 
+from .cache import CachedResponseMixin
 from .models import (
     TemporaryToken, ActionToken, Domain, Organization, AcademicLevel,
     AcademicField,
 )
 from .resources import (AcademicFieldResource, AcademicLevelResource,
                         OrganizationResource, UserResource)
-from .services import ExportPagination
+from .services import ExportPagination, save_fields
 from . import serializers, permissions, services
 
 User = get_user_model()
@@ -92,6 +94,29 @@ class UserViewSet(viewsets.ModelViewSet):
         ])
         return response
 
+    @action(detail=True, methods=['post'])
+    def tickets(self, request, pk=None):
+        """
+        Adds tickets to the balance of the user, or removes them with a
+        negative amount, through the ticket ledger.
+        """
+        user = self.get_object()
+        serializer = serializers.TicketAdjustmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        adjusted = services.adjust_tickets(
+            user,
+            serializer.validated_data['amount'],
+            'admin_adjustment',
+        )
+        if not adjusted:
+            return Response(
+                {'amount': [_("The user doesn't have enough tickets.")]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return Response({'tickets': user.tickets})
+
     def get_serializer_class(self):
         if (self.action == 'update') | (self.action == 'partial_update'):
             return serializers.UserUpdateSerializer
@@ -110,7 +135,7 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         if self.action == 'create':
             permission_classes = []
-        elif self.action == 'list':
+        elif self.action in ('list', 'tickets'):
             permission_classes = [IsAdminUser, ]
         else:
             permission_classes = [
@@ -246,7 +271,7 @@ class UsersActivation(APIView):
             token.expires = timezone.now() + timezone.timedelta(
                 minutes=CONFIG['MINUTES']
             )
-            token.save()
+            save_fields(token, history=False)
 
             # We return the user
             serializer = serializers.UserSerializer(
@@ -303,7 +328,7 @@ class UsersActivation(APIView):
             token.expires = timezone.now() + timezone.timedelta(
                 minutes=CONFIG['MINUTES']
             )
-            token.save()
+            save_fields(token, history=False)
 
             # We return the user
             serializer = serializers.UserSerializer(
@@ -443,7 +468,30 @@ class ChangePassword(APIView):
             )
 
 
-class DomainViewSet(viewsets.ModelViewSet):
+class DirectUpload(APIView):
+    """
+    post:
+    Store a file in the media storage, with the fields returned when its
+    upload was prepared. Stand-in for presigned S3 uploads when files are
+    stored on the filesystem (see blitz_api.services.create_direct_upload).
+    """
+    permission_classes = ()
+    authentication_classes = ()
+    parser_classes = (MultiPartParser, )
+
+    def post(self, request, *args, **kwargs):
+        serializer = serializers.DirectUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        serializer.validated_data['field'].storage.save(
+            serializer.validated_data['key'],
+            serializer.validated_data['file'],
+        )
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DomainViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given domain.
@@ -457,10 +505,13 @@ class DomainViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.DomainSerializer
     queryset = Domain.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'blitz_api.Domain',
+    )
     ordering = ('name',)
 
 
-class OrganizationViewSet(viewsets.ModelViewSet):
+class OrganizationViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given organization.
@@ -474,6 +525,10 @@ class OrganizationViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.OrganizationSerializer
     queryset = Organization.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'blitz_api.Organization',
+        'blitz_api.Domain',
+    )
     ordering = ('name',)
 
     @action(detail=False, permission_classes=[IsAdminUser])
@@ -550,7 +605,7 @@ class TemporaryTokenDestroy(viewsets.GenericViewSet, mixins.DestroyModelMixin):
         return tokens
 
 
-class AcademicLevelViewSet(viewsets.ModelViewSet):
+class AcademicLevelViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given academic level.
@@ -564,6 +619,9 @@ class AcademicLevelViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.AcademicLevelSerializer
     queryset = AcademicLevel.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'blitz_api.AcademicLevel',
+    )
     ordering = ('name',)
 
     @action(detail=False, permission_classes=[IsAdminUser])
@@ -587,7 +645,7 @@ class AcademicLevelViewSet(viewsets.ModelViewSet):
         return response
 
 
-class AcademicFieldViewSet(viewsets.ModelViewSet):
+class AcademicFieldViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given academic field.
@@ -601,6 +659,9 @@ class AcademicFieldViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.AcademicFieldSerializer
     queryset = AcademicField.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'blitz_api.AcademicField',
+    )
     ordering = ('name',)
 
     @action(detail=False, permission_classes=[IsAdminUser])
@@ -0,0 +1,17 @@
+# Generated by Django 2.0.8 on 2026-10-18 22:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('retirement', '0009_reservation_orderline_allow_null'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='waitqueue',
+            index_together={('retirement', 'created_at')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.8 on 2026-10-18 21:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('retirement', '0010_waitqueue_position_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalreservation',
+            name='recap_sent',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Recap sent'),
+        ),
+        migrations.AddField(
+            model_name='historicalreservation',
+            name='reminder_sent',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Reminder sent'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='recap_sent',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Recap sent'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='reminder_sent',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Reminder sent'),
+        ),
+    ]
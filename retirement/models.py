@@ -1,18 +1,20 @@
 from datetime import timedelta
 
-from blitz_api.models import Address
+from blitz_api.models import Address, DirtyFieldsMixin
+from blitz_api.services import PictureMixin
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.utils.html import format_html
+from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
+from jsonfield import JSONField
 from safedelete.models import SafeDeleteModel
-from simple_history.models import HistoricalRecords
+from blitz_api.history import BufferedHistoricalRecords
 from store.models import Membership, OrderLine
 
 User = get_user_model()
 
 
-class Retirement(Address, SafeDeleteModel):
+class Retirement(DirtyFieldsMixin, Address, SafeDeleteModel):
     """Represents a retirement physical place."""
 
     ACTIVITY_LANGUAGE = (
@@ -155,7 +157,7 @@ class Retirement(Address, SafeDeleteModel):
         return self.name
 
 
-class Picture(models.Model):
+class Picture(PictureMixin, DirtyFieldsMixin, models.Model):
     """Represents pictures representing a retirement place"""
 
     class Meta:
@@ -178,13 +180,13 @@ class Picture(models.Model):
 
     picture = models.ImageField(_('picture'), upload_to='retirements')
 
-    # Needed to display in the admin panel
-    def picture_tag(self):
-        return format_html('<img href="{0}" src="{0}" height="150" />'.format(
-            self.picture.url))
-
-    picture_tag.allow_tags = True
-    picture_tag.short_description = 'Picture'
+    # Resized copies of the picture, see blitz_api.services.PictureMixin
+    derivatives = JSONField(
+        verbose_name=_("Derivatives"),
+        blank=True,
+        default=dict,
+        editable=False,
+    )
 
     # History is registered in translation.py
     # history = HistoricalRecords()
@@ -193,7 +195,7 @@ class Picture(models.Model):
         return self.name
 
 
-class Reservation(SafeDeleteModel):
+class Reservation(DirtyFieldsMixin, SafeDeleteModel):
     """Represents a user registration to a Retirement"""
 
     CANCELATION_REASON = (
@@ -259,8 +261,20 @@ class Reservation(SafeDeleteModel):
         verbose_name=_("Exchangeable"),
         default=True,
     )
+    # Set when the reminder and recap emails of the retirement are sent to
+    # the user, so those emails are never sent twice
+    reminder_sent = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name=_("Reminder sent"),
+    )
+    recap_sent = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name=_("Recap sent"),
+    )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return str(self.user)
@@ -279,6 +293,7 @@ class WaitQueue(models.Model):
         verbose_name = _("Waiting queue")
         verbose_name_plural = _("Waiting queues")
         unique_together = ('user', 'retirement')
+        index_together = ('retirement', 'created_at')
 
     user = models.ForeignKey(
         User,
@@ -296,11 +311,24 @@ class WaitQueue(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return ', '.join([str(self.retirement), str(self.user)])
 
+    @property
+    def position(self):
+        """
+        Index of the element in the wait queue of its retirement, ordered by
+        ascending date.
+        """
+        return WaitQueue.objects.filter(
+            retirement_id=self.retirement_id,
+        ).filter(
+            Q(created_at__lt=self.created_at) |
+            Q(created_at=self.created_at, pk__lt=self.pk)
+        ).count()
+
 
 class WaitQueueNotification(models.Model):
     """
@@ -329,7 +357,7 @@ class WaitQueueNotification(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return ', '.join(
@@ -1,16 +1,10 @@
 from copy import copy
 from datetime import timedelta
 from decimal import Decimal, DecimalException
-import json
-import requests
-import traceback
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
-from django.core.mail import mail_admins
 from django.core.mail import send_mail
-from django.db import transaction
 from django.db.models import F
 from django.template.loader import render_to_string
 from django.utils import timezone
@@ -19,30 +13,27 @@ from rest_framework import serializers, status
 from rest_framework.reverse import reverse
 from rest_framework.validators import UniqueValidator
 
-from blitz_api.serializers import UserSerializer
-from blitz_api.services import (check_if_translated_field,
-                                remove_translation_fields)
+from blitz_api.serializers import DirectUploadTokenField, UserSerializer
+from blitz_api.services import (TranslatedSerializerMixin,
+                                check_if_translated_field, )
 from store.exceptions import PaymentAPIError
-from store.models import Order, OrderLine, PaymentProfile, Refund
-from store.services import (charge_payment,
-                            create_external_payment_profile,
-                            create_external_card,
-                            get_external_cards,
+from store.services import (get_external_cards,
+                            split_refund_amount,
                             PAYSAFE_CARD_TYPE,
-                            PAYSAFE_EXCEPTION,
-                            refund_amount, )
+                            PAYSAFE_EXCEPTION, )
 
 from .fields import TimezoneField
-from .models import (Picture, Reservation, Retirement, WaitQueue,
-                     WaitQueueNotification, )
-from .services import refund_retirement
+from .models import Picture, Reservation, Retirement, WaitQueue
+from .services import (exchange_retirement, get_exchange_amount,
+                       has_available_seat, schedule_retirement_emails, )
 
 User = get_user_model()
 
 TAX_RATE = settings.LOCAL_SETTINGS['SELLING_TAX']
 
 
-class RetirementSerializer(serializers.HyperlinkedModelSerializer):
+class RetirementSerializer(TranslatedSerializerMixin,
+                           serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     places_remaining = serializers.ReadOnlyField()
     total_reservations = serializers.ReadOnlyField()
@@ -79,6 +70,9 @@ class RetirementSerializer(serializers.HyperlinkedModelSerializer):
     # picture urls. This works but is not as clean as it could be.
     # Note: this is a read-only field so it isn't used for Workplace creation.
     pictures = serializers.SerializerMethodField()
+    # Resized copies of each picture, in the same order as "pictures", to be
+    # used as the srcset of the images.
+    pictures_srcset = serializers.SerializerMethodField()
 
     def validate_refund_rate(self, value):
         if value > 100:
@@ -92,6 +86,12 @@ class RetirementSerializer(serializers.HyperlinkedModelSerializer):
         picture_urls = [picture.picture.url for picture in obj.pictures.all()]
         return [request.build_absolute_uri(url) for url in picture_urls]
 
+    def get_pictures_srcset(self, obj):
+        request = self.context['request']
+        return [
+            picture.get_srcset(request) for picture in obj.pictures.all()
+        ]
+
     def get_reservations(self, obj):
         reservation_ids = Reservation.objects.filter(
             is_active=True,
@@ -171,111 +171,7 @@ class RetirementSerializer(serializers.HyperlinkedModelSerializer):
         """
         retirement = super().create(validated_data)
 
-        scheduler_url = '{0}'.format(
-            settings.EXTERNAL_SCHEDULER['URL'],
-        )
-
-        # Set reminder email
-        reminder_date = validated_data['start_time'] - timedelta(days=7)
-
-        data = {
-            "hour": 8,
-            "minute": 0,
-            "day_of_month": reminder_date.day,
-            "month": reminder_date.month,
-            "url": '{0}{1}'.format(
-                self.context['request'].build_absolute_uri(
-                    reverse(
-                        'retirement:retirement-detail',
-                        args=(retirement.id, )
-                    )
-                ),
-                "/remind_users"
-            ),
-            "description": "Retirement 7-days reminder notification"
-        }
-
-        try:
-            auth_data = {
-                "username": settings.EXTERNAL_SCHEDULER['USER'],
-                "password": settings.EXTERNAL_SCHEDULER['PASSWORD']
-            }
-            auth = requests.post(
-                scheduler_url + "/authentication",
-                json=auth_data,
-            )
-            auth.raise_for_status()
-
-            r = requests.post(
-                scheduler_url + "/tasks",
-                json=data,
-                headers={
-                    'Authorization':
-                    'Token ' + json.loads(auth.content)['token']},
-            )
-            r.raise_for_status()
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError) as err:
-            mail_admins(
-                "Thèsez-vous: external scheduler error",
-                "{0}\nRetirement:{1}\nException:\n{2}\n".format(
-                    "Pre-event email task scheduling failed!",
-                    retirement.__dict__,
-                    traceback.format_exc(),
-                )
-            )
-
-        # Set post-event email
-        # Send the email at midnight the next day.
-        throwback_date = validated_data['end_time'] + timedelta(days=1)
-
-        data = {
-            "hour": 0,
-            "minute": 0,
-            "day_of_month": throwback_date.day,
-            "month": throwback_date.month,
-            "url": '{0}{1}'.format(
-                self.context['request'].build_absolute_uri(
-                    reverse(
-                        'retirement:retirement-detail',
-                        args=(retirement.id, )
-                    )
-                ),
-                "/recap"
-            ),
-            "description": "Retirement post-event notification"
-        }
-
-        try:
-            auth_data = {
-                "username": settings.EXTERNAL_SCHEDULER['USER'],
-                "password": settings.EXTERNAL_SCHEDULER['PASSWORD']
-            }
-            auth = requests.post(
-                scheduler_url + "/authentication",
-                json=auth_data,
-            )
-            auth.raise_for_status()
-
-            r = requests.post(
-                scheduler_url + "/tasks",
-                json=data,
-                headers={
-                    'Authorization':
-                    'Token ' + json.loads(auth.content)['token']},
-                timeout=(10, 10),
-            )
-            r.raise_for_status()
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError) as err:
-            mail_admins(
-                "Thèsez-vous: external scheduler error",
-                "{0}\nRetirement:{1}\nException:\n{2}\n".format(
-                    "Post-event email task scheduling failed!",
-                    retirement.__dict__,
-                    traceback.format_exc(),
-                )
-            )
+        schedule_retirement_emails(retirement)
 
         return retirement
 
@@ -283,10 +179,7 @@ class RetirementSerializer(serializers.HyperlinkedModelSerializer):
         is_staff = self.context['request'].user.is_staff
         if self.context['view'].action == 'retrieve' and is_staff:
             self.fields['users'] = UserSerializer(many=True)
-        data = super(RetirementSerializer, self).to_representation(instance)
-        if is_staff:
-            return data
-        return remove_translation_fields(data)
+        return super(RetirementSerializer, self).to_representation(instance)
 
     class Meta:
         model = Retirement
@@ -334,18 +227,33 @@ class RetirementSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class PictureSerializer(serializers.HyperlinkedModelSerializer):
+class RetirementCancelationSerializer(serializers.Serializer):
+    refund_rate = serializers.IntegerField(
+        min_value=0,
+        max_value=100,
+        default=100,
+        help_text=_("Percentage of the price refunded to users."),
+    )
+    custom_message = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        help_text=_("Message added to the refund confirmation emails."),
+    )
+
+
+class PictureSerializer(TranslatedSerializerMixin,
+                        serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
+    srcset = serializers.SerializerMethodField(
+        help_text=_("URLs of resized copies of the picture, by width."),
+    )
 
-    def to_representation(self, instance):
-        data = super(PictureSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
+    def get_srcset(self, obj):
+        return obj.get_srcset(self.context['request'])
 
     class Meta:
         model = Picture
-        fields = '__all__'
+        exclude = ('derivatives',)
         extra_kwargs = {
             'retirement': {
                 'help_text': _("Retirement represented by the picture."),
@@ -363,6 +271,24 @@ class PictureSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
+class PictureUploadSerializer(PictureSerializer):
+    upload_token = DirectUploadTokenField(
+        Picture._meta.get_field('picture'),
+        write_only=True,
+        help_text=_("Token returned when the upload was prepared."),
+    )
+
+    def create(self, validated_data):
+        validated_data['picture'] = validated_data.pop('upload_token')
+        return super(PictureUploadSerializer, self).create(validated_data)
+
+    class Meta(PictureSerializer.Meta):
+        extra_kwargs = dict(
+            PictureSerializer.Meta.extra_kwargs,
+            picture={'read_only': True},
+        )
+
+
 class ReservationSerializer(serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     # Custom names are needed to overcome an issue with DRF:
@@ -460,27 +386,13 @@ class ReservationSerializer(serializers.HyperlinkedModelSerializer):
 
     def update(self, instance, validated_data):
 
-        if not instance.exchangeable and validated_data.get('retirement'):
-            raise serializers.ValidationError({
-                'non_field_errors': [_(
-                    "This reservation is not exchangeable. Please contact us "
-                    "to make any changes to this reservation."
-                )]
-            })
-
         user = instance.user
         payment_token = validated_data.pop('payment_token', None)
         single_use_token = validated_data.pop('single_use_token', None)
-        need_transaction = False
-        need_refund = False
-        amount = 0
-        profile = PaymentProfile.objects.filter(owner=user).first()
+        new_retirement = validated_data.pop('retirement', None)
         instance_pk = instance.pk
         current_retirement = instance.retirement
-        coupon = instance.order_line.coupon
-        coupon_value = instance.order_line.coupon_real_value
         order_line = instance.order_line
-        request = self.context['request']
 
         if not self.context['request'].user.is_staff:
             validated_data.pop('is_present', None)
@@ -492,365 +404,146 @@ class ReservationSerializer(serializers.HyperlinkedModelSerializer):
                 )]
             })
 
-        with transaction.atomic():
-            # NOTE: This copy logic should probably be inside the "if" below
-            #       that checks if a retirement exchange is done.
-            # Create a copy of the reservation. This copy keeps track of
-            # the exchange.
-            canceled_reservation = instance
-            canceled_reservation.pk = None
-            canceled_reservation.save()
-
-            instance = Reservation.objects.get(id=instance_pk)
-
-            canceled_reservation.is_active = False
-            canceled_reservation.cancelation_reason = 'U'
-            canceled_reservation.cancelation_action = 'E'
-            canceled_reservation.cancelation_date = timezone.now()
-            canceled_reservation.save()
-
-            # Update the reservation
-            instance = super(ReservationSerializer, self).update(
-                instance,
-                validated_data,
-            )
+        # Retirements are only exchanged with a partial update
+        if self.context['view'].action != 'partial_update':
+            if new_retirement and new_retirement != current_retirement:
+                raise serializers.ValidationError({
+                    'retirement': [_(
+                        "The retirement of a reservation can only be "
+                        "exchanged with a partial update."
+                    )]
+                })
+            new_retirement = None
 
-            # Update retirement seats
-            free_seats = (
-                current_retirement.seats -
-                current_retirement.total_reservations
-            )
-            if (current_retirement.reserved_seats or free_seats == 1):
-                current_retirement.reserved_seats += 1
-                current_retirement.save()
-
-            if validated_data.get('retirement'):
-                # Validate if user has the right to reserve a seat in the new
-                # retirement
-                new_retirement = instance.retirement
-                old_retirement = current_retirement
-
-                user_waiting = new_retirement.wait_queue.filter(user=user)
-                free_seats = (
-                    new_retirement.seats -
-                    new_retirement.total_reservations -
-                    new_retirement.reserved_seats +
-                    1
+        if not new_retirement:
+            if validated_data:
+                super(ReservationSerializer, self).update(
+                    instance,
+                    validated_data,
                 )
-                reserved_for_user = (
-                    new_retirement.reserved_seats and
-                    WaitQueueNotification.objects.filter(
-                        user=user,
-                        retirement=new_retirement
-                    )
-                )
-                if not (free_seats > 0 or reserved_for_user):
-                    raise serializers.ValidationError({
-                        'non_field_errors': [_(
-                            "There are no places left in the requested "
-                            "retirement."
-                        )]
-                    })
-                if user_waiting:
-                    user_waiting.delete()
-
-            if (self.context['view'].action == 'partial_update' and
-                    validated_data.get('retirement')):
-                if order_line.quantity > 1:
-                    raise serializers.ValidationError({
-                        'non_field_errors': [_(
-                            "The order containing this reservation has a "
-                            "quantity bigger than 1. Please contact the "
-                            "support team."
-                        )]
-                    })
-                days_remaining = current_retirement.start_time - timezone.now()
-                days_exchange = timedelta(
-                    days=current_retirement.min_day_exchange
-                )
-                respects_minimum_days = (days_remaining >= days_exchange)
-                new_retirement_price = validated_data['retirement'].price
-                if current_retirement.price < new_retirement_price:
-                    # If the new retirement is more expensive, reapply the
-                    # coupon on the new orderline created. In other words, any
-                    # coupon used for the initial purchase is applied again
-                    # here.
-                    need_transaction = True
-                    amount = (
-                        validated_data['retirement'].price -
-                        order_line.coupon_real_value
-                    )
-                    if not (payment_token or single_use_token):
-                        raise serializers.ValidationError({
-                            'non_field_errors': [_(
-                                "The new retirement is more expensive than "
-                                "the current one. Provide a payment_token or "
-                                "single_use_token to charge the balance."
-                            )]
-                        })
-                if current_retirement.price > new_retirement_price:
-                    # If a coupon was applied for the purchase, check if the
-                    # real cost of the purchase was lower than the price
-                    # difference.
-                    # If so, refund the real cost of the purchase.
-                    # Else refund the difference between the 2 retirements.
-                    need_refund = True
-                    price_diff = (
-                        current_retirement.price -
-                        validated_data['retirement'].price
-                    )
-                    real_cost = order_line.cost
-                    amount = min(price_diff, real_cost)
-                if current_retirement == validated_data['retirement']:
-                    raise serializers.ValidationError({
-                        'retirement': [_(
-                            "That retirement is already assigned to this "
-                            "object."
-                        )]
-                    })
-                if not respects_minimum_days:
-                    raise serializers.ValidationError({
-                        'non_field_errors': [_(
-                            "Maximum exchange date exceeded."
-                        )]
-                    })
-                if need_transaction and (single_use_token and not profile):
-                    # Create external profile
-                    try:
-                        create_profile_res = create_external_payment_profile(
-                            user
-                        )
-                    except PaymentAPIError as err:
-                        raise serializers.ValidationError({
-                            'message': err
-                        })
-                    # Create local profile
-                    profile = PaymentProfile.objects.create(
-                        name="Paysafe",
-                        owner=user,
-                        external_api_id=create_profile_res.json()['id'],
-                        external_api_url='{0}{1}'.format(
-                            create_profile_res.url,
-                            create_profile_res.json()['id']
-                        )
-                    )
-                # Generate a list of tuples containing start/end time of
-                # existing reservations.
-                start = validated_data['retirement'].start_time
-                end = validated_data['retirement'].end_time
-                active_reservations = Reservation.objects.filter(
-                    user=user,
-                    is_active=True,
-                ).exclude(pk=instance.pk).values_list(
-                    'retirement__start_time',
-                    'retirement__end_time',
-                )
-
-                for retirements in active_reservations:
-                    if max(retirements[0], start) < min(retirements[1], end):
-                        raise serializers.ValidationError({
-                            'non_field_errors': [_(
-                                "This reservation overlaps with another "
-                                "active reservations for this user."
-                            )]
-                        })
-                if need_transaction:
-                    order = Order.objects.create(
-                        user=user,
-                        transaction_date=timezone.now(),
-                        authorization_id=1,
-                        settlement_id=1,
-                    )
-                    new_order_line = OrderLine.objects.create(
-                        order=order,
-                        quantity=1,
-                        content_type=ContentType.objects.get_for_model(
-                            Retirement
-                        ),
-                        object_id=validated_data['retirement'].id,
-                        cost=amount,
-                        coupon=coupon,
-                        coupon_real_value=coupon_value,
-                    )
-                    tax = round(amount * Decimal(TAX_RATE), 2)
-                    amount *= Decimal(TAX_RATE + 1)
-                    amount = round(amount * 100, 2)
-                    retirement = validated_data['retirement']
-
-                    # Do a complete refund of the previous retirement
-                    try:
-                        refund_instance = refund_retirement(
-                            canceled_reservation,
-                            100,
-                            "Exchange retirement {0} for retirement "
-                            "{1}".format(
-                                str(current_retirement),
-                                str(validated_data['retirement'])
-                            )
-                        )
-                    except PaymentAPIError as err:
-                        if str(err) == PAYSAFE_EXCEPTION['3406']:
-                            raise serializers.ValidationError({
-                                'non_field_errors': _(
-                                    "The order has not been charged yet. "
-                                    "Try again later."
-                                )
-                            })
-                        raise serializers.ValidationError({
-                            'message': str(err)
-                        })
-
-                    if payment_token and int(amount):
-                        # Charge the order with the external payment API
-                        try:
-                            charge_response = charge_payment(
-                                int(round(amount)),
-                                payment_token,
-                                str(order.id)
-                            )
-                        except PaymentAPIError as err:
-                            raise serializers.ValidationError({
-                                'message': err
-                            })
-
-                    elif single_use_token and int(amount):
-                        # Add card to the external profile & charge user
-                        try:
-                            card_create_response = create_external_card(
-                                profile.external_api_id,
-                                single_use_token
-                            )
-                            charge_response = charge_payment(
-                                int(round(amount)),
-                                card_create_response.json()['paymentToken'],
-                                str(order.id)
-                            )
-                        except PaymentAPIError as err:
-                            raise serializers.ValidationError({
-                                'message': err
-                            })
-                    charge_res_content = charge_response.json()
-                    order.authorization_id = charge_res_content['id']
-                    order.settlement_id = charge_res_content['settlements'][0][
-                        'id'
-                    ]
-                    order.reference_number = charge_res_content[
-                        'merchantRefNum'
-                    ]
-                    order.save()
-                    instance.order_line = new_order_line
-                    instance.save()
-
-                if need_refund:
-                    tax = round(amount * Decimal(TAX_RATE), 2)
-                    amount *= Decimal(TAX_RATE + 1)
-                    amount = round(amount * 100, 2)
-                    retirement = validated_data['retirement']
-
-                    refund_instance = Refund.objects.create(
-                        orderline=order_line,
-                        refund_date=timezone.now(),
-                        amount=amount/100,
-                        details="Exchange retirement {0} for "
-                                "retirement {1}".format(
-                                    str(current_retirement),
-                                    str(validated_data['retirement'])
-                                ),
-                    )
+            return Reservation.objects.get(id=instance_pk)
 
-                    try:
-                        refund_response = refund_amount(
-                            order_line.order.settlement_id,
-                            int(round(amount))
-                        )
-                        refund_res_content = refund_response.json()
-                        refund_instance.refund_id = refund_res_content['id']
-                        refund_instance.save()
-                    except PaymentAPIError as err:
-                        if str(err) == PAYSAFE_EXCEPTION['3406']:
-                            raise serializers.ValidationError({
-                                'non_field_errors': _(
-                                    "The order has not been charged yet. "
-                                    "Try again later."
-                                )
-                            })
-                        raise serializers.ValidationError({
-                            'message': str(err)
-                        })
-
-                    new_retirement = retirement
-                    old_retirement = current_retirement
-
-            # Ask the external scheduler to start calling /notify if the
-            # reserved_seats count == 1. Otherwise, the scheduler should
-            # already be calling /notify at specified intervals.
-            #
-            # Since we are in the context of a cancelation, if reserved_seats
-            # equals 1, that means that this is the first cancelation.
-            if current_retirement.reserved_seats == 1:
-                scheduler_url = '{0}'.format(
-                    settings.EXTERNAL_SCHEDULER['URL'],
-                )
+        # Validate the exchange and compute its price before anything is
+        # written or sent to the payment API.
+        if not instance.exchangeable:
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "This reservation is not exchangeable. Please contact us "
+                    "to make any changes to this reservation."
+                )]
+            })
+        if current_retirement == new_retirement:
+            raise serializers.ValidationError({
+                'retirement': [_(
+                    "That retirement is already assigned to this "
+                    "object."
+                )]
+            })
+        if not has_available_seat(new_retirement, user):
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "There are no places left in the requested "
+                    "retirement."
+                )]
+            })
+        if order_line.quantity > 1:
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "The order containing this reservation has a "
+                    "quantity bigger than 1. Please contact the "
+                    "support team."
+                )]
+            })
+        amount = get_exchange_amount(instance, new_retirement)
+        if amount > 0 and not (payment_token or single_use_token):
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "The new retirement is more expensive than "
+                    "the current one. Provide a payment_token or "
+                    "single_use_token to charge the balance."
+                )]
+            })
+        days_remaining = current_retirement.start_time - timezone.now()
+        days_exchange = timedelta(days=current_retirement.min_day_exchange)
+        if days_remaining < days_exchange:
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "Maximum exchange date exceeded."
+                )]
+            })
+        # Generate a list of tuples containing start/end time of
+        # existing reservations.
+        start = new_retirement.start_time
+        end = new_retirement.end_time
+        active_reservations = Reservation.objects.filter(
+            user=user,
+            is_active=True,
+        ).exclude(pk=instance.pk).values_list(
+            'retirement__start_time',
+            'retirement__end_time',
+        )
 
-                data = {
-                    "hour": timezone.now().hour,
-                    "minute": (timezone.now().minute + 5) % 60,
-                    "url": '{0}{1}'.format(
-                        request.build_absolute_uri(
-                            reverse('retirement:waitqueuenotification-list')
-                        ),
-                        "/notify"
-                    ),
-                    "description": "Retirement wait queue notification"
-                }
+        for retirements in active_reservations:
+            if max(retirements[0], start) < min(retirements[1], end):
+                raise serializers.ValidationError({
+                    'non_field_errors': [_(
+                        "This reservation overlaps with another "
+                        "active reservations for this user."
+                    )]
+                })
 
-                try:
-                    auth_data = {
-                        "username": settings.EXTERNAL_SCHEDULER['USER'],
-                        "password": settings.EXTERNAL_SCHEDULER['PASSWORD']
-                    }
-                    auth = requests.post(
-                        scheduler_url + "/authentication",
-                        json=auth_data,
-                    )
-                    auth.raise_for_status()
-
-                    r = requests.post(
-                        scheduler_url + '/tasks',
-                        json=data,
-                        headers={
-                            'Authorization':
-                            'Token ' + json.loads(auth.content)['token']},
-                        timeout=(10, 10),
-                    )
-                    r.raise_for_status()
-                except (requests.exceptions.HTTPError,
-                        requests.exceptions.ConnectionError) as err:
-                    mail_admins(
-                        "Thèsez-vous: external scheduler error",
-                        traceback.format_exc()
+        try:
+            exchange = exchange_retirement(
+                instance,
+                new_retirement,
+                payment_token,
+                single_use_token,
+            )
+        except PaymentAPIError as err:
+            if str(err) == PAYSAFE_EXCEPTION['3406']:
+                raise serializers.ValidationError({
+                    'non_field_errors': _(
+                        "The order has not been charged yet. "
+                        "Try again later."
                     )
+                })
+            raise serializers.ValidationError({
+                'message': str(err)
+            })
+        if exchange is None:
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "There are no places left in the requested "
+                    "retirement."
+                )]
+            })
+        canceled_reservation, order, charge, refund = exchange
+
+        # The other fields are only saved once the exchange is done
+        if validated_data:
+            super(ReservationSerializer, self).update(
+                instance,
+                validated_data,
+            )
 
         # Send appropriate emails
         # Send order confirmation email
-        if need_transaction:
+        if charge:
+            new_order_line = instance.order_line
             items = [
                 {
-                    'price': new_order_line.content_object.price,
+                    'price': new_retirement.price,
                     'name': "{0}: {1}".format(
                         str(new_order_line.content_type),
-                        new_order_line.content_object.name
+                        new_retirement.name
                     ),
                 }
             ]
 
             merge_data = {
                 'STATUS': "APPROUVÉE",
-                'CARD_NUMBER':
-                charge_res_content['card']['lastDigits'],
-                'CARD_TYPE': PAYSAFE_CARD_TYPE[
-                    charge_res_content['card']['type']
-                ],
+                'CARD_NUMBER': charge['card']['lastDigits'],
+                'CARD_TYPE': PAYSAFE_CARD_TYPE[charge['card']['type']],
                 'DATETIME': timezone.localtime().strftime("%x %X"),
                 'ORDER_ID': order.id,
                 'CUSTOMER_NAME':
@@ -885,12 +578,13 @@ class ReservationSerializer(serializers.HyperlinkedModelSerializer):
                 "Confirmation d'achat",
                 plain_msg,
                 settings.DEFAULT_FROM_EMAIL,
-                [order.user.email],
+                [user.email],
                 html_message=msg_html,
             )
 
         # Send refund confirmation email
-        if need_refund:
+        if refund:
+            subtotal, tax = split_refund_amount(refund.amount)
             merge_data = {
                 'DATETIME': timezone.localtime().strftime("%x %X"),
                 'ORDER_ID': order_line.order.id,
@@ -900,11 +594,10 @@ class ReservationSerializer(serializers.HyperlinkedModelSerializer):
                 'CUSTOMER_NUMBER': user.id,
                 'TYPE': "Remboursement",
                 'NEW_RETIREMENT': new_retirement,
-                'OLD_RETIREMENT': old_retirement,
-                'SUBTOTAL':
-                old_retirement.price - new_retirement.price,
-                'COST': round(amount/100, 2),
-                'TAX': round(Decimal(tax), 2),
+                'OLD_RETIREMENT': current_retirement,
+                'SUBTOTAL': subtotal,
+                'COST': round(refund.amount, 2),
+                'TAX': tax,
             }
 
             plain_msg = render_to_string("refund.txt", merge_data)
@@ -919,55 +612,54 @@ class ReservationSerializer(serializers.HyperlinkedModelSerializer):
             )
 
         # Send exchange confirmation email
-        if validated_data.get('retirement'):
-            merge_data = {
-                'DATETIME': timezone.localtime().strftime("%x %X"),
-                'CUSTOMER_NAME': user.first_name + " " + user.last_name,
-                'CUSTOMER_EMAIL': user.email,
-                'CUSTOMER_NUMBER': user.id,
-                'TYPE': "Échange",
-                'NEW_RETIREMENT': new_retirement,
-                'OLD_RETIREMENT': old_retirement,
-            }
+        merge_data = {
+            'DATETIME': timezone.localtime().strftime("%x %X"),
+            'CUSTOMER_NAME': user.first_name + " " + user.last_name,
+            'CUSTOMER_EMAIL': user.email,
+            'CUSTOMER_NUMBER': user.id,
+            'TYPE': "Échange",
+            'NEW_RETIREMENT': new_retirement,
+            'OLD_RETIREMENT': current_retirement,
+        }
 
-            plain_msg = render_to_string("exchange.txt", merge_data)
-            msg_html = render_to_string("exchange.html", merge_data)
+        plain_msg = render_to_string("exchange.txt", merge_data)
+        msg_html = render_to_string("exchange.html", merge_data)
 
-            send_mail(
-                "Confirmation d'échange",
-                plain_msg,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                html_message=msg_html,
-            )
+        send_mail(
+            "Confirmation d'échange",
+            plain_msg,
+            settings.DEFAULT_FROM_EMAIL,
+            [user.email],
+            html_message=msg_html,
+        )
 
-            merge_data = {
-                'RETIREMENT': new_retirement,
-                'USER': instance.user,
-            }
+        merge_data = {
+            'RETIREMENT': new_retirement,
+            'USER': user,
+        }
 
-            plain_msg = render_to_string(
-                "retirement_info.txt",
-                merge_data
-            )
-            msg_html = render_to_string(
-                "retirement_info.html",
-                merge_data
-            )
+        plain_msg = render_to_string(
+            "retirement_info.txt",
+            merge_data
+        )
+        msg_html = render_to_string(
+            "retirement_info.html",
+            merge_data
+        )
 
-            send_mail(
-                "Confirmation d'inscription à la retraite",
-                plain_msg,
-                settings.DEFAULT_FROM_EMAIL,
-                [instance.user.email],
-                html_message=msg_html,
-            )
+        send_mail(
+            "Confirmation d'inscription à la retraite",
+            plain_msg,
+            settings.DEFAULT_FROM_EMAIL,
+            [user.email],
+            html_message=msg_html,
+        )
 
         return Reservation.objects.get(id=instance_pk)
 
     class Meta:
         model = Reservation
-        exclude = ('deleted', )
+        exclude = ('deleted', 'reminder_sent', 'recap_sent', )
         extra_kwargs = {
             'retirement': {
                 'help_text': _("Retirement represented by the picture."),
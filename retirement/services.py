@@ -1,120 +1,983 @@
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.contrib.contenttypes.models import ContentType
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Case, Count, Max, Q, Value, When
+from django.db.models.functions import Trunc
+from django.template.loader import get_template, render_to_string
 from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
 
+from requests.exceptions import RequestException
+from safedelete.models import HARD_DELETE
+
+from blitz_api import history
+from blitz_api.cache import invalidate_cached_responses
+from blitz_api.services import (get_cached_analytics, get_rate, save_fields,
+                                schedule_task, )
 from store.exceptions import PaymentAPIError
-from store.models import Refund
-from store.services import (PAYSAFE_EXCEPTION,
-                            refund_amount, )
+from store.models import Order, OrderLine, Refund
+from store.services import (NOTIFICATION_BATCH_SIZE, cancel_settlement,
+                            charge_payment, create_card_payment_token,
+                            get_refund_amount, refund_amount, send_refund,
+                            split_refund_amount, update_order_totals,
+                            update_refunded_totals, )
 
+from .models import (Reservation, Retirement, WaitQueue,
+                     WaitQueueNotification, )
 
 TAX_RATE = settings.LOCAL_SETTINGS['SELLING_TAX']
 
 
-def notify_reserved_retirement_seat(user, retirement):
+def schedule_retirement_emails(retirement):
     """
-    This function sends an email to notify a user that he has a reserved seat
-    to a retirement for 24h hours.
+    Schedules the 7-days reminder of a retirement, sent at 8:00 a week before
+    it starts, and its recap, sent at midnight the day after it ends.
     """
+    reminder_date = timezone.localtime(retirement.start_time).date()
+    reminder_date -= timedelta(days=7)
+    schedule_task(
+        'retirement_reminder',
+        timezone.make_aware(datetime.combine(reminder_date, time(8))),
+        retirement_id=retirement.id,
+    )
+
+    recap_date = timezone.localtime(retirement.end_time).date()
+    recap_date += timedelta(days=1)
+    schedule_task(
+        'retirement_recap',
+        timezone.make_aware(datetime.combine(recap_date, time.min)),
+        retirement_id=retirement.id,
+    )
+
 
-    merge_data = {'RETIREMENT_NAME': retirement.name}
+def send_reservation_emails(retirement, subject, sent_field, render):
+    """
+    Sends an email to every user with an active reservation to a retirement,
+    except those already marked as notified in the "sent_field" of their
+    reservation.
 
-    plain_msg = render_to_string("reserved_place.txt", merge_data)
-    msg_html = render_to_string("reserved_place.html", merge_data)
+    render(user) returns the plain text and HTML bodies of a message.
+    Messages are sent through a shared connection by batches of
+    NOTIFICATION_BATCH_SIZE, and each batch is marked as notified once sent,
+    so an interrupted dispatch can be resumed by calling this again.
 
-    return send_mail(
-        "Place exclusive pour 24h",
-        plain_msg,
-        settings.DEFAULT_FROM_EMAIL,
-        [user.email],
-        html_message=msg_html,
+    Returns the number of messages sent.
+    """
+    reservations = list(
+        retirement.reservations.filter(
+            is_active=True,
+            **{sent_field + '__isnull': True}
+        ).select_related('user').order_by('pk')
     )
 
+    sent = 0
+    for index in range(0, len(reservations), NOTIFICATION_BATCH_SIZE):
+        batch = reservations[index:index + NOTIFICATION_BATCH_SIZE]
+        messages = list()
+        for reservation in batch:
+            plain_msg, msg_html = render(reservation.user)
+            message = EmailMultiAlternatives(
+                subject,
+                plain_msg,
+                settings.DEFAULT_FROM_EMAIL,
+                [reservation.user.email],
+            )
+            message.attach_alternative(msg_html, "text/html")
+            messages.append(message)
+        with get_connection() as connection:
+            connection.send_messages(messages)
+        Reservation.objects.filter(
+            pk__in=[reservation.pk for reservation in batch],
+        ).update(**{sent_field: timezone.now()})
+        sent += len(batch)
+
+    return sent
+
 
-def send_retirement_7_days_email(user, retirement):
+def remind_retirement_users(retirement_id):
     """
-    This function sends an email to notify a user that a retirement in which he
-    has bought a seat is starting in 7 days.
+    Sends the 7-days reminder to the users who will attend a retirement and
+    didn't receive it yet. The message is the same for everyone and is
+    rendered once.
     """
+    retirement = Retirement.objects.filter(pk=retirement_id).first()
+    if retirement is None:
+        return 0
 
     merge_data = {'RETIREMENT': retirement}
 
     plain_msg = render_to_string("reminder.txt", merge_data)
     msg_html = render_to_string("reminder.html", merge_data)
 
-    return send_mail(
+    return send_reservation_emails(
+        retirement,
         "Rappel retraite",
-        plain_msg,
-        settings.DEFAULT_FROM_EMAIL,
-        [user.email],
-        html_message=msg_html,
+        'reminder_sent',
+        lambda user: (plain_msg, msg_html),
     )
 
 
-def send_post_retirement_email(user, retirement):
+def recap_retirement_users(retirement_id):
     """
-    This function sends an email to get back to a user after a retirement has
-    ended.
+    Sends the post-event email to the users who attended a retirement and
+    didn't receive it yet. Templates are loaded once and only rendered with
+    the user.
     """
+    retirement = Retirement.objects.filter(pk=retirement_id).first()
+    if retirement is None:
+        return 0
 
-    merge_data = {
-        'RETIREMENT': retirement,
-        'USER': user,
-    }
+    plain_template = get_template("throwback.txt")
+    html_template = get_template("throwback.html")
 
-    plain_msg = render_to_string("throwback.txt", merge_data)
-    msg_html = render_to_string("throwback.html", merge_data)
+    def render(user):
+        merge_data = {
+            'RETIREMENT': retirement,
+            'USER': user,
+        }
+        return (
+            plain_template.render(merge_data),
+            html_template.render(merge_data),
+        )
 
-    return send_mail(
+    return send_reservation_emails(
+        retirement,
         "Merci pour votre participation",
-        plain_msg,
-        settings.DEFAULT_FROM_EMAIL,
-        [user.email],
-        html_message=msg_html,
+        'recap_sent',
+        render,
+    )
+
+
+def notify_wait_queues():
+    """
+    Notifies users in wait queues of every retirement. For each retirement,
+    there will be as many users notified as there are reserved seats.
+    At the same time, this clears older notification logs.
+
+    The retirements to notify are locked and read with a single query, as
+    are the wait queues of those retirements. Notifications are logged with
+    one bulk insert and the cursors of the retirements are updated with one
+    query, then the emails are sent by batches over a shared connection.
+
+    Returns None if someone was notified, else the details of why nobody
+    was, with "stop" set if there are no reserved seats left.
+    """
+    now = timezone.now()
+    # Checks if lastest notification is older than 24h
+    # Keep a 5 minutes gap.
+    time_limit = now - timedelta(hours=23, minutes=55)
+
+    # Remove older notifications
+    remove_before = now - timedelta(
+        days=settings.LOCAL_SETTINGS[
+            'RETIREMENT_NOTIFICATION_LIFETIME_DAYS'
+        ]
+    )
+    WaitQueueNotification.objects.filter(
+        created_at__lt=remove_before
+    ).delete()
+
+    # The retirements are locked until their cursors are updated: a
+    # cancellation reserving a seat in the meantime would be overwritten.
+    with transaction.atomic():
+        retirements_to_notify = list(
+            Retirement.objects.select_for_update().filter(
+                reserved_seats__gt=0,
+                start_time__gt=now,
+                is_active=True,
+            ).order_by('pk')
+        )
+
+        if not retirements_to_notify:
+            return {
+                'detail': "No reserved seats.",
+                'stop': True,
+            }
+
+        # Aggregates can't be selected for update
+        last_notifications = dict(
+            WaitQueueNotification.objects.filter(
+                retirement__in=retirements_to_notify,
+            ).values('retirement').annotate(
+                last_notification=Max('created_at'),
+            ).values_list('retirement', 'last_notification')
+        )
+
+        # Skip the retirements whose wait_queue has been notified less than
+        # 24h ago.
+        ready_retirements = [
+            retirement for retirement in retirements_to_notify
+            if last_notifications.get(retirement.id) is None or
+            last_notifications[retirement.id] <= time_limit
+        ]
+
+        if not ready_retirements:
+            return {
+                'detail': "Last notification was sent less than 24h ago."
+            }
+
+        # Get the wait queues with elements ordered by ascending date
+        wait_queues = defaultdict(list)
+        queryset = WaitQueue.objects.filter(
+            retirement__in=ready_retirements,
+        ).select_related('user').order_by('retirement', 'created_at', 'pk')
+        for item in queryset:
+            wait_queues[item.retirement_id].append(item.user)
+
+        notifications = list()
+        for retirement in ready_retirements:
+            # Notify a user for every reserved seat
+            waiting_users = wait_queues[retirement.id][
+                retirement.next_user_notified:
+                retirement.next_user_notified + retirement.reserved_seats
+            ]
+            if waiting_users:
+                # Free the reserved seats left without waiting users
+                retirement.reserved_seats = len(waiting_users)
+                retirement.next_user_notified += len(waiting_users)
+            else:
+                # All users have already been notified, free all reserved
+                # seats
+                retirement.reserved_seats = 0
+                retirement.next_user_notified = 0
+            notifications += [
+                WaitQueueNotification(user=user, retirement=retirement)
+                for user in waiting_users
+            ]
+
+        created_after = timezone.now()
+        WaitQueueNotification.objects.bulk_create(notifications)
+        # Primary keys are not set by bulk_create on every database backend
+        WaitQueueNotification.history.bulk_history_create(
+            WaitQueueNotification.objects.filter(
+                retirement__in=ready_retirements,
+                created_at__gte=created_after,
+            )
+        )
+        Retirement.objects.filter(
+            pk__in=[retirement.pk for retirement in ready_retirements],
+        ).update(
+            reserved_seats=Case(*[
+                When(pk=retirement.pk, then=retirement.reserved_seats)
+                for retirement in ready_retirements
+            ]),
+            next_user_notified=Case(*[
+                When(pk=retirement.pk, then=retirement.next_user_notified)
+                for retirement in ready_retirements
+            ]),
+        )
+        invalidate_cached_responses(Retirement)
+
+    send_reserved_seat_notifications(notifications)
+
+    if not notifications:
+        return {
+            'detail': "No reserved seats.",
+            'stop': True,
+        }
+
+
+def send_reserved_seat_notifications(notifications):
+    """
+    Sends an email to notify users that they have a reserved seat to a
+    retirement for 24h hours, one for every WaitQueueNotification.
+
+    The message of each retirement is rendered once and messages are sent by
+    batches of NOTIFICATION_BATCH_SIZE over a shared connection.
+    """
+    rendered_messages = dict()
+    messages = list()
+    for notification in notifications:
+        retirement = notification.retirement
+        if retirement.id not in rendered_messages:
+            merge_data = {'RETIREMENT_NAME': retirement.name}
+            rendered_messages[retirement.id] = (
+                render_to_string("reserved_place.txt", merge_data),
+                render_to_string("reserved_place.html", merge_data),
+            )
+        plain_msg, msg_html = rendered_messages[retirement.id]
+        message = EmailMultiAlternatives(
+            "Place exclusive pour 24h",
+            plain_msg,
+            settings.DEFAULT_FROM_EMAIL,
+            [notification.user.email],
+        )
+        message.attach_alternative(msg_html, "text/html")
+        messages.append(message)
+
+    for index in range(0, len(messages), NOTIFICATION_BATCH_SIZE):
+        with get_connection() as connection:
+            connection.send_messages(
+                messages[index:index + NOTIFICATION_BATCH_SIZE]
+            )
+
+
+def schedule_wait_queue_notification(delay=timedelta(minutes=5)):
+    """
+    Schedules the notification of users in wait queues, unless it is
+    already scheduled.
+    """
+    return schedule_task(
+        'wait_queue_notification',
+        timezone.now() + delay,
+        unique=True,
     )
 
 
+def run_wait_queue_notification():
+    """
+    Notifies users in wait queues and, while seats remain reserved, schedules
+    the next notification a day later.
+    """
+    response_data = notify_wait_queues()
+    if not (response_data and response_data.get('stop')):
+        schedule_wait_queue_notification(delay=timedelta(days=1))
+
+
 def refund_retirement(reservation, refund_rate, refund_reason):
     """
     reservation: Reservation model instance
     refund_rate: integer from 0 to 100 defining percentage of amount refunded
     refund_reason: string for additonnal details
 
-    This function finds the order associated to the reservation and does a
-    complete refund. It also creates the Refund object to keep track of the
-    transaction.
+    This function finds the order associated to the reservation and records
+    its refund in a Refund object. The refund itself is sent to the external
+    payment API by a scheduled task (see store.services.send_refund).
     """
     orderline = reservation.order_line
-    user = orderline.order.user
     retirement = reservation.retirement
-    previous_refunds = orderline.refunds
-    refunded_amount = Decimal(0)
 
-    if previous_refunds:
-        refunded_amount = sum(
-            previous_refunds.all().values_list('amount', flat=True)
+    refund_instance = Refund.objects.create(
+        orderline=orderline,
+        refund_date=timezone.now(),
+        amount=sum(
+            get_refund_amount(orderline, retirement.price, refund_rate)
+        ),
+        details=refund_reason,
+    )
+    update_refunded_totals([orderline.pk])
+    schedule_task('refund', timezone.now(), refund_id=refund_instance.pk)
+
+    return refund_instance
+
+
+def get_exchange_amount(reservation, new_retirement):
+    """
+    Returns the amount, before taxes, to charge (positive) or to refund
+    (negative) to exchange the reservation for new_retirement.
+
+    A more expensive retirement is bought at its price minus the coupon of
+    the initial purchase, which is then refunded in full. A cheaper one gives
+    a refund of the price difference, up to the real cost of the initial
+    purchase.
+    """
+    order_line = reservation.order_line
+    current_price = reservation.retirement.price
+
+    if new_retirement.price > current_price:
+        return new_retirement.price - order_line.coupon_real_value
+    if new_retirement.price < current_price:
+        return -min(current_price - new_retirement.price, order_line.cost)
+    return Decimal(0)
+
+
+def has_available_seat(retirement, user):
+    """
+    Whether the user can take a seat in the retirement, either because a
+    seat is free or because one is reserved for the user by a wait queue
+    notification.
+    """
+    free_seats = (
+        retirement.seats -
+        retirement.total_reservations -
+        retirement.reserved_seats
+    )
+    if free_seats > 0:
+        return True
+    return bool(retirement.reserved_seats) and (
+        WaitQueueNotification.objects.filter(
+            user=user,
+            retirement=retirement,
+        ).exists()
+    )
+
+
+def hold_retirement_exchange(reservation, new_retirement, amount, reason):
+    """
+    First step of an exchange. While new_retirement is locked, checks that a
+    seat is still available and holds it with a pending reservation, active
+    so it counts against the seats of new_retirement.
+
+    A positive amount creates the order to charge and a negative one the
+    Refund to send. Their external IDs are only known once the payment API
+    answers. The reservation keeps its seat in the current retirement until
+    the exchange is confirmed.
+
+    Returns (pending_reservation, order, refund), or None if there is no
+    seat left.
+    """
+    order_line = reservation.order_line
+    order = refund = None
+
+    with history.atomic():
+        new_retirement = Retirement.objects.select_for_update().get(
+            pk=new_retirement.pk,
+        )
+        if not has_available_seat(new_retirement, reservation.user):
+            return None
+
+        if amount > 0:
+            order = Order.objects.create(
+                user=reservation.user,
+                transaction_date=timezone.now(),
+                authorization_id=1,
+                settlement_id=1,
+            )
+            order_line = OrderLine.objects.create(
+                order=order,
+                quantity=1,
+                content_type=ContentType.objects.get_for_model(Retirement),
+                object_id=new_retirement.id,
+                cost=amount,
+                coupon=order_line.coupon,
+                coupon_real_value=order_line.coupon_real_value,
+            )
+            update_order_totals(order)
+        elif amount < 0:
+            refund = Refund.objects.create(
+                orderline=order_line,
+                refund_date=timezone.now(),
+                amount=sum(get_refund_amount(order_line, -amount)),
+                details=reason,
+            )
+            update_refunded_totals([order_line.pk])
+
+        pending_reservation = Reservation.objects.create(
+            user=reservation.user,
+            retirement=new_retirement,
+            order_line=order_line,
+            is_present=reservation.is_present,
+            refundable=reservation.refundable,
+            exchangeable=reservation.exchangeable,
+            is_active=True,
+        )
+
+    return pending_reservation, order, refund
+
+
+def release_retirement_exchange(pending_reservation, order=None,
+                                refund=None):
+    """
+    Undoes hold_retirement_exchange after a failed payment: the objects
+    created for the exchange are deleted, except a refund already sent to the
+    payment API. Objects already deleted are ignored, so this can safely be
+    retried.
+    """
+    with history.atomic():
+        Reservation.objects.filter(pk=pending_reservation.pk).delete(
+            force_policy=HARD_DELETE,
+        )
+        if order:
+            Order.objects.filter(pk=order.pk).delete()
+        if refund:
+            Refund.objects.filter(
+                pk=refund.pk,
+                refund_id__isnull=True,
+            ).delete(force_policy=HARD_DELETE)
+            update_refunded_totals([refund.orderline_id])
+
+
+def confirm_retirement_exchange(reservation, pending_reservation,
+                                order=None, charge=None, reason=None):
+    """
+    Last step of an exchange, once the payment API accepted the payment.
+
+    The reservation is moved to the new retirement with the order line of the
+    pending reservation, which becomes the canceled copy of the reservation.
+    The charge is saved on the order of a more expensive retirement and the
+    initial purchase is refunded. The seat of the previous retirement is
+    freed and the user leaves the wait queue of the new one.
+
+    Returns the canceled reservation.
+    """
+    with history.atomic():
+        current_retirement = reservation.retirement
+        new_retirement = pending_reservation.retirement
+        new_order_line = pending_reservation.order_line
+
+        pending_reservation.retirement = current_retirement
+        pending_reservation.order_line = reservation.order_line
+        pending_reservation.is_active = False
+        pending_reservation.cancelation_reason = 'U'
+        pending_reservation.cancelation_action = 'E'
+        pending_reservation.cancelation_date = timezone.now()
+        pending_reservation.save()
+        canceled_reservation = pending_reservation
+
+        reservation.retirement = new_retirement
+        reservation.order_line = new_order_line
+        reservation.save()
+
+        if order:
+            if charge:
+                order.authorization_id = charge['id']
+                order.settlement_id = charge['settlements'][0]['id']
+                order.reference_number = charge['merchantRefNum']
+                order.save()
+            refund_retirement(canceled_reservation, 100, reason)
+
+        free_seats = (
+            current_retirement.seats -
+            current_retirement.total_reservations
         )
+        if current_retirement.reserved_seats or free_seats == 1:
+            current_retirement.reserved_seats += 1
+            save_fields(current_retirement, history=False)
+
+        WaitQueue.objects.filter(
+            user=reservation.user,
+            retirement=new_retirement,
+        ).delete()
+
+        # Start notifying the wait queue if the reserved_seats count == 1.
+        # Otherwise, the notification is already scheduled to run at
+        # specified intervals.
+        if current_retirement.reserved_seats == 1:
+            schedule_wait_queue_notification()
 
-    amount_to_refund = (retirement.price - refunded_amount) * refund_rate
+    return canceled_reservation
 
-    tax = round(amount_to_refund * Decimal(TAX_RATE), 2)
-    amount_to_refund *= Decimal(TAX_RATE + 1)
 
-    refund_response = refund_amount(
-        orderline.order.settlement_id,
-        int(amount_to_refund)
+def run_retirement_exchange_confirmation(reservation_id,
+                                         pending_reservation_id, reason=None):
+    """
+    Confirms an exchange whose refund was sent but whose confirmation failed.
+    Nothing is done if the exchange is already confirmed.
+    """
+    pending_reservation = Reservation.objects.get(pk=pending_reservation_id)
+    if not pending_reservation.is_active:
+        return
+    confirm_retirement_exchange(
+        Reservation.objects.get(pk=reservation_id),
+        pending_reservation,
+        reason=reason,
     )
-    refund_res_content = refund_response.json()
 
-    refund_instance = Refund.objects.create(
-        orderline=orderline,
-        refund_date=timezone.now(),
-        amount=amount_to_refund/100,
-        details=refund_reason,
-        refund_id=refund_res_content['id'],
+
+def exchange_retirement(reservation, new_retirement, payment_token=None,
+                        single_use_token=None):
+    """
+    Exchanges the reservation for new_retirement.
+
+    The price difference is computed first. The seat is then held in a short
+    transaction, the payment API is called outside of any transaction (a
+    charge, preceded by the creation of the card of single_use_token if
+    given, or a refund), and the exchange is confirmed in a second short
+    transaction.
+
+    If the payment fails, the hold is released. If the confirmation fails
+    after a charge, the settlement is canceled and the hold released. If it
+    fails after a refund, which can't be taken back, the confirmation is
+    retried by a scheduled task.
+
+    Returns (canceled_reservation, order, charge, refund), where charge is
+    the content of the charge response, or None if there is no seat left.
+    Errors of the payment API are raised as PaymentAPIError.
+    """
+    amount = get_exchange_amount(reservation, new_retirement)
+    reason = "Exchange retirement {0} for retirement {1}".format(
+        str(reservation.retirement),
+        str(new_retirement),
     )
 
-    return refund_instance
+    held = hold_retirement_exchange(reservation, new_retirement, amount,
+                                    reason)
+    if held is None:
+        return None
+    pending_reservation, order, refund = held
+
+    charge = None
+    try:
+        if order:
+            amount = int(round(amount * Decimal(TAX_RATE + 1) * 100))
+            if amount:
+                if single_use_token:
+                    payment_token = create_card_payment_token(
+                        reservation.user,
+                        single_use_token,
+                    )
+                charge = charge_payment(
+                    amount,
+                    payment_token,
+                    str(order.id),
+                ).json()
+        elif refund:
+            refund = send_refund(refund.pk)
+    except PaymentAPIError:
+        release_retirement_exchange(pending_reservation, order, refund)
+        raise
+
+    try:
+        canceled_reservation = confirm_retirement_exchange(
+            reservation, pending_reservation, order, charge, reason
+        )
+    except Exception:
+        if refund:
+            schedule_task(
+                'retirement_exchange',
+                timezone.now(),
+                reservation_id=reservation.pk,
+                pending_reservation_id=pending_reservation.pk,
+                reason=reason,
+            )
+            raise
+        try:
+            if charge:
+                cancel_settlement(charge['settlements'][0]['id'])
+        finally:
+            release_retirement_exchange(pending_reservation, order)
+        raise
+
+    return canceled_reservation, order, charge, refund
+
+
+REFUND_WORKERS = 5
+CANCELATION_REFUND_DETAILS = "Retirement canceled"
+
+
+def cancel_retirement(retirement, refund_rate=100, custom_message=None):
+    """
+    Cancels a retirement and every one of its active reservations. The
+    retirement is deactivated first so no seat can be booked meanwhile.
+
+    Refunds are computed in one pass: refundable reservations that are the
+    only item of their order line are refunded refund_rate% of the price,
+    taxes included, the others are canceled without refund. Each refund is
+    recorded before being sent to the payment API by a pool of
+    REFUND_WORKERS threads, with a merchant reference derived from the
+    reservation.
+
+    Reservations whose refund failed stay active, so the cancelation can be
+    run again to retry them. A refund rejected by the payment API is deleted
+    so it is recorded and sent again. One whose outcome is unknown is kept
+    and sent again by the next run with the same merchant reference, which
+    the payment API doesn't refund twice. The others are canceled with bulk
+    queries and refunded users are notified by batches of emails.
+
+    Returns the number of reservations by result and the result of each
+    reservation.
+    """
+    retirement.is_active = False
+    retirement.reserved_seats = 0
+    retirement.save()
+
+    reservations = list(
+        retirement.reservations.filter(
+            is_active=True,
+        ).select_related('user', 'order_line__order').order_by('pk')
+    )
+
+    refundable = [
+        reservation for reservation in reservations
+        if reservation.refundable and reservation.order_line and
+        reservation.order_line.quantity == 1
+    ]
+    # Refunds recorded by a previous run, by order line
+    refunds = {
+        refund.orderline_id: refund
+        for refund in Refund.objects.filter(
+            orderline__in=[r.order_line_id for r in refundable],
+            details=CANCELATION_REFUND_DETAILS,
+        )
+    }
+
+    # Amounts to refund, taxes included, and their taxes by reservation
+    amounts = dict()
+    taxes = dict()
+    for reservation in refundable:
+        if reservation.order_line_id in refunds:
+            subtotal, tax = split_refund_amount(
+                refunds[reservation.order_line_id].amount
+            )
+        else:
+            subtotal, tax = get_refund_amount(
+                reservation.order_line,
+                retirement.price,
+                refund_rate,
+            )
+        if subtotal + tax:
+            amounts[reservation.pk] = subtotal + tax
+            taxes[reservation.pk] = tax
+
+    to_refund = [
+        reservation for reservation in refundable
+        if reservation.pk in amounts and
+        reservation.order_line_id not in refunds
+    ]
+    with history.atomic():
+        now = timezone.now()
+        Refund.objects.bulk_create([
+            Refund(
+                orderline=reservation.order_line,
+                refund_date=now,
+                amount=amounts[reservation.pk],
+                details=CANCELATION_REFUND_DETAILS,
+            ) for reservation in to_refund
+        ])
+        # Primary keys are not set by bulk_create on every database backend
+        created_refunds = {
+            refund.orderline_id: refund
+            for refund in Refund.objects.filter(
+                orderline__in=[r.order_line_id for r in to_refund],
+                details=CANCELATION_REFUND_DETAILS,
+            )
+        }
+        Refund.history.bulk_history_create(created_refunds.values())
+        update_refunded_totals(list(created_refunds))
+
+    # Refunds to send: the new ones and those of a previous run whose outcome
+    # is unknown, sent again with the same merchant reference
+    to_resend = list()
+    pending_refunds = dict(created_refunds)
+    refund_ids = dict()
+    for reservation in refundable:
+        refund = refunds.get(reservation.order_line_id)
+        if refund is None:
+            continue
+        if refund.refund_id:
+            refund_ids[reservation.pk] = refund.refund_id
+        else:
+            to_resend.append(reservation)
+            pending_refunds[reservation.order_line_id] = refund
+
+    def refund_reservation(reservation):
+        refund_response = refund_amount(
+            reservation.order_line.order.settlement_id,
+            int(amounts[reservation.pk] * 100),
+            reference_number="cancelation-{0}".format(reservation.pk),
+        )
+        return refund_response.json()['id']
+
+    sent = dict()
+    rejected = list()
+    errors = dict()
+    with ThreadPoolExecutor(max_workers=REFUND_WORKERS) as executor:
+        futures = {
+            executor.submit(refund_reservation, reservation): reservation
+            for reservation in to_refund + to_resend
+        }
+        for future in as_completed(futures):
+            reservation = futures[future]
+            refund = pending_refunds[reservation.order_line_id]
+            try:
+                refund_ids[reservation.pk] = sent[refund.pk] = future.result()
+            except PaymentAPIError as err:
+                errors[reservation.pk] = str(err)
+                rejected.append(refund.pk)
+            except RequestException as err:
+                errors[reservation.pk] = str(err)
+
+    now = timezone.now()
+    refunded = [r for r in reservations if r.pk in refund_ids]
+    not_refunded = [r for r in reservations if r.pk not in amounts]
+    canceled = [r.pk for r in refunded + not_refunded]
+
+    with history.atomic():
+        if sent:
+            Refund.objects.filter(pk__in=sent.keys()).update(
+                refund_id=Case(*[
+                    When(pk=refund_pk, then=Value(refund_id))
+                    for refund_pk, refund_id in sent.items()
+                ]),
+            )
+            Refund.history.bulk_history_create(
+                Refund.objects.filter(pk__in=sent.keys())
+            )
+        if rejected:
+            # These refunds were not sent, the next run sends them again
+            Refund.objects.filter(pk__in=rejected).delete(
+                force_policy=HARD_DELETE,
+            )
+            update_refunded_totals([
+                refund.orderline_id for refund in pending_refunds.values()
+                if refund.pk in rejected
+            ])
+        for action, group in (('R', refunded), ('N', not_refunded)):
+            Reservation.objects.filter(
+                pk__in=[reservation.pk for reservation in group],
+            ).update(
+                is_active=False,
+                cancelation_reason='RD',
+                cancelation_action=action,
+                cancelation_date=now,
+            )
+        invalidate_cached_responses(Reservation)
+        Reservation.history.bulk_history_create(
+            Reservation.objects.filter(pk__in=canceled)
+        )
+
+    send_cancelation_refund_emails(
+        retirement, refunded, amounts, taxes, custom_message
+    )
+
+    results = list()
+    for reservation in reservations:
+        result = {
+            'id': reservation.pk,
+            'user': reservation.user_id,
+        }
+        if reservation.pk in errors:
+            result['status'] = 'failed'
+            result['error'] = errors[reservation.pk]
+        elif reservation.pk in refund_ids:
+            result['status'] = 'refunded'
+            result['amount'] = amounts[reservation.pk]
+        else:
+            result['status'] = 'canceled'
+        results.append(result)
+
+    return {
+        'total': len(reservations),
+        'refunded': len(refunded),
+        'canceled': len(not_refunded),
+        'failed': len(errors),
+        'reservations': results,
+    }
+
+
+def send_cancelation_refund_emails(retirement, reservations, amounts, taxes,
+                                   custom_message=None):
+    """
+    Sends a refund confirmation to the users of reservations refunded by
+    cancel_retirement, by batches of NOTIFICATION_BATCH_SIZE over a shared
+    connection. amounts and taxes are the amounts refunded, taxes included,
+    and their taxes by reservation.
+    """
+    messages = list()
+    for reservation in reservations:
+        user = reservation.user
+        amount = amounts[reservation.pk]
+        old_retirement = {
+            'price': amount - taxes[reservation.pk],
+            'name': "{0}: {1}".format(_("Retirement"), retirement.name),
+        }
+        merge_data = {
+            'DATETIME': timezone.localtime().strftime("%x %X"),
+            'ORDER_ID': reservation.order_line.order_id,
+            'CUSTOMER_NAME': user.first_name + " " + user.last_name,
+            'CUSTOMER_EMAIL': user.email,
+            'CUSTOMER_NUMBER': user.id,
+            'TYPE': "Remboursement",
+            'OLD_RETIREMENT': old_retirement,
+            'COST': amount,
+            'TAX': taxes[reservation.pk],
+            'CUSTOM_MESSAGE': custom_message,
+        }
+        message = EmailMultiAlternatives(
+            "Confirmation de remboursement",
+            render_to_string("refund.txt", merge_data),
+            settings.DEFAULT_FROM_EMAIL,
+            [user.email],
+        )
+        message.attach_alternative(
+            render_to_string("refund.html", merge_data),
+            "text/html",
+        )
+        messages.append(message)
+
+    for index in range(0, len(messages), NOTIFICATION_BATCH_SIZE):
+        with get_connection() as connection:
+            connection.send_messages(
+                messages[index:index + NOTIFICATION_BATCH_SIZE]
+            )
+
+
+def compute_retirement_occupancy(start_time, end_time, period):
+    """
+    Returns the occupancy of retirements starting between start_time and
+    end_time, by time bucket: a dict of
+    {first day of bucket: list of entries by retirement}.
+
+    Uses one grouped query for the reservations and one for the
+    cancelations.
+    """
+    now = timezone.now()
+    retirements = Retirement.objects.filter(
+        start_time__gte=start_time,
+        start_time__lt=end_time,
+    ).annotate(
+        bucket=Trunc('start_time', period),
+    ).order_by('start_time', 'id')
+
+    entries = OrderedDict()
+    for retirement in retirements.values('id', 'name', 'seats', 'bucket'):
+        entries[retirement['id']] = {
+            'retirement': retirement['id'],
+            'name': retirement['name'],
+            'bucket': retirement['bucket'],
+            'capacity': retirement['seats'],
+            'reservations': 0,
+            'attended': 0,
+            'past_reservations': 0,
+            'cancelations': {},
+            'cancelation_actions': {},
+        }
+
+    reservations = Reservation.objects.filter(
+        retirement__in=retirements,
+    ).order_by()
+    past = Q(is_active=True, retirement__end_time__lt=now)
+    rows = reservations.values('retirement').annotate(
+        active=Count('id', filter=Q(is_active=True)),
+        past=Count('id', filter=past),
+        attended=Count('id', filter=past & Q(is_present=True)),
+    )
+    for row in rows:
+        entry = entries[row['retirement']]
+        entry['reservations'] = row['active']
+        entry['past_reservations'] = row['past']
+        entry['attended'] = row['attended']
+
+    rows = reservations.filter(is_active=False).values(
+        'retirement', 'cancelation_reason', 'cancelation_action',
+    ).annotate(count=Count('id'))
+    for row in rows:
+        entry = entries[row['retirement']]
+        for field, breakdown in (('cancelation_reason', 'cancelations'),
+                                 ('cancelation_action',
+                                  'cancelation_actions')):
+            key = row[field] or ''
+            entry[breakdown][key] = entry[breakdown].get(key, 0) + row['count']
+
+    occupancy = defaultdict(list)
+    for entry in entries.values():
+        entry['fill_rate'] = get_rate(
+            entry['reservations'], entry['capacity'],
+        )
+        entry['no_show_rate'] = get_rate(
+            entry['past_reservations'] - entry['attended'],
+            entry['past_reservations'],
+        )
+        bucket = timezone.localtime(entry.pop('bucket')).date()
+        occupancy[bucket].append(entry)
+    return occupancy
+
+
+def get_retirement_occupancy(start_date, end_date, period='month'):
+    """
+    Returns the occupancy of retirements between two dates (included) by
+    time bucket, cached per bucket.
+    """
+    return get_cached_analytics(
+        'retirement_occupancy',
+        start_date,
+        end_date,
+        period,
+        compute_retirement_occupancy,
+    )
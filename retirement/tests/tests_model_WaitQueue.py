@@ -50,3 +50,25 @@ class WaitQueueTests(APITestCase):
             wait_queue.__str__(),
             ', '.join(["random_retirement", str(self.user)])
         )
+
+    def test_position(self):
+        """
+        Ensure that the position of an element is its index in the wait queue
+        ordered by ascending date, ties broken by id.
+        """
+        wait_queues = [
+            WaitQueue.objects.create(
+                user=UserFactory(),
+                retirement=self.retirement,
+            ) for i in range(3)
+        ]
+        WaitQueue.objects.filter(pk=wait_queues[2].pk).update(
+            created_at=wait_queues[0].created_at,
+        )
+        wait_queues[2].refresh_from_db()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(wait_queues[1].position, 2)
+
+        self.assertEqual(wait_queues[0].position, 0)
+        self.assertEqual(wait_queues[2].position, 1)
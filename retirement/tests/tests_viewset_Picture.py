@@ -1,6 +1,8 @@
 import json
 import tempfile
+import time
 from datetime import datetime
+from unittest import mock
 
 import pytz
 from django.conf import settings
@@ -11,7 +13,8 @@ from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from blitz_api.factories import AdminFactory, UserFactory
-from blitz_api.services import remove_translation_fields
+from blitz_api.services import (remove_translation_fields,
+                                run_scheduled_tasks, )
 
 from ..models import Picture, Retirement
 
@@ -99,6 +102,7 @@ class PictureTests(APITestCase):
             'id': 2,
             'name': 'random_picture',
             'picture': 'http://testserver/media/retirements/' + fname,
+            'srcset': {},
             'url': 'http://testserver/retirement/pictures/2',
             'retirement': 'http://testserver/retirement/retirements/1'
         }
@@ -108,6 +112,17 @@ class PictureTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+        # The copies are made by a scheduled task
+        run_scheduled_tasks()
+
+        self.assertEqual(
+            Picture.objects.get(pk=2).get_srcset(),
+            {
+                '200w': '/media/retirements/' +
+                fname.replace('.png', '_200w.webp'),
+            },
+        )
+
     def test_create_without_permission(self):
         """
         Ensure we can't create a picture if user has no permission.
@@ -240,6 +255,7 @@ class PictureTests(APITestCase):
             'name_en': 'new_picture',
             'name_fr': None,
             'picture': 'http://testserver/media/retirements/' + fname,
+            'srcset': {},
             'url': 'http://testserver/retirement/pictures/1',
             'retirement': 'http://testserver/retirement/retirements/1'
         }
@@ -248,6 +264,17 @@ class PictureTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        # The copies are made by a scheduled task
+        run_scheduled_tasks()
+
+        self.assertEqual(
+            Picture.objects.get(pk=1).get_srcset(),
+            {
+                '200w': '/media/retirements/' +
+                fname.replace('.png', '_200w.webp'),
+            },
+        )
+
     def test_delete(self):
         """
         Ensure we can delete a picture.
@@ -286,6 +313,7 @@ class PictureTests(APITestCase):
                 'random_picture',
                 'picture':
                 'http://testserver' + self.picture.picture.url,
+                'srcset': {},
                 'url':
                 'http://testserver/retirement/pictures/1',
                 'retirement':
@@ -312,6 +340,7 @@ class PictureTests(APITestCase):
             'id': 1,
             'name': 'random_picture',
             'picture': 'http://testserver' + self.picture.picture.url,
+            'srcset': {},
             'url': 'http://testserver/retirement/pictures/1',
             'retirement': 'http://testserver/retirement/retirements/1'
         }
@@ -336,3 +365,216 @@ class PictureTests(APITestCase):
         self.assertEqual(json.loads(response.content), content)
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload(self):
+        """
+        Ensure we can upload a picture file straight to the storage, then
+        create the picture from it.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('retirement:picture-upload'),
+            {'filename': 'new picture.png'},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        upload = json.loads(response.content)
+        key = upload['fields']['key']
+
+        self.assertRegex(key, r'^retirements/[0-9a-f]{32}/new_picture\.png$')
+
+        data = dict(upload['fields'], file=self.picture_file)
+
+        response = self.client.post(upload['url'], data)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        data = {
+            'name': "uploaded_picture",
+            'retirement': reverse(
+                'retirement:retirement-detail', args=[self.retirement.id]),
+            'upload_token': upload['token'],
+        }
+
+        response = self.client.post(
+            reverse('retirement:picture-complete-upload'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        content = json.loads(response.content)
+
+        self.assertEqual(
+            content['picture'],
+            'http://testserver/media/' + key,
+        )
+        self.assertEqual(content['srcset'], {})
+
+        run_scheduled_tasks()
+
+        self.assertEqual(
+            list(Picture.objects.get(pk=content['id']).get_srcset()),
+            ['200w'],
+        )
+        self.assertEqual(
+            Picture.objects.get(pk=content['id']).picture.name,
+            key,
+        )
+
+    def test_complete_upload_used_token(self):
+        """
+        Ensure an upload token can only be used once.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('retirement:picture-upload'),
+            {'filename': 'picture.png'},
+            format='json',
+        )
+        upload = json.loads(response.content)
+
+        self.client.post(
+            upload['url'],
+            dict(upload['fields'], file=self.picture_file),
+        )
+
+        data = {
+            'name': "uploaded_picture",
+            'retirement': reverse(
+                'retirement:retirement-detail', args=[self.retirement.id]),
+            'upload_token': upload['token'],
+        }
+
+        response = self.client.post(
+            reverse('retirement:picture-complete-upload'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post(
+            reverse('retirement:picture-complete-upload'),
+            data,
+            format='json',
+        )
+
+        content = {
+            'upload_token': ['Invalid or expired upload, or file not sent.'],
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_complete_upload_expired_token(self):
+        """
+        Ensure an upload token can't be used once expired.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('retirement:picture-upload'),
+            {'filename': 'picture.png'},
+            format='json',
+        )
+        upload = json.loads(response.content)
+
+        self.client.post(
+            upload['url'],
+            dict(upload['fields'], file=self.picture_file),
+        )
+
+        data = {
+            'name': "uploaded_picture",
+            'retirement': reverse(
+                'retirement:retirement-detail', args=[self.retirement.id]),
+            'upload_token': upload['token'],
+        }
+
+        expired = time.time() + settings.DIRECT_UPLOADS['TOKEN_EXPIRES'] + 1
+        with mock.patch('time.time', return_value=expired):
+            response = self.client.post(
+                reverse('retirement:picture-complete-upload'),
+                data,
+                format='json',
+            )
+
+        content = {
+            'upload_token': ['Invalid or expired upload, or file not sent.'],
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_invalid_file(self):
+        """
+        Ensure we can't prepare the upload of a file that isn't an image.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('retirement:picture-upload'),
+            {'filename': 'document.txt'},
+            format='json',
+        )
+
+        content = {'filename': ['Only image files can be uploaded.']}
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_without_permission(self):
+        """
+        Ensure we can't prepare an upload if user has no permission.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(
+            reverse('retirement:picture-upload'),
+            {'filename': 'picture.png'},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_complete_upload_file_not_sent(self):
+        """
+        Ensure we can't create a picture if its file wasn't uploaded.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('retirement:picture-upload'),
+            {'filename': 'picture.png'},
+            format='json',
+        )
+
+        data = {
+            'name': "uploaded_picture",
+            'retirement': reverse(
+                'retirement:retirement-detail', args=[self.retirement.id]),
+            'upload_token': json.loads(response.content)['token'],
+        }
+
+        response = self.client.post(
+            reverse('retirement:picture-complete-upload'),
+            data,
+            format='json',
+        )
+
+        content = {
+            'upload_token': ['Invalid or expired upload, or file not sent.'],
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -12,6 +12,7 @@ from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
 from django.core import mail
+from django.db import DatabaseError
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth import get_user_model
 from django.test.utils import override_settings
@@ -19,15 +20,16 @@ from django.test.utils import override_settings
 from unittest import mock
 
 from blitz_api.factories import UserFactory, AdminFactory
-from blitz_api.services import remove_translation_fields
+from blitz_api.models import ScheduledTask
+from blitz_api.services import (remove_translation_fields,
+                                run_scheduled_tasks, )
 
 from store.models import Order, OrderLine, Refund
-from store.tests.paysafe_sample_responses import (SAMPLE_REFUND_RESPONSE,
-                                                  SAMPLE_NO_AMOUNT_TO_REFUND,
-                                                  SAMPLE_PAYMENT_RESPONSE,
-                                                  SAMPLE_PROFILE_RESPONSE,
-                                                  SAMPLE_CARD_RESPONSE,
-                                                  UNKNOWN_EXCEPTION, )
+from store.tests.paysafe_sample_responses import (
+    SAMPLE_REFUND_RESPONSE, SAMPLE_NO_AMOUNT_TO_REFUND,
+    SAMPLE_PAYMENT_RESPONSE, SAMPLE_PROFILE_RESPONSE, SAMPLE_CARD_RESPONSE,
+    SAMPLE_CARD_REFUSED, SAMPLE_INVALID_SINGLE_USE_TOKEN, UNKNOWN_EXCEPTION,
+)
 
 from ..models import Retirement, Reservation
 
@@ -219,6 +221,7 @@ class ReservationTests(APITestCase):
                 'longitude': None,
                 'name': 'random_retirement',
                 'pictures': [],
+                'pictures_srcset': [],
                 'postal_code': '123 456',
                 'reserved_seats': 0,
                 'seats': 40,
@@ -768,6 +771,10 @@ class ReservationTests(APITestCase):
 
         self.assertEqual(response_data, content)
 
+        # Nothing is saved when the exchange is refused
+        self.reservation.refresh_from_db()
+        self.assertFalse(self.reservation.is_present)
+
     def test_update_partial_same_retirement(self):
         """
         Ensure we can't update a reservation if the new retirement has no free
@@ -1095,6 +1102,11 @@ class ReservationTests(APITestCase):
         )
         self.assertEqual(refund.refund_date, FIXED_TIME)
 
+        # The refund is sent to the payment API by a scheduled task
+        self.assertIsNone(refund.refund_id)
+        task = ScheduledTask.objects.get(name='refund')
+        self.assertEqual(task.arguments, {'refund_id': refund.id})
+
         # 1 mail confirming the exchange
         # 1 mail confirming the participation to the new retirement
         # 1 mail confirming the new order
@@ -1103,6 +1115,136 @@ class ReservationTests(APITestCase):
         self.retirement2.price = 199
         self.retirement2.save()
 
+    @responses.activate
+    def test_update_partial_more_expensive_retirement_payment_refused(self):
+        """
+        Ensure that the reservation is left untouched if the payment of a
+        more expensive retirement is refused.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        self.retirement2.price = 999
+        self.retirement2.save()
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths/",
+            json=SAMPLE_CARD_REFUSED,
+            status=400
+        )
+
+        order_count = Order.objects.count()
+
+        data = {
+            'retirement': reverse(
+                'retirement:retirement-detail',
+                kwargs={'pk': 2},
+            ),
+            'payment_token': "valid_token"
+        }
+
+        response = self.client.patch(
+            reverse(
+                'retirement:reservation-detail',
+                kwargs={'pk': 1},
+            ),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST,
+            response.content
+        )
+        self.assertIn('message', json.loads(response.content))
+
+        self.reservation.refresh_from_db()
+
+        self.assertEqual(self.reservation.retirement, self.retirement)
+        self.assertEqual(self.reservation.order_line, self.order_line)
+        self.assertFalse(
+            Reservation.all_objects.filter(is_active=False).exists()
+        )
+        self.assertEqual(Order.objects.count(), order_count)
+        self.assertFalse(Refund.objects.exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.retirement2.price = 199
+        self.retirement2.save()
+
+    @responses.activate
+    def test_update_partial_more_expensive_retirement_confirmation_failed(
+            self):
+        """
+        Ensure that the settlement is canceled and the reservation left
+        untouched if the exchange can't be confirmed after the charge.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        self.retirement2.price = 999
+        self.retirement2.save()
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths/",
+            json=SAMPLE_PAYMENT_RESPONSE,
+            status=200
+        )
+
+        responses.add(
+            responses.PUT,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1",
+            json=SAMPLE_PAYMENT_RESPONSE['settlements'][0],
+            status=200
+        )
+
+        order_count = Order.objects.count()
+
+        data = {
+            'retirement': reverse(
+                'retirement:retirement-detail',
+                kwargs={'pk': 2},
+            ),
+            'payment_token': "valid_token"
+        }
+
+        with mock.patch(
+                'retirement.services.confirm_retirement_exchange',
+                side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.patch(
+                    reverse(
+                        'retirement:reservation-detail',
+                        kwargs={'pk': 1},
+                    ),
+                    data,
+                    format='json',
+                )
+
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(
+            json.loads(responses.calls[1].request.body),
+            {'status': "CANCELLED"},
+        )
+
+        self.reservation.refresh_from_db()
+
+        self.assertEqual(self.reservation.retirement, self.retirement)
+        self.assertEqual(self.reservation.order_line, self.order_line)
+        self.assertFalse(
+            Reservation.all_objects.filter(
+                user=self.user,
+                retirement=self.retirement2,
+            ).exists()
+        )
+        self.assertEqual(Order.objects.count(), order_count)
+        self.assertFalse(Refund.objects.exists())
+
+        self.retirement2.price = 199
+        self.retirement2.save()
+
     @responses.activate
     def test_update_partial_more_expensive_retirement_single_use_token(self):
         """
@@ -1240,6 +1382,76 @@ class ReservationTests(APITestCase):
         self.retirement2.price = 199
         self.retirement2.save()
 
+    @responses.activate
+    def test_update_partial_more_expensive_retirement_card_refused(self):
+        """
+        Ensure that the reservation is left untouched, and nothing is
+        charged, if the card of a single_use_token can't be created.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        self.retirement2.price = 999
+        self.retirement2.save()
+
+        responses.add(
+            responses.POST,
+            "http://example.com/customervault/v1/profiles/",
+            json=SAMPLE_PROFILE_RESPONSE,
+            status=201
+        )
+
+        responses.add(
+            responses.POST,
+            "http://example.com/customervault/v1/profiles/123/cards/",
+            json=SAMPLE_INVALID_SINGLE_USE_TOKEN,
+            status=400
+        )
+
+        order_count = Order.objects.count()
+
+        FIXED_TIME = datetime(2018, 1, 1, tzinfo=LOCAL_TIMEZONE)
+
+        data = {
+            'retirement': reverse(
+                'retirement:retirement-detail',
+                kwargs={'pk': 2},
+            ),
+            'single_use_token': "invalid_token"
+        }
+
+        with mock.patch(
+                'django.utils.timezone.now', return_value=FIXED_TIME):
+            response = self.client.patch(
+                reverse(
+                    'retirement:reservation-detail',
+                    kwargs={'pk': 1},
+                ),
+                data,
+                format='json',
+            )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST,
+            response.content
+        )
+        self.assertIn('message', json.loads(response.content))
+
+        self.reservation.refresh_from_db()
+
+        self.assertEqual(self.reservation.retirement, self.retirement)
+        self.assertEqual(self.reservation.order_line, self.order_line)
+        self.assertEqual(
+            Reservation.all_objects.filter(user=self.user).count(), 1
+        )
+        self.assertEqual(Order.objects.count(), order_count)
+        # The profile and the card were sent, but no payment
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.retirement2.price = 199
+        self.retirement2.save()
+
     @responses.activate
     def test_update_partial_less_expensive_retirement(self):
         """
@@ -1339,6 +1551,74 @@ class ReservationTests(APITestCase):
         self.retirement2.price = 199
         self.retirement2.save()
 
+    @responses.activate
+    def test_update_partial_less_expensive_retirement_confirmation_failed(
+            self):
+        """
+        Ensure that a refund already sent is kept and that the exchange is
+        confirmed later if its confirmation fails.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        self.retirement2.price = 99
+        self.retirement2.save()
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds",
+            json=SAMPLE_REFUND_RESPONSE,
+            status=200
+        )
+
+        data = {
+            'retirement': reverse(
+                'retirement:retirement-detail',
+                kwargs={'pk': 2},
+            ),
+        }
+
+        with mock.patch(
+                'retirement.services.confirm_retirement_exchange',
+                side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.patch(
+                    reverse(
+                        'retirement:reservation-detail',
+                        kwargs={'pk': 1},
+                    ),
+                    data,
+                    format='json',
+                )
+
+        refund = Refund.objects.get(orderline=self.order_line)
+        self.assertEqual(refund.refund_id, SAMPLE_REFUND_RESPONSE['id'])
+
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.retirement, self.retirement)
+
+        self.assertTrue(
+            ScheduledTask.objects.filter(
+                name='retirement_exchange',
+                status='P',
+            ).exists()
+        )
+
+        run_scheduled_tasks()
+
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.retirement, self.retirement2)
+
+        canceled_reservation = Reservation.objects.get(is_active=False)
+        self.assertEqual(canceled_reservation.cancelation_action, 'E')
+        self.assertEqual(canceled_reservation.retirement, self.retirement)
+        self.assertEqual(canceled_reservation.order_line, self.order_line)
+
+        self.assertEqual(len(responses.calls), 1)
+
+        self.retirement2.price = 199
+        self.retirement2.save()
+
     def test_update_partial_with_forbidden_fields(self):
         """
         Ensure we can't partially update a reservation (other fields).
@@ -1723,10 +2003,10 @@ class ReservationTests(APITestCase):
         self.reservation.save()
 
     @responses.activate
-    def test_delete_scheduler_error(self):
+    def test_delete_schedule_wait_queue_notification(self):
         """
-        Ensure emails were sent to admins if the API fails to schedule
-        notifications.
+        Ensure that the notification of the wait queue is scheduled when the
+        first seat of a full retirement is freed.
         """
         self.client.force_authenticate(user=self.admin)
 
@@ -1741,12 +2021,6 @@ class ReservationTests(APITestCase):
             status=200
         )
 
-        responses.add(
-            responses.POST,
-            settings.EXTERNAL_SCHEDULER['URL'],
-            status=400
-        )
-
         FIXED_TIME = datetime(2018, 1, 1, tzinfo=LOCAL_TIMEZONE)
 
         with mock.patch(
@@ -1775,9 +2049,15 @@ class ReservationTests(APITestCase):
         self.reservation_admin.cancelation_date = None
         self.reservation_admin.cancelation_reason = None
 
+        task = ScheduledTask.objects.get(name='wait_queue_notification')
+        self.assertEqual(task.status, 'P')
+        self.assertEqual(
+            task.execution_date,
+            FIXED_TIME + timedelta(minutes=5),
+        )
+
         # 1 mail for the refund
-        # X mails to every admin
-        self.assertTrue(len(mail.outbox) > 1, "Invalid sent mail count")
+        self.assertEqual(len(mail.outbox), 1)
 
         self.retirement2.seats = 400
         self.retirement2.save()
@@ -1,13 +1,17 @@
 import json
 from datetime import datetime, timedelta
+from decimal import Decimal
 
 import pytz
 import responses
+from requests.exceptions import ConnectionError
 from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.core import mail
+from django.core.cache import cache
 from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
@@ -15,14 +19,20 @@ from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from blitz_api.factories import AdminFactory, UserFactory
+from blitz_api.models import ScheduledTask
 from blitz_api.services import remove_translation_fields
+from store.models import Order, OrderLine, Refund
+from store.tests.paysafe_sample_responses import (SAMPLE_REFUND_RESPONSE,
+                                                  UNKNOWN_EXCEPTION, )
 
-from ..models import Retirement
+from ..models import Reservation, Retirement
 
 User = get_user_model()
 
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
+TAX_RATE = settings.LOCAL_SETTINGS['SELLING_TAX']
+
 
 class RetirementTests(APITestCase):
 
@@ -78,33 +88,13 @@ class RetirementTests(APITestCase):
             review_url='example3.com',
         )
 
-    @override_settings(
-        EXTERNAL_SCHEDULER={
-            'URL': "http://example.com",
-            'USER': "user",
-            'PASSWORD': "password",
-        }
-    )
-    @responses.activate
     def test_create(self):
         """
         Ensure we can create a retirement if user has permission.
+        Its reminder and recap emails should be scheduled.
         """
         self.client.force_authenticate(user=self.admin)
 
-        responses.add(
-            responses.POST,
-            "http://example.com/authentication",
-            json={"token": "1234567890"},
-            status=200
-        )
-
-        responses.add(
-            responses.POST,
-            "http://example.com/tasks",
-            status=200
-        )
-
         data = {
             'name': "random_retirement",
             'seats': 40,
@@ -156,6 +146,7 @@ class RetirementTests(APITestCase):
             'next_user_notified': 0,
             'notification_interval': '1 00:00:00',
             'pictures': [],
+            'pictures_srcset': [],
             'start_time': '2130-01-15T12:00:00-05:00',
             'end_time': '2130-01-17T16:00:00-05:00',
             'seats': 40,
@@ -186,6 +177,26 @@ class RetirementTests(APITestCase):
             content
         )
 
+        tasks = ScheduledTask.objects.order_by('execution_date')
+        self.assertEqual(
+            [
+                (task.name, task.arguments, task.execution_date)
+                for task in tasks
+            ],
+            [
+                (
+                    'retirement_reminder',
+                    {'retirement_id': 3},
+                    LOCAL_TIMEZONE.localize(datetime(2130, 1, 8, 8)),
+                ),
+                (
+                    'retirement_recap',
+                    {'retirement_id': 3},
+                    LOCAL_TIMEZONE.localize(datetime(2130, 1, 18)),
+                ),
+            ]
+        )
+
     def test_create_invalid_refund_rate(self):
         """
         Ensure we can't create a retirement if refund_rate is not between
@@ -468,6 +479,7 @@ class RetirementTests(APITestCase):
             'longitude': None,
             'name': 'New Name',
             'pictures': [],
+            'pictures_srcset': [],
             'start_time': '2130-01-15T08:00:00-05:00',
             'end_time': '2130-01-17T12:00:00-05:00',
             'seats': 40,
@@ -559,6 +571,7 @@ class RetirementTests(APITestCase):
                     'longitude': None,
                     'name': 'mega_retirement',
                     'pictures': [],
+                    'pictures_srcset': [],
                     'start_time': '2130-01-15T08:00:00-05:00',
                     'end_time': '2130-01-17T12:00:00-05:00',
                     'seats': 400,
@@ -622,6 +635,7 @@ class RetirementTests(APITestCase):
                 'longitude': None,
                 'name': 'ultra_retirement',
                 'pictures': [],
+                'pictures_srcset': [],
                 'start_time': '2140-01-15T08:00:00-05:00',
                 'end_time': '2140-01-17T12:00:00-05:00',
                 'seats': 400,
@@ -679,6 +693,7 @@ class RetirementTests(APITestCase):
             'longitude': None,
             'name': 'mega_retirement',
             'pictures': [],
+            'pictures_srcset': [],
             'start_time': '2130-01-15T08:00:00-05:00',
             'end_time': '2130-01-17T12:00:00-05:00',
             'seats': 400,
@@ -743,6 +758,7 @@ class RetirementTests(APITestCase):
             'longitude': None,
             'name': 'mega_retirement',
             'pictures': [],
+            'pictures_srcset': [],
             'start_time': '2130-01-15T08:00:00-05:00',
             'end_time': '2130-01-17T12:00:00-05:00',
             'reserved_seats': 0,
@@ -819,6 +835,42 @@ class RetirementTests(APITestCase):
             self.retirement.reservations.filter(is_active=True).count()
         )
 
+    def test_reminder_email_resumed(self):
+        """
+        Ensure that users are reminded only once, even if the reminder is
+        triggered again.
+        """
+        Reservation.objects.create(
+            user=self.admin,
+            retirement=self.retirement,
+            is_active=True,
+            reminder_sent=timezone.now(),
+        )
+        reservation = Reservation.objects.create(
+            user=self.user,
+            retirement=self.retirement,
+            is_active=True,
+        )
+
+        for i in range(2):
+            with mock.patch(
+                    'retirement.views.timezone.now',
+                    return_value=self.retirement.start_time):
+                response = self.client.get(
+                    reverse(
+                        'retirement:retirement-remind-users',
+                        kwargs={'pk': 1},
+                    ),
+                )
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+
+        reservation.refresh_from_db()
+        self.assertIsNotNone(reservation.reminder_sent)
+
     def test_reminder_email_too_early(self):
         """
         Ensure we can't send emails too early. Prevents spamming by anonymous
@@ -893,3 +945,302 @@ class RetirementTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         self.assertEqual(len(mail.outbox), 0)
+
+    def test_occupancy(self):
+        """
+        Ensure that admins can get the occupancy of retirements by month.
+        """
+        cache.clear()
+        self.client.force_authenticate(user=self.admin)
+
+        Reservation.objects.create(
+            user=self.admin,
+            retirement=self.retirement,
+            is_active=True,
+        )
+        Reservation.objects.create(
+            user=self.user,
+            retirement=self.retirement,
+            is_active=False,
+            cancelation_reason='U',
+            cancelation_action='R',
+        )
+
+        response = self.client.get(
+            reverse('retirement:retirement-occupancy'),
+            {'start_date': '2130-01-01', 'end_date': '2130-01-31'},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        content = [{
+            'period': '2130-01-01',
+            'retirement': self.retirement.id,
+            'name': 'mega_retirement',
+            'capacity': 400,
+            'reservations': 1,
+            'attended': 0,
+            'past_reservations': 0,
+            'cancelations': {'U': 1},
+            'cancelation_actions': {'R': 1},
+            'fill_rate': 0.0025,
+            'no_show_rate': None,
+        }]
+
+        self.assertEqual(json.loads(response.content), content)
+
+    def test_occupancy_invalid_dates(self):
+        """
+        Ensure that the start date must precede the end date.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.get(
+            reverse('retirement:retirement-occupancy'),
+            {'start_date': '2130-01-31', 'end_date': '2130-01-01'},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        content = {
+            'end_date': ['End date must be later than start_date.'],
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+    @override_settings(
+        PAYSAFE={
+            'ACCOUNT_NUMBER': "0123456789",
+            'USER': "user",
+            'PASSWORD': "password",
+            'BASE_URL': "http://example.com/",
+            'VAULT_URL': "customervault/v1/",
+            'CARD_URL': "cardpayments/v1/"
+        }
+    )
+    @responses.activate
+    def test_cancel(self):
+        """
+        Ensure that admins can cancel a retirement with all its reservations
+        and that failed refunds are reported and can be retried.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds",
+            json=SAMPLE_REFUND_RESPONSE,
+            status=200
+        )
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/2/refunds",
+            json=UNKNOWN_EXCEPTION,
+            status=400
+        )
+
+        users = [self.user, self.admin, UserFactory()]
+        reservations = list()
+        for index, user in enumerate(users):
+            order = Order.objects.create(
+                user=user,
+                transaction_date=timezone.now(),
+                authorization_id=1,
+                settlement_id=index + 1,
+            )
+            order_line = OrderLine.objects.create(
+                order=order,
+                quantity=1,
+                content_type=ContentType.objects.get_for_model(Retirement),
+                object_id=self.retirement.id,
+                cost=self.retirement.price,
+            )
+            reservations.append(Reservation.objects.create(
+                user=user,
+                retirement=self.retirement,
+                order_line=order_line,
+                is_active=True,
+                refundable=index < 2,
+            ))
+
+        response = self.client.post(
+            reverse(
+                'retirement:retirement-cancel',
+                kwargs={'pk': self.retirement.id},
+            ),
+            {'custom_message': "Canceled because of the weather."},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        amount = round(self.retirement.price * Decimal(TAX_RATE + 1), 2)
+        response_data = json.loads(response.content)
+
+        self.assertEqual(response_data['total'], 3)
+        self.assertEqual(response_data['refunded'], 1)
+        self.assertEqual(response_data['canceled'], 1)
+        self.assertEqual(response_data['failed'], 1)
+        self.assertEqual(
+            [result['status'] for result in response_data['reservations']],
+            ['refunded', 'failed', 'canceled'],
+        )
+        self.assertEqual(
+            Decimal(str(response_data['reservations'][0]['amount'])),
+            amount,
+        )
+
+        for reservation in reservations:
+            reservation.refresh_from_db()
+
+        self.assertEqual(reservations[0].cancelation_action, 'R')
+        self.assertEqual(reservations[0].cancelation_reason, 'RD')
+        self.assertTrue(reservations[1].is_active)
+        self.assertEqual(reservations[2].cancelation_action, 'N')
+
+        refund = Refund.objects.get()
+
+        self.assertEqual(refund.orderline, reservations[0].order_line)
+        self.assertEqual(refund.amount, amount)
+        self.assertEqual(refund.refund_id, SAMPLE_REFUND_RESPONSE['id'])
+        # Recorded before being sent, then updated with its refund_id
+        self.assertEqual(refund.history.count(), 2)
+        self.assertEqual(
+            json.loads(responses.calls[0].request.body)['merchantRefNum'][:12],
+            "cancelation-",
+        )
+
+        self.retirement.refresh_from_db()
+
+        self.assertFalse(self.retirement.is_active)
+
+        # Only the refunded user is notified
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("Canceled because of the weather.", mail.outbox[0].body)
+
+        # Retrying only sends the refund that failed
+        response = self.client.post(
+            reverse(
+                'retirement:retirement-cancel',
+                kwargs={'pk': self.retirement.id},
+            ),
+        )
+
+        self.assertEqual(json.loads(response.content)['total'], 1)
+        self.assertEqual(len(responses.calls), 3)
+
+    @override_settings(
+        PAYSAFE={
+            'ACCOUNT_NUMBER': "0123456789",
+            'USER': "user",
+            'PASSWORD': "password",
+            'BASE_URL': "http://example.com/",
+            'VAULT_URL': "customervault/v1/",
+            'CARD_URL': "cardpayments/v1/"
+        }
+    )
+    @responses.activate
+    def test_cancel_refund_outcome_unknown(self):
+        """
+        Ensure that a refund whose outcome is unknown is kept and sent again,
+        with the same merchant reference, when the cancelation is retried.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        refund_url = (
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds"
+        )
+        responses.add(
+            responses.POST,
+            refund_url,
+            body=ConnectionError(),
+        )
+
+        order = Order.objects.create(
+            user=self.user,
+            transaction_date=timezone.now(),
+            authorization_id=1,
+            settlement_id=1,
+        )
+        order_line = OrderLine.objects.create(
+            order=order,
+            quantity=1,
+            content_type=ContentType.objects.get_for_model(Retirement),
+            object_id=self.retirement.id,
+            cost=self.retirement.price,
+        )
+        reservation = Reservation.objects.create(
+            user=self.user,
+            retirement=self.retirement,
+            order_line=order_line,
+            is_active=True,
+        )
+
+        url = reverse(
+            'retirement:retirement-cancel',
+            kwargs={'pk': self.retirement.id},
+        )
+
+        response = self.client.post(url)
+
+        self.assertEqual(json.loads(response.content)['failed'], 1)
+
+        refund = Refund.objects.get()
+
+        self.assertEqual(refund.orderline, order_line)
+        self.assertIsNone(refund.refund_id)
+
+        reservation.refresh_from_db()
+
+        self.assertTrue(reservation.is_active)
+
+        responses.replace(
+            responses.POST,
+            refund_url,
+            json=SAMPLE_REFUND_RESPONSE,
+            status=200,
+        )
+
+        response = self.client.post(url)
+
+        self.assertEqual(json.loads(response.content)['refunded'], 1)
+        self.assertEqual(json.loads(response.content)['failed'], 0)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(
+            [
+                json.loads(call.request.body)['merchantRefNum']
+                for call in responses.calls
+            ],
+            ["cancelation-{0}".format(reservation.pk)] * 2,
+        )
+        self.assertEqual(Refund.objects.count(), 1)
+
+        refund.refresh_from_db()
+
+        self.assertEqual(refund.refund_id, SAMPLE_REFUND_RESPONSE['id'])
+
+        reservation.refresh_from_db()
+
+        self.assertFalse(reservation.is_active)
+
+    def test_cancel_without_permission(self):
+        """
+        Ensure that only admins can cancel a retirement.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(
+            reverse(
+                'retirement:retirement-cancel',
+                kwargs={'pk': self.retirement.id},
+            ),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.retirement.refresh_from_db()
+
+        self.assertTrue(self.retirement.is_active)
@@ -553,3 +553,60 @@ class WaitQueueNotificationTests(APITestCase):
         }
 
         self.assertEqual(response_data, content)
+
+    def test_notify_many_retirements(self):
+        """
+        Ensure that wait queues of all retirements are notified with a
+        constant number of queries.
+        """
+        retirements = list()
+        for i in range(3):
+            retirement = Retirement.objects.create(
+                name="retirement{0}".format(i),
+                seats=400,
+                price=199,
+                start_time=LOCAL_TIMEZONE.localize(datetime(2130, 1, 15, 8)),
+                end_time=LOCAL_TIMEZONE.localize(datetime(2130, 1, 17, 12)),
+                min_day_refund=7,
+                min_day_exchange=7,
+                refund_rate=50,
+                is_active=True,
+                reserved_seats=1,
+                accessibility=True,
+            )
+            for user in (self.user, self.user2):
+                WaitQueue.objects.create(user=user, retirement=retirement)
+            retirements.append(retirement)
+
+        with self.assertNumQueries(12):
+            response = self.client.get(
+                reverse('retirement:waitqueuenotification-notify'),
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        for retirement in retirements:
+            retirement.refresh_from_db()
+            self.assertEqual(retirement.reserved_seats, 1)
+            self.assertEqual(retirement.next_user_notified, 1)
+            self.assertEqual(
+                list(retirement.wait_queue_notifications.values_list(
+                    'user', flat=True,
+                )),
+                [self.user.id],
+            )
+
+        self.assertEqual(
+            WaitQueueNotification.history.filter(
+                retirement__in=retirements,
+                history_type='+',
+            ).count(),
+            3,
+        )
+
+        # The wait queue of self.retirement is empty
+        self.retirement.refresh_from_db()
+        self.assertEqual(self.retirement.reserved_seats, 0)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
@@ -1,6 +1,8 @@
 import simple_history
 from modeltranslation.translator import TranslationOptions, register
 
+from blitz_api.history import BufferedHistoricalRecords
+
 from . import models
 
 
@@ -22,5 +24,9 @@ class PictureTranslationOptions(TranslationOptions):
     fields = ('name', )
 
 
-simple_history.register(models.Retirement, inherit=True)
-simple_history.register(models.Picture, inherit=True)
+simple_history.register(
+    models.Retirement, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.Picture, inherit=True, records_class=BufferedHistoricalRecords
+)
@@ -1,25 +1,22 @@
-from decimal import Decimal
-import json
 from copy import copy
 from datetime import datetime, timedelta
 
-import requests
-import traceback
-
 import pytz
 import rest_framework
 
 from blitz_api.exceptions import MailServiceError
-from blitz_api.services import send_mail, ExportPagination
+from blitz_api import history
+from blitz_api.cache import CachedResponseMixin
+from blitz_api.serializers import (AnalyticsQuerySerializer,
+                                   ImageUploadSerializer)
+from blitz_api.services import (create_direct_upload, send_mail,
+                                ExportPagination, save_fields)
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.mail import mail_admins
 from django.core.mail import send_mail as django_send_mail
-from django.db import transaction
 from django.db.models import F
 from django.http import HttpResponse
 from django.template.loader import render_to_string
-from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import exceptions, mixins, status, viewsets, serializers
@@ -29,25 +26,25 @@ from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from store.exceptions import PaymentAPIError
 from store.models import Refund
-from store.services import refund_amount, PAYSAFE_EXCEPTION
+from store.services import (get_refund_amount, refund_amount,
+                            update_refunded_totals, PAYSAFE_EXCEPTION, )
 
 from . import permissions, serializers
 from .models import (Picture, Reservation, Retirement, WaitQueue,
                      WaitQueueNotification)
 from .resources import (ReservationResource, RetirementResource,
                         WaitQueueNotificationResource, WaitQueueResource)
-from .services import (notify_reserved_retirement_seat,
-                       send_retirement_7_days_email,
-                       send_post_retirement_email, )
+from .services import (cancel_retirement, get_retirement_occupancy,
+                       notify_wait_queues, recap_retirement_users,
+                       remind_retirement_users,
+                       schedule_wait_queue_notification, )
 
 User = get_user_model()
 
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
-TAX = settings.LOCAL_SETTINGS['SELLING_TAX']
-
 
-class RetirementViewSet(viewsets.ModelViewSet):
+class RetirementViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given retirement.
@@ -61,6 +58,11 @@ class RetirementViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.RetirementSerializer
     queryset = Retirement.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly, )
+    cache_models = (
+        'retirement.Retirement',
+        'retirement.Picture',
+        'retirement.Reservation',
+    )
     filter_fields = {
         'start_time': ['exact', 'gte', 'lte'],
         'end_time': ['exact', 'gte', 'lte'],
@@ -73,9 +75,19 @@ class RetirementViewSet(viewsets.ModelViewSet):
         This viewset should return active retirements except if
         the currently authenticated user is an admin (is_staff).
         """
+        queryset = Retirement.objects.prefetch_related('pictures')
         if self.request.user.is_staff:
-            return Retirement.objects.all()
-        return Retirement.objects.filter(is_active=True)
+            return queryset
+        return queryset.filter(is_active=True)
+
+    def use_cached_response(self, request):
+        """
+        The retirements retrieved by admins contain their users, whose
+        changes don't invalidate the cache.
+        """
+        if self.action == 'retrieve' and request.user.is_staff:
+            return False
+        return super(RetirementViewSet, self).use_cached_response(request)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -104,6 +116,52 @@ class RetirementViewSet(viewsets.ModelViewSet):
         ])
         return response
 
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def occupancy(self, request):
+        """
+        This custom action returns, by time bucket and retirement, the
+        capacity, the number of active reservations, the fill rate, the
+        attendance, the no-show rate and the number of cancelations by
+        reason and by action.
+
+        Query parameters:
+            start_date, end_date: date range of the report (included).
+            period: "day" or "month" (default).
+        """
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+
+        serializer.is_valid(raise_exception=True)
+
+        return Response(get_retirement_occupancy(**serializer.validated_data))
+
+    @action(methods=['post'], detail=True, permission_classes=[IsAdminUser])
+    def cancel(self, request, pk=None):
+        """
+        This custom action allows an admin to cancel a retirement and all of
+        its active reservations at once. The retirement is deactivated.
+
+        Optional parameters:
+            refund_rate: percentage of the price refunded to users of
+                refundable reservations (default: 100).
+            custom_message: message added to the refund confirmation emails.
+
+        Reservations whose refund failed are left active. Calling this action
+        again retries them without refunding the others twice.
+
+        The response contains the number of reservations refunded, canceled
+        without refund and failed, then the result of each reservation.
+        """
+        retirement = self.get_object()
+        serializer = serializers.RetirementCancelationSerializer(
+            data=request.data
+        )
+
+        serializer.is_valid(raise_exception=True)
+
+        report = cancel_retirement(retirement, **serializer.validated_data)
+
+        return Response(report, status=status.HTTP_200_OK)
+
     @action(detail=True, permission_classes=[])
     def remind_users(self, request, pk=None):
         """
@@ -120,9 +178,7 @@ class RetirementViewSet(viewsets.ModelViewSet):
             }
             return Response(response_data, status=status.HTTP_200_OK)
 
-        # Notify a user for every reserved seat
-        for reservation in retirement.reservations.filter(is_active=True):
-            send_retirement_7_days_email(reservation.user, retirement)
+        remind_retirement_users(retirement.id)
 
         response_data = {
             'stop': True,
@@ -145,9 +201,7 @@ class RetirementViewSet(viewsets.ModelViewSet):
             }
             return Response(response_data, status=status.HTTP_200_OK)
 
-        # Notify a user for every reserved seat
-        for reservation in retirement.reservations.filter(is_active=True):
-            send_post_retirement_email(reservation.user, retirement)
+        recap_retirement_users(retirement.id)
 
         response_data = {
             'stop': True,
@@ -176,6 +230,42 @@ class PictureViewSet(viewsets.ModelViewSet):
         'retirement',
     }
 
+    @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
+    def upload(self, request):
+        """
+        This custom action prepares the upload of a picture file straight to
+        the media storage, without going through the API.
+
+        The returned "fields", followed by the file as "file", are POSTed as
+        a multipart form to the returned "url". The picture is then created
+        with the complete_upload action and the returned "token".
+        """
+        serializer = ImageUploadSerializer(data=request.data)
+
+        serializer.is_valid(raise_exception=True)
+
+        return Response(create_direct_upload(
+            Picture._meta.get_field('picture'),
+            serializer.validated_data['filename'],
+            request,
+        ))
+
+    @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
+    def complete_upload(self, request):
+        """
+        This custom action creates a picture from a file uploaded as
+        prepared by the upload action, given as "upload_token".
+        """
+        serializer = serializers.PictureUploadSerializer(
+            data=request.data,
+            context=self.get_serializer_context(),
+        )
+
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 class ReservationViewSet(viewsets.ModelViewSet):
     """
@@ -284,8 +374,9 @@ class ReservationViewSet(viewsets.ModelViewSet):
         respects_minimum_days = (
             (retirement.start_time - timezone.now()) >=
             timedelta(days=retirement.min_day_refund))
+        total_amount = tax = 0
 
-        with transaction.atomic():
+        with history.atomic():
             # No need to check for previous refunds because a refunded
             # reservation == canceled reservation, thus not active.
             if reservation_active:
@@ -298,25 +389,24 @@ class ReservationViewSet(viewsets.ModelViewSet):
                         )]
                     })
                 if respects_minimum_days and instance.refundable:
+                    subtotal, tax = get_refund_amount(
+                        order_line,
+                        retirement.price,
+                        retirement.refund_rate,
+                    )
+                    total_amount = subtotal + tax
+                if total_amount:
                     try:
-                        amount = retirement.price
-                        # The refund_rate converts in cents at the same time
-                        amount_no_tax = Decimal(
-                            amount * retirement.refund_rate
-                        )
-                        amount_tax = Decimal(TAX) * amount_no_tax
-                        total_amount = round(Decimal(
-                            amount_no_tax + amount_tax
-                        ), 2)
                         refund_instance = Refund.objects.create(
                             orderline=order_line,
                             refund_date=timezone.now(),
-                            amount=total_amount/100,
+                            amount=total_amount,
                             details="Reservation canceled",
                         )
+                        update_refunded_totals([order_line.pk])
                         refund_response = refund_amount(
                             order.settlement_id,
-                            int(round(total_amount))
+                            int(total_amount * 100)
                         )
                         refund_res_content = refund_response.json()
                         refund_instance.refund_id = refund_res_content['id']
@@ -350,67 +440,24 @@ class ReservationViewSet(viewsets.ModelViewSet):
                 free_seats = retirement.seats - retirement.total_reservations
                 if (retirement.reserved_seats or free_seats == 1):
                     retirement.reserved_seats += 1
-                # Ask the external scheduler to start calling /notify if the
-                # reserved_seats count == 1. Otherwise, the scheduler should
-                # already be calling /notify at specified intervals.
+                # Start notifying the wait queue if the reserved_seats
+                # count == 1. Otherwise, the notification is already
+                # scheduled to run at specified intervals.
                 #
                 # Since we are in the context of a cancelation, if
                 # reserved_seats equals 1, that means that this is the first
                 # cancelation.
                 if retirement.reserved_seats == 1:
-                    scheduler_url = '{0}'.format(
-                        settings.EXTERNAL_SCHEDULER['URL'],
-                    )
-
-                    data = {
-                        "hour": timezone.now().hour,
-                        "minute": (timezone.now().minute + 5) % 60,
-                        "url": '{0}{1}'.format(
-                            request.build_absolute_uri(
-                                reverse(
-                                    'retirement:waitqueuenotification-list'
-                                )
-                            ),
-                            "/notify"
-                        ),
-                        "description": "Retirement wait queue notification"
-                    }
-
-                    try:
-                        auth_data = {
-                            "username": settings.EXTERNAL_SCHEDULER['USER'],
-                            "password": settings.EXTERNAL_SCHEDULER['PASSWORD']
-                        }
-                        auth = requests.post(
-                            scheduler_url + "/authentication",
-                            json=auth_data,
-                        )
-                        auth.raise_for_status()
-
-                        r = requests.post(
-                            scheduler_url + '/tasks',
-                            json=data,
-                            headers={
-                                'Authorization':
-                                'Token ' + json.loads(auth.content)['token']},
-                            timeout=(10, 10),
-                        )
-                        r.raise_for_status()
-                    except (requests.exceptions.HTTPError,
-                            requests.exceptions.ConnectionError) as err:
-                        mail_admins(
-                            "Thèsez-vous: external scheduler error",
-                            traceback.format_exc()
-                        )
+                    schedule_wait_queue_notification()
 
-                retirement.save()
+                save_fields(retirement, history=False)
 
         # Send an email if a refund has been issued
         if reservation_active and instance.cancelation_action == 'R':
             # Here the price takes the applied coupon into account, if
             # applicable.
             old_retirement = {
-                'price': (amount * retirement.refund_rate) / 100,
+                'price': total_amount - tax,
                 'name': "{0}: {1}".format(
                     _("Retirement"),
                     retirement.name
@@ -426,8 +473,8 @@ class ReservationViewSet(viewsets.ModelViewSet):
                 'CUSTOMER_NUMBER': user.id,
                 'TYPE': "Remboursement",
                 'OLD_RETIREMENT': old_retirement,
-                'COST': round(total_amount/100, 2),
-                'TAX': round(Decimal(amount_tax/100), 2),
+                'COST': total_amount,
+                'TAX': tax,
             }
 
             plain_msg = render_to_string("refund.txt", merge_data)
@@ -503,14 +550,9 @@ class WaitQueueViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         retirement = instance.retirement
-        wait_queue = retirement.wait_queue.all().order_by('created_at')
-        for index, item in enumerate(wait_queue):
-            if item == instance:
-                wait_queue_pos = index
-                break
-        if wait_queue_pos < retirement.next_user_notified:
+        if instance.position < retirement.next_user_notified:
             retirement.next_user_notified -= 1
-            retirement.save()
+            save_fields(retirement, history=False)
         return super(WaitQueueViewSet, self).destroy(request, *args, **kwargs)
 
 
@@ -551,82 +593,14 @@ class WaitQueueNotificationViewSet(mixins.ListModelMixin,
         reserved seats.
         At the same time, this clears older notification logs. That part should
         be moved somewhere else.
-        """
-        # Checks if lastest notification is older than 24h
-        # This is a hard-coded limitation to allow anonymous users to call
-        # the function.
-        # Keep a 5 minutes gap.
-        time_limit = timezone.now() - timedelta(hours=23, minutes=55)
-        notified_someone = False
-        ready_retirements = False
-
-        retirements_to_notify = Retirement.objects.filter(
-            reserved_seats__gt=0,
-            start_time__gt=timezone.now(),
-            is_active=True,
-        )
 
-        # Remove older notifications
-        remove_before = timezone.now() - timedelta(
-            days=settings.LOCAL_SETTINGS[
-                'RETIREMENT_NOTIFICATION_LIFETIME_DAYS'
-            ]
-        )
-        WaitQueueNotification.objects.filter(
-            created_at__lt=remove_before
-        ).delete()
-
-        for retirement in retirements_to_notify:
-            if retirement.wait_queue_notifications.filter(
-                    created_at__gt=time_limit):
-                # Next iteration, since this wait_queue has been notified less
-                # than 24h ago.
-                continue
-            ready_retirements = True
-            # Get the wait queue with elements ordered by ascending date
-            wait_queue = retirement.wait_queue.all().order_by('created_at')
-            # Get number of waiting users
-            nb_waiting_users = wait_queue.count()
-            # If all users have already been notified, free all reserved seats
-            if retirement.next_user_notified >= nb_waiting_users:
-                retirement.reserved_seats = 0
-                retirement.next_user_notified = 0
-            # Else notify a user for every reserved seat
-            for seat in range(retirement.reserved_seats):
-                if retirement.next_user_notified >= nb_waiting_users:
-                    retirement.reserved_seats -= 1
-                else:
-                    user = wait_queue[retirement.next_user_notified].user
-                    notify_reserved_retirement_seat(
-                        user,
-                        retirement,
-                    )
-                    retirement.next_user_notified += 1
-                    WaitQueueNotification.objects.create(
-                        user=user,
-                        retirement=retirement,
-                    )
-                    notified_someone = True
-            retirement.save()
-
-        if retirements_to_notify.count() == 0:
-            response_data = {
-                'detail': "No reserved seats.",
-                'stop': True,
-            }
-            return Response(response_data, status=status.HTTP_200_OK)
-
-        if not ready_retirements:
-            response_data = {
-                'detail': "Last notification was sent less than 24h ago."
-            }
-            return Response(response_data, status=status.HTTP_200_OK)
+        NOTE: Notifications are also sent by the "wait_queue_notification"
+        scheduled task. Retirements notified less than 24h ago are skipped,
+        which allows anonymous users to call this action.
+        """
+        response_data = notify_wait_queues()
 
-        if not notified_someone:
-            response_data = {
-                'detail': "No reserved seats.",
-                'stop': True,
-            }
+        if response_data:
             return Response(response_data, status=status.HTTP_200_OK)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,25 +1,60 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.forms.models import BaseInlineFormSet
 from django.utils.translation import ugettext_lazy as _
 from import_export.admin import ExportActionModelAdmin
 from modeltranslation.admin import TranslationAdmin
 from safedelete.admin import SafeDeleteAdmin, highlight_deleted
 from simple_history.admin import SimpleHistoryAdmin
 
+from blitz_api.services import prefetch_generic_objects
+
 from .models import (Membership, Order, OrderLine, Package, PaymentProfile,
-                     CustomPayment, Coupon, CouponUser, Refund, )
+                     CustomPayment, Coupon, CouponUser, Refund,
+                     RevenueSummary, )
 from .resources import (MembershipResource, OrderResource, OrderLineResource,
                         PackageResource, CustomPaymentResource, CouponResource,
                         CouponUserResource, RefundResource, )
 
 
+class OrderLineFormSet(BaseInlineFormSet):
+    """
+    Fetches the products of the order lines with one query per type of
+    product.
+    """
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            self._queryset = prefetch_generic_objects(
+                super(OrderLineFormSet, self).get_queryset()
+            )
+        return self._queryset
+
+
+class OrderLineChangeList(ChangeList):
+    """
+    Fetches the products of the listed order lines with one query per type
+    of product.
+    """
+
+    def get_results(self, request):
+        super(OrderLineChangeList, self).get_results(request)
+        self.result_list = prefetch_generic_objects(self.result_list)
+
+
 class OrderLineInline(admin.StackedInline):
     model = OrderLine
+    formset = OrderLineFormSet
     can_delete = True
     show_change_link = True
     verbose_name_plural = _('Orderlines')
     fk_name = 'order'
     extra = 0
 
+    def get_queryset(self, request):
+        queryset = super(OrderLineInline, self).get_queryset(request)
+        return queryset.select_related('content_type')
+
 
 class RefundAdmin(SimpleHistoryAdmin, ExportActionModelAdmin):
     resource_class = RefundResource
@@ -84,6 +119,7 @@ class OrderAdmin(SimpleHistoryAdmin, ExportActionModelAdmin):
         'settlement_id',
         'transaction_date',
         'user',
+        'total',
     )
     list_filter = (
         ('user', admin.RelatedOnlyFieldListFilter),
@@ -117,6 +153,17 @@ class OrderLineAdmin(SimpleHistoryAdmin, ExportActionModelAdmin):
         'coupon__code',
     )
 
+    def get_queryset(self, request):
+        queryset = super(OrderLineAdmin, self).get_queryset(request)
+        return queryset.select_related(
+            'content_type',
+            'coupon',
+            'order__user',
+        )
+
+    def get_changelist(self, request, **kwargs):
+        return OrderLineChangeList
+
     def owner(self, instance):
         return instance.order.user
 
@@ -189,6 +236,24 @@ class CouponUserAdmin(SimpleHistoryAdmin, SafeDeleteAdmin,
     ) + SafeDeleteAdmin.list_filter
 
 
+class RevenueSummaryAdmin(admin.ModelAdmin):
+    list_display = (
+        'date',
+        'content_type',
+        'object_id',
+        'quantity',
+        'revenue',
+        'discount',
+        'tax',
+        'refunds',
+    )
+    list_filter = (
+        ('content_type', admin.RelatedOnlyFieldListFilter),
+        'date',
+    )
+    readonly_fields = list_display
+
+
 admin.site.register(Membership, MembershipAdmin)
 admin.site.register(Package, PackageAdmin)
 admin.site.register(CustomPayment, CustomPaymentAdmin)
@@ -198,3 +263,4 @@ admin.site.register(PaymentProfile, PaymentProfileAdmin)
 admin.site.register(Coupon, CouponAdmin)
 admin.site.register(CouponUser, CouponUserAdmin)
 admin.site.register(Refund, RefundAdmin)
+admin.site.register(RevenueSummary, RevenueSummaryAdmin)
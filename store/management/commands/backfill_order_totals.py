@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Order
+from store.services import update_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Compute and save the totals of existing orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch_size',
+            type=int,
+            default=500,
+            help='Number of orders updated per transaction',
+        )
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            dest='missing',
+            help='Only update orders without any total',
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.order_by('pk')
+        if options['missing']:
+            orders = orders.filter(total=0, ticket_total=0)
+
+        order_ids = list(orders.values_list('pk', flat=True))
+        batch_size = options['batch_size']
+
+        for index in range(0, len(order_ids), batch_size):
+            with transaction.atomic():
+                batch = Order.objects.filter(
+                    pk__in=order_ids[index:index + batch_size],
+                )
+                for order in batch:
+                    update_order_totals(order)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Successfully updated the totals of %s orders' %
+                len(order_ids)
+            )
+        )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from store.services import refresh_revenue_summary
+
+
+class Command(BaseCommand):
+    help = 'Refresh the revenue summary from its last summarized day'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            dest='full',
+            help='Rebuild the whole summary',
+        )
+
+    def handle(self, *args, **options):
+        start_date = refresh_revenue_summary(full=options['full'])
+
+        if start_date:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    'Successfully refreshed the revenue summary since %s' %
+                    start_date.isoformat()
+                )
+            )
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    'Successfully rebuilt the revenue summary'
+                )
+            )
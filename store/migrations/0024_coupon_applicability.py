@@ -0,0 +1,59 @@
+# Generated by Django 2.0.8 on 2026-10-18 20:59
+
+from django.db import migrations
+import jsonfield.fields
+
+
+APPLICABLE_PRODUCT_FIELDS = (
+    'applicable_retirements',
+    'applicable_timeslots',
+    'applicable_packages',
+    'applicable_memberships',
+)
+
+
+def build_applicability(apps, schema_editor):
+    Coupon = apps.get_model('store', 'Coupon')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    for coupon in Coupon.objects.all():
+        products = dict()
+        for field_name in APPLICABLE_PRODUCT_FIELDS:
+            manager = getattr(coupon, field_name)
+            opts = manager.model._meta
+            content_type, created = ContentType.objects.get_or_create(
+                app_label=opts.app_label,
+                model=opts.model_name,
+            )
+            products[str(content_type.id)] = list(
+                manager.values_list('id', flat=True)
+            )
+        coupon.applicability = {
+            'product_types': list(
+                coupon.applicable_product_types.values_list('id', flat=True)
+            ),
+            'products': products,
+        }
+        coupon.save(update_fields=['applicability'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('store', '0023_couponuser_uniqueness'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='applicability',
+            field=jsonfield.fields.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='historicalcoupon',
+            name='applicability',
+            field=jsonfield.fields.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(build_applicability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.0.8 on 2026-10-18 21:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_codes(apps, schema_editor):
+    """
+    Codes were only unique among non-deleted coupons. The oldest coupon
+    keeps its code, the others get their id appended.
+    """
+    Coupon = apps.get_model('store', 'Coupon')
+
+    duplicated_codes = Coupon.objects.values('code').annotate(
+        count=Count('id'),
+    ).filter(count__gt=1).values_list('code', flat=True)
+
+    for code in list(duplicated_codes):
+        duplicates = Coupon.objects.filter(code=code).order_by('id')[1:]
+        for coupon in duplicates:
+            coupon.code = '{0}-{1}'.format(code, coupon.id)
+            coupon.save(update_fields=['code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_coupon_applicability'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=253, unique=True, verbose_name='Code'),
+        ),
+        migrations.AlterField(
+            model_name='historicalcoupon',
+            name='code',
+            field=models.CharField(db_index=True, max_length=253, verbose_name='Code'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.0.8 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_coupon_code_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalorder',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Discount'),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Cost of the order before taxes, discount included.', max_digits=10, verbose_name='Subtotal'),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='tax',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Tax'),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='ticket_total',
+            field=models.PositiveIntegerField(default=0, help_text='Number of tickets spent on timeslots.', verbose_name='Ticket total'),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Total'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Discount'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Cost of the order before taxes, discount included.', max_digits=10, verbose_name='Subtotal'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='tax',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Tax'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='ticket_total',
+            field=models.PositiveIntegerField(default=0, help_text='Number of tickets spent on timeslots.', verbose_name='Ticket total'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Total'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.8 on 2026-10-18 21:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('store', '0026_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Date')),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='Product ID')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Quantity')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Sales before taxes, discount included.', max_digits=12, verbose_name='Revenue')),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Discount')),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Tax')),
+                ('refunds', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Refunds')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType', verbose_name='Product type')),
+            ],
+            options={
+                'verbose_name': 'Revenue summary',
+                'verbose_name_plural': 'Revenue summaries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='revenuesummary',
+            unique_together={('date', 'content_type', 'object_id')},
+        ),
+    ]
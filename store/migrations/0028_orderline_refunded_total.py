@@ -0,0 +1,39 @@
+# Generated by Django 2.0.8 on 2026-10-18 22:00
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def compute_refunded_totals(apps, schema_editor):
+    OrderLine = apps.get_model('store', 'OrderLine')
+    Refund = apps.get_model('store', 'Refund')
+
+    refunded_totals = Refund.objects.filter(
+        deleted__isnull=True,
+    ).values('orderline').annotate(total=Sum('amount'))
+
+    for refunded_total in refunded_totals:
+        OrderLine.objects.filter(pk=refunded_total['orderline']).update(
+            refunded_total=refunded_total['total'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0027_revenuesummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalorderline',
+            name='refunded_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6, verbose_name='Refunded total'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='refunded_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6, verbose_name='Refunded total'),
+        ),
+        migrations.RunPython(compute_refunded_totals, migrations.RunPython.noop),
+    ]
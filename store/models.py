@@ -8,16 +8,17 @@ from django.contrib.contenttypes.fields import (
 )
 from django.contrib.contenttypes.models import ContentType
 
+from jsonfield import JSONField
 from safedelete.models import SafeDeleteModel
 
-from simple_history.models import HistoricalRecords
+from blitz_api.history import BufferedHistoricalRecords
 
-from blitz_api.models import AcademicLevel
+from blitz_api.models import AcademicLevel, DirtyFieldsMixin
 
 User = get_user_model()
 
 
-class Order(models.Model):
+class Order(DirtyFieldsMixin, models.Model):
     """Represents a transaction."""
 
     class Meta:
@@ -52,35 +53,50 @@ class Order(models.Model):
         blank=True,
     )
 
-    history = HistoricalRecords()
-
-    @property
-    def total_cost(self):
-        cost = 0
-        orderlines = self.order_lines.filter(
-            models.Q(content_type__model='membership') |
-            models.Q(content_type__model='package') |
-            models.Q(content_type__model='retirement')
-        )
-        for orderline in orderlines:
-            cost += orderline.cost * orderline.quantity
-        return cost
-
-    @property
-    def total_ticket(self):
-        tickets = 0
-        orderlines = self.order_lines.filter(
-            content_type__model='timeslot'
-        )
-        for orderline in orderlines:
-            tickets += orderline.content_object.price * orderline.quantity
-        return tickets
+    # Totals are computed from the order lines at checkout. See
+    # store.services.update_order_totals.
+    subtotal = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name=_("Subtotal"),
+        help_text=_("Cost of the order before taxes, discount included."),
+        default=0,
+    )
+
+    discount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name=_("Discount"),
+        default=0,
+    )
+
+    tax = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name=_("Tax"),
+        default=0,
+    )
+
+    total = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name=_("Total"),
+        default=0,
+    )
+
+    ticket_total = models.PositiveIntegerField(
+        verbose_name=_("Ticket total"),
+        help_text=_("Number of tickets spent on timeslots."),
+        default=0,
+    )
+
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return str(self.authorization_id)
 
 
-class OrderLine(models.Model):
+class OrderLine(DirtyFieldsMixin, models.Model):
     """
     Represents a line of an order. Can specify the product/service with a
     generic relationship.
@@ -136,13 +152,22 @@ class OrderLine(models.Model):
         default=0,
     )
 
-    history = HistoricalRecords()
+    # Sum of the refunds of the order line, taxes included. Kept up to date
+    # by store.services.update_refunded_totals.
+    refunded_total = models.DecimalField(
+        max_digits=6,
+        decimal_places=2,
+        verbose_name=_("Refunded total"),
+        default=0,
+    )
+
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return str(self.content_object) + ', qt:' + str(self.quantity)
 
 
-class Refund(SafeDeleteModel):
+class Refund(DirtyFieldsMixin, SafeDeleteModel):
     """
     Represents a refund. It is always linked to an orderline and it can refund
     it fully or partially.
@@ -183,13 +208,13 @@ class Refund(SafeDeleteModel):
         blank=True,
     )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return str(self.orderline) + ', ' + str(self.amount) + "$"
 
 
-class BaseProduct(models.Model):
+class BaseProduct(DirtyFieldsMixin, models.Model):
     """Abstract model for base products"""
 
     name = models.CharField(
@@ -324,7 +349,7 @@ class CustomPayment(models.Model):
         verbose_name = _("Custom payment")
         verbose_name_plural = _("Custom payments")
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return self.name
@@ -359,13 +384,13 @@ class PaymentProfile(models.Model):
         max_length=253,
     )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return self.name
 
 
-class Coupon(SafeDeleteModel):
+class Coupon(DirtyFieldsMixin, SafeDeleteModel):
     """
     Represents a coupon that provides a discount on various products.
     The "owner" of the instance is the buyer of the coupon, but not necessarily
@@ -389,6 +414,7 @@ class Coupon(SafeDeleteModel):
     code = models.CharField(
         verbose_name=_("Code"),
         max_length=253,
+        unique=True,
     )
 
     start_time = models.DateTimeField(verbose_name=_("Start time"), )
@@ -458,13 +484,23 @@ class Coupon(SafeDeleteModel):
         through='CouponUser',
     )
 
-    history = HistoricalRecords()
+    # Flattened copy of the applicable_* fields used to check a cart without
+    # querying them. Rebuilt when they change (see signals.py).
+    # Format: {'product_types': [content_type_id, ...],
+    #          'products': {'content_type_id': [object_id, ...], ...}}
+    applicability = JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return self.code
 
 
-class CouponUser(SafeDeleteModel):
+class CouponUser(DirtyFieldsMixin, SafeDeleteModel):
     """Contains uses of coupons by users."""
 
     class Meta:
@@ -484,7 +520,75 @@ class CouponUser(SafeDeleteModel):
     )
     uses = models.PositiveIntegerField()
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return ', '.join([str(self.coupon), str(self.user)])
+
+
+class RevenueSummary(models.Model):
+    """
+    Daily sales of a product, aggregated from orders, refunds and custom
+    payments. Rows are derived data refreshed by the
+    refresh_revenue_summary management command.
+    """
+
+    class Meta:
+        verbose_name = _("Revenue summary")
+        verbose_name_plural = _("Revenue summaries")
+        unique_together = (('date', 'content_type', 'object_id'),)
+
+    date = models.DateField(
+        verbose_name=_("Date"),
+        db_index=True,
+    )
+
+    content_type = models.ForeignKey(
+        ContentType,
+        on_delete=models.CASCADE,
+        verbose_name=_("Product type"),
+    )
+
+    # Custom payments are not related to a product
+    object_id = models.PositiveIntegerField(
+        verbose_name=_("Product ID"),
+        null=True,
+        blank=True,
+    )
+
+    quantity = models.PositiveIntegerField(
+        verbose_name=_("Quantity"),
+        default=0,
+    )
+
+    revenue = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        verbose_name=_("Revenue"),
+        help_text=_("Sales before taxes, discount included."),
+        default=0,
+    )
+
+    discount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        verbose_name=_("Discount"),
+        default=0,
+    )
+
+    tax = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        verbose_name=_("Tax"),
+        default=0,
+    )
+
+    refunds = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        verbose_name=_("Refunds"),
+        default=0,
+    )
+
+    def __str__(self):
+        return '{0}, {1}'.format(self.date, self.content_type)
@@ -1,12 +1,13 @@
 from django.apps import apps
 from django.contrib.auth import get_user_model
+from django.db.models import QuerySet, Sum
 
 from import_export import fields, resources
 from import_export.widgets import (ForeignKeyWidget, ManyToManyWidget,
                                    DateTimeWidget)
 
 from blitz_api.models import AcademicLevel
-from blitz_api.services import get_model_from_name
+from blitz_api.services import prefetch_generic_objects
 
 from .models import (Membership, Order, OrderLine, Package, CustomPayment,
                      Coupon, CouponUser, Refund, )
@@ -70,6 +71,11 @@ class OrderResource(resources.ModelResource):
             'authorization_id',
             'settlement_id',
             'coupon',
+            'subtotal',
+            'discount',
+            'tax',
+            'total',
+            'ticket_total',
         )
         export_order = (
             'id',
@@ -78,6 +84,11 @@ class OrderResource(resources.ModelResource):
             'authorization_id',
             'settlement_id',
             'coupon',
+            'subtotal',
+            'discount',
+            'tax',
+            'total',
+            'ticket_total',
         )
 
 
@@ -98,13 +109,25 @@ class OrderLineResource(resources.ModelResource):
 
     item_id = fields.Field()
 
+    def export(self, queryset=None, *args, **kwargs):
+        """
+        Products of the order lines are fetched with one query per type of
+        product instead of one query per line.
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        if isinstance(queryset, QuerySet):
+            queryset = queryset.select_related('order__user', 'content_type')
+        order_lines = prefetch_generic_objects(queryset)
+        return super(OrderLineResource, self).export(
+            order_lines, *args, **kwargs
+        )
+
     def dehydrate_item_name(self, orderline):
-        model = get_model_from_name(orderline.content_type.model)
-        return model.objects.get(id=orderline.object_id).name
+        return orderline.content_object.name
 
     def dehydrate_item_id(self, orderline):
-        model = get_model_from_name(orderline.content_type.model)
-        return model.objects.get(id=orderline.object_id).id
+        return orderline.object_id
 
     class Meta:
         model = OrderLine
@@ -202,7 +225,7 @@ class CouponResource(resources.ModelResource):
 
     def dehydrate_total_use(self, coupon):
         uses = CouponUser.objects.filter(coupon=coupon)
-        return sum(uses.values_list('uses', flat=True))
+        return uses.aggregate(total=Sum('uses'))['total'] or 0
 
     class Meta:
         model = Coupon
@@ -304,6 +327,19 @@ class RefundResource(resources.ModelResource):
         widget=ForeignKeyWidget(OrderLine, 'content_object__name'),
     )
 
+    def export(self, queryset=None, *args, **kwargs):
+        """
+        Products of the refunded order lines are fetched with one query per
+        type of product instead of one query per refund.
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        if isinstance(queryset, QuerySet):
+            queryset = queryset.select_related('orderline__content_type')
+        refunds = list(queryset)
+        prefetch_generic_objects(refund.orderline for refund in refunds)
+        return super(RefundResource, self).export(refunds, *args, **kwargs)
+
     class Meta:
         model = Refund
         fields = (
@@ -1,9 +1,8 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from decimal import Decimal
-import random
-import string
+from collections import OrderedDict
+from functools import lru_cache
 import uuid
 
 from django.apps import apps
@@ -11,14 +10,17 @@ from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.db import transaction, models
+from django.db import IntegrityError, models, transaction
 from django.db.models import Q
 from django.conf import settings
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 
-from blitz_api.services import (remove_translation_fields,
-                                check_if_translated_field,)
+from blitz_api import history
+from blitz_api.services import (TranslatedSerializerMixin,
+                                check_if_translated_field,
+                                adjust_tickets, save_fields,
+                                prefetch_generic_objects,)
 from workplace.models import Reservation
 from retirement.models import Reservation as RetirementReservation
 from retirement.models import WaitQueueNotification, Retirement
@@ -32,14 +34,22 @@ from .services import (charge_payment,
                        create_external_card,
                        get_external_cards,
                        PAYSAFE_CARD_TYPE,
-                       validate_coupon_for_order, )
+                       evaluate_coupon,
+                       redeem_coupon,
+                       create_coupons,
+                       APPLICABLE_PRODUCT_FIELDS,
+                       generate_coupon_code,
+                       COUPON_CODE_TRIES,
+                       update_order_totals,
+                       REPORT_GROUPS,
+                       REPORT_PERIODS, )
 
 User = get_user_model()
 
-TAX_RATE = settings.LOCAL_SETTINGS['SELLING_TAX']
 
-
-class BaseProductSerializer(serializers.HyperlinkedModelSerializer):
+class BaseProductSerializer(TranslatedSerializerMixin,
+                            serializers.HyperlinkedModelSerializer):
+    staff_only_fields = ('order_lines', )
     id = serializers.ReadOnlyField()
     order_lines = serializers.HyperlinkedRelatedField(
         many=True,
@@ -66,14 +76,6 @@ class BaseProductSerializer(serializers.HyperlinkedModelSerializer):
         allow_null=True,
     )
 
-    def to_representation(self, instance):
-        user = self.context['request'].user
-        data = super(BaseProductSerializer, self).to_representation(instance)
-        if not user.is_staff:
-            data.pop("order_lines")
-            data = remove_translation_fields(data)
-        return data
-
     class Meta:
         model = BaseProduct
         fields = '__all__'
@@ -151,7 +153,7 @@ class CustomPaymentSerializer(serializers.HyperlinkedModelSerializer):
         validated_data['settlement_id'] = "0"
         validated_data['transaction_date'] = timezone.now()
 
-        with transaction.atomic():
+        with history.atomic():
             custom_payment = CustomPayment.objects.create(**validated_data)
             amount = int(round(custom_payment.price*100))
 
@@ -265,6 +267,7 @@ class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
     )
     coupon_real_value = serializers.ReadOnlyField()
     cost = serializers.ReadOnlyField()
+    refunded_total = serializers.ReadOnlyField()
     coupon = serializers.SlugRelatedField(
         slug_field='code',
         allow_null=True,
@@ -329,6 +332,9 @@ class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
                 or content_type.model == 'retirement'):
             attrs['cost'] = obj.price * validated_data.get('quantity')
 
+        # Keep the product to avoid fetching it again
+        attrs['content_object'] = obj
+
         return attrs
 
     class Meta:
@@ -432,23 +438,26 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                 )
             )
 
-        with transaction.atomic():
+        with history.atomic():
             coupon = validated_data.pop('coupon', None)
             order = Order.objects.create(**validated_data)
             charge_response = None
             discount_amount = 0
-            for orderline_data in orderlines_data:
+            orderlines = [
                 OrderLine.objects.create(order=order, **orderline_data)
+                for orderline_data in orderlines_data
+            ]
 
             if coupon:
-                coupon_info = validate_coupon_for_order(coupon, order)
+                coupon_info = evaluate_coupon(coupon, user, orderlines)
                 if coupon_info['valid_use']:
-                    coupon_user = CouponUser.objects.get(
-                        user=user,
-                        coupon=coupon,
-                    )
-                    coupon_user.uses = coupon_user.uses + 1
-                    coupon_user.save()
+                    if not redeem_coupon(coupon, user):
+                        raise serializers.ValidationError({
+                            'non_field_errors': [_(
+                                "Maximum number of uses exceeded for this "
+                                "coupon."
+                            )]
+                        })
                     discount_amount = coupon_info['value']
                     orderline_cost = coupon_info['orderline'].cost
                     coupon_info['orderline'].cost = (
@@ -463,11 +472,9 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                 else:
                     raise serializers.ValidationError(coupon_info['error'])
 
-            amount = order.total_cost
-            tax = amount * Decimal(repr(TAX_RATE))
-            tax = tax.quantize(Decimal('0.01'))
-            amount *= Decimal(repr(TAX_RATE + 1))
-            amount = round(amount * 100, 2)
+            update_order_totals(order)
+            tax = order.tax
+            amount = order.total * 100
 
             membership_orderlines = order.order_lines.filter(
                 content_type__model="membership"
@@ -500,11 +507,12 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
             if package_orderlines:
                 need_transaction = True
                 for package_orderline in package_orderlines:
-                    user.tickets += (
+                    adjust_tickets(
+                        user,
                         package_orderline.content_object.reservations *
-                        package_orderline.quantity
+                        package_orderline.quantity,
+                        'package_purchase',
                     )
-                    user.save()
             if reservation_orderlines:
                 for reservation_orderline in reservation_orderlines:
                     timeslot = reservation_orderline.content_object
@@ -535,8 +543,16 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                         # OrderLine's quantity and TimeSlot's price will be
                         # used in the future if we want to allow multiple
                         # reservations of the same timeslot.
-                        user.tickets -= 1
-                        user.save()
+                        # The balance is checked again by the database in
+                        # case a concurrent order used the same tickets.
+                        if not adjust_tickets(
+                                user, -1, 'timeslot_reservation'):
+                            raise serializers.ValidationError({
+                                'non_field_errors': [_(
+                                    "You don't have enough tickets to make "
+                                    "this reservation."
+                                )]
+                            })
                     else:
                         raise serializers.ValidationError({
                             'non_field_errors': [_(
@@ -587,7 +603,7 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                             retirement.reserved_seats = (
                                 retirement.reserved_seats - 1
                             )
-                            retirement.save()
+                            save_fields(retirement, history=False)
                     else:
                         raise serializers.ValidationError({
                             'non_field_errors': [_(
@@ -661,10 +677,12 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
 
         if need_transaction:
             # Send order email
-            orderlines = order.order_lines.filter(
-                models.Q(content_type__model='membership') |
-                models.Q(content_type__model='package') |
-                models.Q(content_type__model='retirement')
+            orderlines = prefetch_generic_objects(
+                order.order_lines.filter(
+                    models.Q(content_type__model='membership') |
+                    models.Q(content_type__model='package') |
+                    models.Q(content_type__model='retirement')
+                ).select_related('content_type')
             )
 
             # Here, the 'details' key is used to provide details of the
@@ -771,9 +789,95 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
             'user': {
                 'read_only': True,
             },
+            'subtotal': {
+                'read_only': True,
+            },
+            'discount': {
+                'read_only': True,
+            },
+            'tax': {
+                'read_only': True,
+            },
+            'total': {
+                'read_only': True,
+            },
+            'ticket_total': {
+                'read_only': True,
+            },
         }
 
 
+class RevenueReportSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    period = serializers.ChoiceField(
+        choices=REPORT_PERIODS,
+        default='day',
+    )
+    group_by = serializers.ChoiceField(
+        choices=REPORT_GROUPS,
+        required=False,
+    )
+    product_type = serializers.SlugRelatedField(
+        queryset=ContentType.objects.all(),
+        slug_field='model',
+        required=False,
+    )
+
+    def validate(self, attrs):
+        validated_data = super(RevenueReportSerializer, self).validate(attrs)
+        start_date = validated_data.get('start_date')
+        end_date = validated_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise serializers.ValidationError({
+                'end_date': [_("End date must be later than start_date.")],
+            })
+        if validated_data.get('product_type'):
+            validated_data['product_type'] = (
+                validated_data['product_type'].model
+            )
+        return validated_data
+
+
+class RevenueReportEntrySerializer(serializers.Serializer):
+    period = serializers.DateField()
+    product_type = serializers.CharField(required=False)
+    object_id = serializers.IntegerField(required=False)
+    workplace = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+    discount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    tax = serializers.DecimalField(max_digits=12, decimal_places=2)
+    refunds = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+def is_compact(request):
+    """
+    Products applicable to coupons are only represented by their id and name
+    when the "compact" query parameter is set.
+    """
+    return request.query_params.get('compact', '').lower() in ('1', 'true')
+
+
+@lru_cache(maxsize=None)
+def get_product_serializers():
+    """
+    Returns the serializers used to represent the products applicable to a
+    coupon, by field name.
+
+    Those serializers are imported on first use since their modules depend on
+    this one.
+    """
+    from workplace.serializers import TimeSlotSerializer
+    from retirement.serializers import RetirementSerializer
+    return OrderedDict((
+        ('applicable_retirements', RetirementSerializer),
+        ('applicable_timeslots', TimeSlotSerializer),
+        ('applicable_packages', PackageSerializer),
+        ('applicable_memberships', MembershipSerializer),
+    ))
+
+
 class CouponSerializer(serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     applicable_product_types = serializers.SlugRelatedField(
@@ -786,7 +890,7 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
         allow_blank=True,
         required=False,
         validators=[
-            UniqueValidator(queryset=Coupon.objects.all()),
+            UniqueValidator(queryset=Coupon.all_objects.all()),
         ]
     )
     value = serializers.DecimalField(
@@ -832,26 +936,28 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
     def create(self, validated_data):
         """
         Generate coupon's code and create the coupon.
+
+        Generated codes are not checked beforehand: the unique index on the
+        code is relied upon and the insertion is retried on conflict.
         """
-        code = validated_data.get('code', None)
-
-        used_code = Coupon.objects.all().values_list('code', flat=True)
-        n = 0
-        while ((not code or code in used_code) and (n < 100)):
-            code = ''.join(
-                random.choices(
-                    string.ascii_uppercase.replace("O", "").replace("I", "") +
-                    string.digits.replace("0", ""),
-                    k=8))
-            n += 1
-        if n >= 100:
-            raise serializers.ValidationError({
-                'non_field_errors': [_(
-                    "Can't generate new unique codes. Delete old coupons."
-                )]
-            })
-        validated_data['code'] = code
-        return super(CouponSerializer, self).create(validated_data)
+        if validated_data.get('code', None):
+            return super(CouponSerializer, self).create(validated_data)
+
+        for attempt in range(COUPON_CODE_TRIES):
+            try:
+                with transaction.atomic():
+                    # Copy data since relations are popped by create()
+                    return super(CouponSerializer, self).create(
+                        dict(validated_data, code=generate_coupon_code())
+                    )
+            except IntegrityError:
+                pass
+
+        raise serializers.ValidationError({
+            'non_field_errors': [_(
+                "Can't generate new unique codes. Delete old coupons."
+            )]
+        })
 
     def update(self, instance, validated_data):
 
@@ -886,47 +992,29 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
 
     def to_representation(self, instance):
         data = super(CouponSerializer, self).to_representation(instance)
-        from workplace.serializers import TimeSlotSerializer
-        from retirement.serializers import RetirementSerializer
         action = self.context['view'].action
         if action == 'retrieve' or action == 'list':
-            data['applicable_retirements'] = RetirementSerializer(
-                instance.applicable_retirements,
-                many=True,
-                context={
-                    'request': self.context['request'],
-                    'view': self.context['view'],
-                },
-            ).data
-            data['applicable_timeslots'] = TimeSlotSerializer(
-                instance.applicable_timeslots,
-                many=True,
-                context={
-                    'request': self.context['request'],
-                    'view': self.context['view'],
-                },
-            ).data
-            data['applicable_packages'] = PackageSerializer(
-                instance.applicable_packages,
-                many=True,
-                context={
-                    'request': self.context['request'],
-                    'view': self.context['view'],
-                },
-            ).data
-            data['applicable_memberships'] = MembershipSerializer(
-                instance.applicable_memberships,
-                many=True,
-                context={
-                    'request': self.context['request'],
-                    'view': self.context['view'],
-                },
-            ).data
+            if is_compact(self.context['request']):
+                for field_name in APPLICABLE_PRODUCT_FIELDS:
+                    data[field_name] = [
+                        {'id': product.id, 'name': product.name}
+                        for product in getattr(instance, field_name).all()
+                    ]
+                return data
+            for field_name, serializer in get_product_serializers().items():
+                data[field_name] = serializer(
+                    getattr(instance, field_name),
+                    many=True,
+                    context={
+                        'request': self.context['request'],
+                        'view': self.context['view'],
+                    },
+                ).data
         return data
 
     class Meta:
         model = Coupon
-        exclude = ('deleted', )
+        exclude = ('deleted', 'applicability', )
         extra_kwargs = {
             'applicable_retirements': {
                 'required': False,
@@ -944,6 +1032,46 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
+class BatchCouponSerializer(CouponSerializer):
+    code = None
+    count = serializers.IntegerField(
+        min_value=1,
+        max_value=10000,
+        help_text=_("Number of coupons to create."),
+    )
+
+    def create(self, validated_data):
+        """
+        Creates "count" coupons with the same settings and unique random
+        codes in a single transaction.
+
+        Returns a report of the operation.
+        """
+        count = validated_data.pop('count')
+        many_to_many = {
+            field.name: validated_data.pop(field.name)
+            for field in Coupon._meta.many_to_many
+            if field.name in validated_data
+        }
+
+        try:
+            coupons = create_coupons(validated_data, many_to_many, count)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                'non_field_errors': [_(
+                    "Can't generate new unique codes. Delete old coupons."
+                )]
+            })
+
+        return {
+            'count': len(coupons),
+            'codes': [coupon.code for coupon in coupons],
+        }
+
+    class Meta(CouponSerializer.Meta):
+        exclude = CouponSerializer.Meta.exclude + ('code', )
+
+
 class CouponUserSerializer(serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
 
@@ -1,18 +1,29 @@
-from decimal import Decimal
+from collections import defaultdict, OrderedDict
+from datetime import datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 import json
 import random
 import requests
+import string
 import uuid
 
 from django.conf import settings
-from django.core.mail import send_mail
-from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import (Case, Count, DecimalField, F, IntegerField, Max,
+                              OuterRef, Q, Subquery, Sum, When, )
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from blitz_api.services import prefetch_generic_objects, save_fields
+from workplace.models import TimeSlot
+
 from .exceptions import PaymentAPIError
-from .models import CouponUser
+from .models import (Coupon, CouponUser, CustomPayment, OrderLine,
+                     PaymentProfile, Refund, RevenueSummary, )
 
 
 ###############################################################################
@@ -144,15 +155,18 @@ def charge_payment(amount, payment_token, reference_number):
     return r
 
 
-def refund_amount(settlement_id, amount):
+def refund_amount(settlement_id, amount, reference_number=None):
     """
     This method is used to refund an amount to the same card that was used for
     buying the products contained in the order.
     This is tigthly coupled with Paysafe for now, but this should be made
     generic in the future to ease migrations to another payment patform.
 
-    settlement_id: ID for the Paysafe settlement
-    amount:        Positive number representing the amount to be refunded back
+    settlement_id:      ID for the Paysafe settlement
+    amount:             Positive number representing the amount to be
+                        refunded back
+    reference_number:   Merchant reference of the refund. A random one is
+                        generated if not provided.
     """
     refund_url = '{0}{1}{2}{3}{4}'.format(
         settings.PAYSAFE['BASE_URL'],
@@ -163,7 +177,7 @@ def refund_amount(settlement_id, amount):
     )
 
     data = {
-        "merchantRefNum": "refund-" + str(uuid.uuid4()),
+        "merchantRefNum": reference_number or "refund-" + str(uuid.uuid4()),
         "amount": amount,
     }
 
@@ -189,6 +203,74 @@ def refund_amount(settlement_id, amount):
     return r
 
 
+def cancel_settlement(settlement_id):
+    """
+    This method is used to cancel a settlement that has not been batched yet,
+    so the card is not charged. Settlements already batched must be refunded
+    instead.
+    This is tigthly coupled with Paysafe for now, but this should be made
+    generic in the future to ease migrations to another payment patform.
+
+    settlement_id:      ID for the Paysafe settlement
+    """
+    settlement_url = '{0}{1}{2}{3}'.format(
+        settings.PAYSAFE['BASE_URL'],
+        settings.PAYSAFE['CARD_URL'],
+        "accounts/" + settings.PAYSAFE['ACCOUNT_NUMBER'],
+        "/settlements/" + settlement_id,
+    )
+
+    data = {
+        "status": "CANCELLED",
+    }
+
+    try:
+        r = requests.put(
+            settlement_url,
+            auth=(
+                settings.PAYSAFE['USER'],
+                settings.PAYSAFE['PASSWORD'],
+            ),
+            json=data,
+        )
+        r.raise_for_status()
+    except requests.exceptions.HTTPError as err:
+        try:
+            err_code = json.loads(err.response.content)['error']['code']
+            if err_code in PAYSAFE_EXCEPTION:
+                raise PaymentAPIError(PAYSAFE_EXCEPTION[err_code])
+        except json.decoder.JSONDecodeError as err:
+            print(err.response)
+        raise PaymentAPIError(PAYSAFE_EXCEPTION['unknown'])
+
+    return r
+
+
+def send_refund(refund_id):
+    """
+    Sends a Refund recorded without refund_id to the external payment API,
+    against the settlement of its order.
+
+    The merchant reference is derived from the refund and nothing is sent if
+    the refund already has a refund_id, so this can safely be retried.
+    """
+    refund = Refund.objects.select_related('orderline__order').get(
+        pk=refund_id,
+    )
+    if refund.refund_id:
+        return refund
+
+    refund_response = refund_amount(
+        refund.orderline.order.settlement_id,
+        int(round(refund.amount * 100)),
+        reference_number="refund-{0}".format(refund.pk),
+    )
+    refund.refund_id = refund_response.json()['id']
+    refund.save()
+
+    return refund
+
+
 def create_external_payment_profile(user):
     """
     This method is used to create a payment profile in external payment API.
@@ -356,6 +438,34 @@ def create_external_card(profile_id, single_use_token):
     return r
 
 
+def create_card_payment_token(user, single_use_token):
+    """
+    Adds the card of a single use token to the external payment profile of
+    the user, creating the profile if needed, and returns the payment token
+    of the card.
+
+    user:               Django User model instance
+    single_use_token:   Single use token representing the card instance
+    """
+    profile = PaymentProfile.objects.filter(owner=user).first()
+    if not profile:
+        create_profile_res = create_external_payment_profile(user)
+        profile = PaymentProfile.objects.create(
+            name="Paysafe",
+            owner=user,
+            external_api_id=create_profile_res.json()['id'],
+            external_api_url='{0}{1}'.format(
+                create_profile_res.url,
+                create_profile_res.json()['id']
+            )
+        )
+    card_create_response = create_external_card(
+        profile.external_api_id,
+        single_use_token
+    )
+    return card_create_response.json()['paymentToken']
+
+
 def get_external_cards(profile_id):
     """
     This method is used to get cards of a payment profile from an external
@@ -449,18 +559,89 @@ def delete_external_card(profile_id, card_id):
 ###############################################################################
 
 
-def validate_coupon_for_order(coupon, order):
+APPLICABLE_PRODUCT_FIELDS = (
+    'applicable_retirements',
+    'applicable_timeslots',
+    'applicable_packages',
+    'applicable_memberships',
+)
+
+
+def build_coupon_applicability(coupon):
+    """
+    Returns the flattened applicability of a coupon as stored in
+    Coupon.applicability.
+    """
+    return build_applicability(
+        coupon.applicable_product_types.values_list('id', flat=True),
+        {
+            field_name: getattr(coupon, field_name).values_list(
+                'id', flat=True
+            )
+            for field_name in APPLICABLE_PRODUCT_FIELDS
+        },
+    )
+
+
+def build_applicability(product_type_ids, product_ids):
+    """
+    product_type_ids: iterable of ContentType ids
+    product_ids: dict of {applicable_* field name: iterable of product ids}
+    """
+    products = dict()
+    for field_name, object_ids in product_ids.items():
+        model = Coupon._meta.get_field(field_name).related_model
+        content_type = ContentType.objects.get_for_model(model)
+        products[str(content_type.id)] = list(object_ids)
+    return {
+        'product_types': list(product_type_ids),
+        'products': products,
+    }
+
+
+def update_coupon_applicability(coupon):
+    """
+    Rebuilds and saves the flattened applicability of a coupon.
+    """
+    coupon.applicability = build_coupon_applicability(coupon)
+    save_fields(coupon, history=False)
+
+
+def get_applicable_order_lines(coupon, order_lines):
+    """
+    Returns the order lines, saved or not, to which the coupon can be
+    applied. Matching is done in memory against Coupon.applicability.
+    """
+    applicability = (
+        coupon.applicability or build_coupon_applicability(coupon)
+    )
+    product_types = set(applicability['product_types'])
+    products = {
+        int(content_type_id): set(object_ids) for content_type_id, object_ids
+        in applicability['products'].items()
+    }
+
+    return [
+        order_line for order_line in order_lines
+        if order_line.content_type_id in product_types
+        or order_line.object_id in products.get(
+            order_line.content_type_id, ()
+        )
+    ]
+
+
+def evaluate_coupon(coupon, user, order_lines):
     """
     coupon: Coupon model instance
-    order: Order model instance
+    user: User model instance
+    order_lines: iterable of OrderLine model instances, saved or not
 
-    THIS DOES NOT RECORD COUPON USE. Linked CouponUser instance needs to be
-    updated outside of this function!
+    Evaluates the use of a coupon on the products of a cart. Nothing is
+    written to the database: this can be used to preview a discount.
 
     Returns a dict containing informations concerning the coupon use.
     """
     now = timezone.now()
-    user = order.user
     coupon_info = {
         'valid_use': False,
         'error': None,
@@ -494,20 +675,7 @@ def validate_coupon_for_order(coupon, order):
         return coupon_info
 
     # Check if the maximum number of use for this coupon is exceeded
-    coupon_user, created = CouponUser.objects.get_or_create(
-        coupon=coupon,
-        user=user,
-        defaults={'uses': 0},
-    )
-    total_coupon_uses = CouponUser.objects.filter(coupon=coupon)
-    total_coupon_uses = sum(
-        total_coupon_uses.values_list('uses', flat=True)
-    )
-    valid_use = coupon_user.uses < coupon.max_use_per_user
-    valid_use = valid_use or not coupon.max_use_per_user
-    valid_use = valid_use and (total_coupon_uses < coupon.max_use
-                               or not coupon.max_use)
-    if not valid_use:
+    if not coupon_has_uses_left(coupon, user):
         coupon_info['error'] = {
             'non_field_errors': [_(
                 "Maximum number of uses exceeded for this coupon."
@@ -516,21 +684,7 @@ def validate_coupon_for_order(coupon, order):
         return coupon_info
 
     # Check if the coupon can be applied to a product in the order
-    applicable_orderlines = order.order_lines.filter(
-        Q(content_type__in=coupon.applicable_product_types.all())
-        | Q(content_type__model='package',
-            object_id__in=coupon.applicable_packages.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='timeslot',
-            object_id__in=coupon.applicable_timeslots.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='membership',
-            object_id__in=coupon.applicable_memberships.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='retirement',
-            object_id__in=coupon.applicable_retirements.all().
-            values_list('id', flat=True))
-    )
+    applicable_orderlines = get_applicable_order_lines(coupon, order_lines)
     if not applicable_orderlines:
         coupon_info['error'] = {
             'non_field_errors': [_(
@@ -563,10 +717,167 @@ def validate_coupon_for_order(coupon, order):
     return coupon_info
 
 
-def notify_for_coupon(email, coupon):
+def get_coupon_uses(coupon, user):
+    """
+    Returns a tuple (total uses, uses by the user) of a coupon computed with
+    a single query.
+    """
+    uses = CouponUser.objects.filter(coupon=coupon).aggregate(
+        total=Sum('uses'),
+        user=Sum('uses', filter=Q(user=user)),
+    )
+    return uses['total'] or 0, uses['user'] or 0
+
+
+def coupon_has_uses_left(coupon, user):
+    """
+    Returns True if neither the global nor the per-user limit of uses of the
+    coupon is reached. A limit of 0 means unlimited uses.
+    """
+    total_uses, user_uses = get_coupon_uses(coupon, user)
+    return (
+        (not coupon.max_use_per_user or user_uses < coupon.max_use_per_user)
+        and (not coupon.max_use or total_uses < coupon.max_use)
+    )
+
+
+def redeem_coupon(coupon, user):
+    """
+    coupon: Coupon model instance
+    user: User model instance
+
+    Records a use of the coupon by the user if the limits of uses allow it.
+
+    The per-user limit is enforced by a conditional UPDATE on the user's
+    CouponUser row. The global limit spans many rows: the coupon row is
+    locked (not the table) so that concurrent redemptions of the same coupon
+    are checked one after the other.
+
+    Returns True if the use was recorded, False if a limit is reached.
+    """
+    coupon_user, created = CouponUser.objects.get_or_create(
+        coupon=coupon,
+        user=user,
+        defaults={'uses': 0},
+    )
+
+    with transaction.atomic():
+        if coupon.max_use:
+            Coupon.objects.select_for_update().get(pk=coupon.pk)
+            total_uses = get_coupon_uses(coupon, user)[0]
+            if total_uses >= coupon.max_use:
+                return False
+
+        user_uses = CouponUser.objects.filter(pk=coupon_user.pk)
+        if coupon.max_use_per_user:
+            user_uses = user_uses.filter(uses__lt=coupon.max_use_per_user)
+
+        return bool(user_uses.update(uses=F('uses') + 1))
+
+
+COUPON_CODE_CHARACTERS = (
+    string.ascii_uppercase.replace("O", "").replace("I", "") +
+    string.digits.replace("0", "")
+)
+COUPON_CODE_LENGTH = 8
+# Number of attempts before giving up on finding unused codes
+COUPON_CODE_TRIES = 10
+
+
+def generate_coupon_code():
+    """
+    Returns a random coupon code. Its uniqueness is guaranteed by the unique
+    index on Coupon.code: callers insert and retry on conflict.
+    """
+    return ''.join(
+        random.choices(COUPON_CODE_CHARACTERS, k=COUPON_CODE_LENGTH)
+    )
+
+
+def create_coupons(coupon_data, many_to_many, count):
+    """
+    coupon_data: dict of Coupon field values, except the code
+    many_to_many: dict of {many-to-many field name: list of instances}
+    count: number of coupons to create
+
+    Creates many coupons with random codes in a single transaction, with one
+    INSERT for the coupons and one per many-to-many relation.
+
+    Raises IntegrityError if no set of unused codes can be found.
+
+    Returns the list of created coupons.
+    """
+    applicability = build_applicability(
+        [
+            content_type.id for content_type in
+            many_to_many.get('applicable_product_types', [])
+        ],
+        {
+            field_name: [
+                product.id for product in many_to_many.get(field_name, [])
+            ]
+            for field_name in APPLICABLE_PRODUCT_FIELDS
+        },
+    )
+
+    with transaction.atomic():
+        for attempt in range(COUPON_CODE_TRIES):
+            codes = set()
+            while len(codes) < count:
+                codes.add(generate_coupon_code())
+            codes = list(codes)
+            try:
+                # Savepoint rolled back if a code is already used
+                with transaction.atomic():
+                    Coupon.objects.bulk_create(
+                        Coupon(
+                            code=code,
+                            applicability=applicability,
+                            **coupon_data
+                        ) for code in codes
+                    )
+                    break
+            except IntegrityError:
+                if attempt == COUPON_CODE_TRIES - 1:
+                    raise
+
+        # Primary keys are not set by bulk_create on every database backend
+        coupons = list()
+        for index in range(0, count, 500):
+            coupons += Coupon.objects.filter(
+                code__in=codes[index:index + 500]
+            )
+
+        for field_name, related_objects in many_to_many.items():
+            field = Coupon._meta.get_field(field_name)
+            through = field.remote_field.through
+            through.objects.bulk_create(
+                through(**{
+                    field.m2m_field_name(): coupon,
+                    field.m2m_reverse_field_name(): related_object,
+                })
+                for coupon in coupons for related_object in related_objects
+            )
+
+        Coupon.history.bulk_history_create(coupons)
+
+    return coupons
+
+
+# Maximum number of messages sent through a single SMTP connection
+NOTIFICATION_BATCH_SIZE = 100
+
+
+def notify_for_coupon(email_list, coupon):
     """
-    This function sends an email to notify a user that he has access to a
-    coupon code for his next purchase.
+    This function sends an email to notify users that they have access to a
+    coupon code for their next purchase.
+
+    The message is rendered once and every recipient gets a separate copy,
+    sent through a shared connection opened once per batch of
+    NOTIFICATION_BATCH_SIZE recipients.
+
+    Returns the number of messages sent.
     """
 
     merge_data = {'COUPON': coupon}
@@ -574,10 +885,328 @@ def notify_for_coupon(email, coupon):
     plain_msg = render_to_string("coupon_code.txt", merge_data)
     msg_html = render_to_string("coupon_code.html", merge_data)
 
-    return send_mail(
-        "Coupon rabais",
-        plain_msg,
-        settings.DEFAULT_FROM_EMAIL,
-        [email],
-        html_message=msg_html,
+    # Remove duplicates while keeping the original order
+    email_list = list(OrderedDict.fromkeys(email_list))
+
+    sent = 0
+    for index in range(0, len(email_list), NOTIFICATION_BATCH_SIZE):
+        messages = list()
+        for email in email_list[index:index + NOTIFICATION_BATCH_SIZE]:
+            message = EmailMultiAlternatives(
+                "Coupon rabais",
+                plain_msg,
+                settings.DEFAULT_FROM_EMAIL,
+                [email],
+            )
+            message.attach_alternative(msg_html, "text/html")
+            messages.append(message)
+        with get_connection() as connection:
+            sent += connection.send_messages(messages) or 0
+
+    return sent
+
+
+def send_coupon_notification(coupon_id, email_list):
+    """
+    Scheduled task notifying a list of emails with the code of a coupon (see
+    notify_for_coupon). Nothing is sent if the coupon was deleted.
+    """
+    coupon = Coupon.objects.filter(pk=coupon_id).first()
+    if coupon is None:
+        return 0
+
+    return notify_for_coupon(email_list, coupon)
+
+
+TAX_RATE = settings.LOCAL_SETTINGS['SELLING_TAX']
+# Products paid with money. Timeslots are paid with tickets.
+PAID_PRODUCT_MODELS = ('membership', 'package', 'retirement')
+ORDER_TOTAL_FIELDS = ('subtotal', 'discount', 'tax', 'total', 'ticket_total')
+
+
+def compute_order_totals(order):
+    """
+    Returns the totals of an order computed from its order lines:
+        subtotal: cost before taxes, discount included
+        discount: sum of the coupon values applied to the order lines
+        tax: taxes on the subtotal
+        total: subtotal and taxes
+        ticket_total: number of tickets spent on timeslots
+
+    Order lines are fetched with one query, and their products with one
+    query per type of product.
+    """
+    subtotal = Decimal(0)
+    discount = Decimal(0)
+    ticket_total = 0
+
+    order_lines = prefetch_generic_objects(
+        order.order_lines.select_related('content_type')
+    )
+
+    for order_line in order_lines:
+        discount += order_line.coupon_real_value
+        model = order_line.content_type.model
+        if model in PAID_PRODUCT_MODELS:
+            # The cost already includes the quantity
+            subtotal += order_line.cost
+        elif model == 'timeslot':
+            ticket_total += (
+                order_line.content_object.price * order_line.quantity
+            )
+
+    tax = (subtotal * Decimal(repr(TAX_RATE))).quantize(Decimal('0.01'))
+    total = (subtotal * Decimal(repr(TAX_RATE + 1))).quantize(
+        Decimal('0.01')
     )
+
+    return {
+        'subtotal': subtotal,
+        'discount': discount,
+        'tax': tax,
+        'total': total,
+        'ticket_total': int(ticket_total),
+    }
+
+
+def update_order_totals(order):
+    """
+    Computes and saves the totals of an order. Totals are derived from the
+    order lines so no historical record is created.
+    """
+    for field_name, value in compute_order_totals(order).items():
+        setattr(order, field_name, value)
+    save_fields(order, *ORDER_TOTAL_FIELDS, history=False)
+
+
+def split_refund_amount(amount):
+    """
+    Returns the part before taxes and the taxes of an amount refunded, taxes
+    included, rounded to the cent so they add up to the amount.
+    """
+    subtotal = (amount / Decimal(TAX_RATE + 1)).quantize(
+        Decimal('0.01'),
+        rounding=ROUND_HALF_UP,
+    )
+    return subtotal, amount - subtotal
+
+
+def get_refund_amount(order_line, price, refund_rate=100):
+    """
+    Returns the amount to refund on an order line, in dollars, to give back
+    refund_rate% of a price before taxes, as its part before taxes and its
+    taxes. Both are rounded to the cent and their sum, the amount to refund,
+    is rounded as a whole.
+
+    The amount is capped to what is left to refund on the order line: its
+    cost, taxes included, minus its refunded_total. Order lines without cost,
+    created before costs were recorded, are not capped.
+    """
+    subtotal = price * Decimal(refund_rate) / 100
+    amount = (subtotal * Decimal(TAX_RATE + 1)).quantize(
+        Decimal('0.01'),
+        rounding=ROUND_HALF_UP,
+    )
+    subtotal = subtotal.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    if order_line.cost:
+        refundable = (
+            order_line.cost * Decimal(TAX_RATE + 1) -
+            order_line.refunded_total
+        ).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        if amount > refundable:
+            return split_refund_amount(max(refundable, Decimal(0)))
+
+    return subtotal, amount - subtotal
+
+
+def update_refunded_totals(order_line_ids):
+    """
+    Saves the sum of the refunds of the given order lines in their
+    refunded_total, with a single query. Totals are derived from the refunds
+    so no historical record is created.
+    """
+    refunded_totals = Refund.objects.filter(
+        orderline=OuterRef('pk'),
+    ).values('orderline').annotate(
+        total=Sum('amount'),
+    ).values('total')
+
+    OrderLine.objects.filter(pk__in=order_line_ids).update(
+        refunded_total=Coalesce(
+            Subquery(refunded_totals, output_field=DecimalField()),
+            Decimal(0),
+        ),
+    )
+
+
+# Days recomputed before the watermark of the revenue summary, for orders
+# and refunds committed after the previous refresh with an earlier date.
+REVENUE_SUMMARY_OVERLAP = timedelta(days=1)
+REVENUE_SUMMARY_FIELDS = ('quantity', 'revenue', 'discount', 'tax', 'refunds')
+REPORT_PERIODS = ('day', 'week', 'month')
+REPORT_GROUPS = ('product_type', 'product', 'workplace')
+
+
+def refresh_revenue_summary(full=False):
+    """
+    Recomputes the daily rows of RevenueSummary from the last summarized day
+    (the watermark) onward. Every row is rebuilt if full is True or if the
+    summary is empty.
+
+    Sales are aggregated by the database with one query per source: order
+    lines, refunds and custom payments.
+
+    Returns the first day refreshed, or None if every row was rebuilt.
+    """
+    start_date = None
+    if not full:
+        watermark = RevenueSummary.objects.aggregate(Max('date'))['date__max']
+        if watermark:
+            start_date = watermark - REVENUE_SUMMARY_OVERLAP
+
+    order_lines = OrderLine.objects.all()
+    refunds = Refund.objects.all()
+    custom_payments = CustomPayment.objects.all()
+    if start_date:
+        start_time = timezone.make_aware(
+            datetime.combine(start_date, time.min)
+        )
+        order_lines = order_lines.filter(
+            order__transaction_date__gte=start_time,
+        )
+        refunds = refunds.filter(refund_date__gte=start_time)
+        custom_payments = custom_payments.filter(
+            transaction_date__gte=start_time,
+        )
+
+    rows = defaultdict(dict)
+
+    order_lines = order_lines.annotate(
+        date=TruncDate('order__transaction_date'),
+    ).values('date', 'content_type', 'object_id').annotate(
+        total_quantity=Sum('quantity'),
+        # The cost of an order line already includes its quantity
+        total_revenue=Sum('cost'),
+        total_discount=Sum('coupon_real_value'),
+    )
+    for entry in order_lines:
+        row = rows[(entry['date'], entry['content_type'], entry['object_id'])]
+        row['quantity'] = entry['total_quantity']
+        row['revenue'] = entry['total_revenue']
+        row['discount'] = entry['total_discount']
+        row['tax'] = (
+            entry['total_revenue'] * Decimal(repr(TAX_RATE))
+        ).quantize(Decimal('0.01'))
+
+    refunds = refunds.annotate(
+        date=TruncDate('refund_date'),
+    ).values(
+        'date', 'orderline__content_type', 'orderline__object_id',
+    ).annotate(total_amount=Sum('amount'))
+    for entry in refunds:
+        row = rows[(
+            entry['date'],
+            entry['orderline__content_type'],
+            entry['orderline__object_id'],
+        )]
+        row['refunds'] = entry['total_amount']
+
+    # No tax is applied on custom payments
+    custom_payment_type = ContentType.objects.get_for_model(CustomPayment)
+    custom_payments = custom_payments.annotate(
+        date=TruncDate('transaction_date'),
+    ).values('date').annotate(
+        total_quantity=Count('id'),
+        total_revenue=Sum('price'),
+    )
+    for entry in custom_payments:
+        row = rows[(entry['date'], custom_payment_type.id, None)]
+        row['quantity'] = entry['total_quantity']
+        row['revenue'] = entry['total_revenue']
+
+    with transaction.atomic():
+        summary = RevenueSummary.objects.all()
+        if start_date:
+            summary = summary.filter(date__gte=start_date)
+        summary.delete()
+        RevenueSummary.objects.bulk_create(
+            RevenueSummary(
+                date=date,
+                content_type_id=content_type_id,
+                object_id=object_id,
+                **values
+            ) for (date, content_type_id, object_id), values in rows.items()
+        )
+
+    return start_date
+
+
+def get_revenue_report(start_date=None, end_date=None, period='day',
+                       group_by=None, product_type=None):
+    """
+    Returns the sales of the revenue summary between two dates (included),
+    summed by period ("day", "week" or "month") and optionally grouped by
+    "product_type", "product" or "workplace" (for timeslots).
+
+    Each entry contains the start date of its period, its group and the
+    totals of the fields in REVENUE_SUMMARY_FIELDS. Totals are summed by the
+    database, per day for weekly reports.
+    """
+    rows = RevenueSummary.objects.all()
+    if start_date:
+        rows = rows.filter(date__gte=start_date)
+    if end_date:
+        rows = rows.filter(date__lte=end_date)
+    if product_type:
+        rows = rows.filter(content_type__model=product_type)
+
+    # Weeks are folded below: Django 2.0 has no TruncWeek
+    if period == 'month':
+        rows = rows.annotate(period=TruncMonth('date'))
+    else:
+        rows = rows.annotate(period=F('date'))
+
+    group_names = list()
+    if group_by in ('product_type', 'product'):
+        rows = rows.annotate(product_type=F('content_type__model'))
+        group_names.append('product_type')
+    if group_by == 'product':
+        group_names.append('object_id')
+    if group_by == 'workplace':
+        rows = rows.annotate(workplace=Case(
+            When(
+                content_type__model='timeslot',
+                then=Subquery(
+                    TimeSlot.objects.filter(
+                        pk=OuterRef('object_id'),
+                    ).values('period__workplace_id')[:1]
+                ),
+            ),
+            default=None,
+            output_field=IntegerField(),
+        ))
+        group_names.append('workplace')
+
+    rows = rows.values('period', *group_names).annotate(**{
+        'total_' + field_name: Sum(field_name)
+        for field_name in REVENUE_SUMMARY_FIELDS
+    }).order_by('period', *group_names)
+
+    entries = OrderedDict()
+    for row in rows:
+        period_start = row['period']
+        if period == 'week':
+            period_start -= timedelta(days=period_start.weekday())
+
+        key = (period_start, ) + tuple(row[name] for name in group_names)
+        if key not in entries:
+            entries[key] = OrderedDict(period=period_start)
+            for name in group_names:
+                entries[key][name] = row[name]
+            for field_name in REVENUE_SUMMARY_FIELDS:
+                entries[key][field_name] = 0
+        for field_name in REVENUE_SUMMARY_FIELDS:
+            entries[key][field_name] += row['total_' + field_name]
+
+    return list(entries.values())
@@ -0,0 +1,50 @@
+from django.db.models.signals import m2m_changed
+
+from .models import Coupon
+from .services import APPLICABLE_PRODUCT_FIELDS, update_coupon_applicability
+
+
+def rebuild_coupon_applicability(sender, instance, action, reverse, pk_set,
+                                 **kwargs):
+    """
+    Keeps Coupon.applicability in sync with the applicable_* fields.
+
+    When the relation is changed from the product side (reverse), "instance"
+    is the product and "pk_set" contains the affected coupons.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            update_coupon_applicability(instance)
+        return
+
+    field_name = APPLICABLE_FIELDS_BY_THROUGH[sender]
+    if action == 'pre_clear':
+        # The affected coupons are unknown once the relation is cleared
+        instance._cleared_coupons = list(
+            Coupon.objects.filter(
+                **{field_name: instance}
+            ).values_list('pk', flat=True)
+        )
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_coupons', [])
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    for coupon in Coupon.objects.filter(pk__in=pk_set):
+        update_coupon_applicability(coupon)
+
+
+APPLICABLE_FIELDS_BY_THROUGH = {
+    getattr(Coupon, field_name).through: field_name
+    for field_name in APPLICABLE_PRODUCT_FIELDS + ('applicable_product_types',)
+}
+
+for through in APPLICABLE_FIELDS_BY_THROUGH:
+    m2m_changed.connect(
+        rebuild_coupon_applicability,
+        sender=through,
+        dispatch_uid='rebuild_coupon_applicability_{0}'.format(
+            through._meta.label
+        ),
+    )
@@ -0,0 +1,76 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from blitz_api.factories import UserFactory
+
+from ..models import Order, OrderLine, Package
+
+
+class BackfillOrderTotalsTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(BackfillOrderTotalsTest, cls).setUpClass()
+        cls.user = UserFactory()
+        cls.package = Package.objects.create(
+            name="extreme_package",
+            details="100 reservations package",
+            available=True,
+            price=400,
+            reservations=100,
+        )
+        cls.orders = [
+            Order.objects.create(
+                user=cls.user,
+                transaction_date=timezone.now(),
+                authorization_id=1,
+                settlement_id=1,
+            ) for i in range(3)
+        ]
+        for order in cls.orders:
+            OrderLine.objects.create(
+                order=order,
+                quantity=1,
+                content_type=ContentType.objects.get_for_model(Package),
+                object_id=cls.package.id,
+                cost=400,
+            )
+
+    def test_backfill_order_totals(self):
+        out = StringIO()
+
+        call_command(
+            'backfill_order_totals',
+            '--batch_size=2',
+            stdout=out,
+        )
+
+        self.assertIn(
+            'Successfully updated the totals of 3 orders',
+            out.getvalue()
+        )
+        for order in Order.objects.all():
+            self.assertEqual(order.subtotal, 400)
+            self.assertEqual(order.total, Decimal('459.90'))
+
+    def test_backfill_order_totals_missing(self):
+        out = StringIO()
+
+        Order.objects.filter(pk=self.orders[0].pk).update(total=1)
+
+        call_command(
+            'backfill_order_totals',
+            '--missing',
+            stdout=out,
+        )
+
+        self.assertIn(
+            'Successfully updated the totals of 2 orders',
+            out.getvalue()
+        )
+        self.assertEqual(Order.objects.get(pk=self.orders[0].pk).total, 1)
@@ -0,0 +1,140 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+import pytz
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase
+
+from blitz_api.factories import UserFactory
+
+from ..models import (CustomPayment, Order, OrderLine, Package, Refund,
+                      RevenueSummary, )
+
+LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
+
+
+class RefreshRevenueSummaryTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(RefreshRevenueSummaryTest, cls).setUpClass()
+        cls.user = UserFactory()
+        cls.package = Package.objects.create(
+            name="extreme_package",
+            details="100 reservations package",
+            available=True,
+            price=400,
+            reservations=100,
+        )
+        cls.package_type = ContentType.objects.get_for_model(Package)
+        cls.orderline = cls.create_order(datetime(2019, 1, 10, 23), 380, 20)
+        cls.create_order(datetime(2019, 1, 10, 8), 800, quantity=2)
+        Refund.objects.create(
+            orderline=cls.orderline,
+            amount=100,
+            refund_date=LOCAL_TIMEZONE.localize(datetime(2019, 1, 15, 8)),
+        )
+        CustomPayment.objects.create(
+            user=cls.user,
+            name="custom",
+            price=30,
+            transaction_date=LOCAL_TIMEZONE.localize(
+                datetime(2019, 1, 10, 12)
+            ),
+            authorization_id=1,
+            settlement_id=1,
+        )
+
+    @classmethod
+    def create_order(cls, transaction_date, cost, discount=0, quantity=1):
+        order = Order.objects.create(
+            user=cls.user,
+            transaction_date=LOCAL_TIMEZONE.localize(transaction_date),
+            authorization_id=1,
+            settlement_id=1,
+        )
+        return OrderLine.objects.create(
+            order=order,
+            quantity=quantity,
+            content_type=cls.package_type,
+            object_id=cls.package.id,
+            cost=cost,
+            coupon_real_value=discount,
+        )
+
+    def test_refresh_revenue_summary(self):
+        out = StringIO()
+
+        call_command('refresh_revenue_summary', stdout=out)
+
+        self.assertIn(
+            'Successfully rebuilt the revenue summary',
+            out.getvalue()
+        )
+
+        # Sales are summarized by local day
+        row = RevenueSummary.objects.get(
+            date=date(2019, 1, 10),
+            content_type=self.package_type,
+        )
+        # The cost of an order line already includes its quantity
+        self.assertEqual(row.quantity, 3)
+        self.assertEqual(row.revenue, 1180)
+        self.assertEqual(row.discount, 20)
+        self.assertEqual(
+            row.tax,
+            round(Decimal(1180 * settings.LOCAL_SETTINGS['SELLING_TAX']), 2),
+        )
+
+        row = RevenueSummary.objects.get(date=date(2019, 1, 15))
+        self.assertEqual(row.refunds, 100)
+        self.assertEqual(row.revenue, 0)
+
+        row = RevenueSummary.objects.get(
+            date=date(2019, 1, 10),
+            content_type=ContentType.objects.get_for_model(CustomPayment),
+        )
+        self.assertEqual(row.quantity, 1)
+        self.assertEqual(row.revenue, 30)
+        self.assertEqual(row.tax, 0)
+
+    def test_refresh_revenue_summary_from_watermark(self):
+        """
+        Ensure that only days since the watermark are recomputed.
+        """
+        out = StringIO()
+
+        call_command('refresh_revenue_summary', stdout=out)
+
+        RevenueSummary.objects.filter(date=date(2019, 1, 10)).update(
+            quantity=99,
+        )
+        self.create_order(datetime(2019, 1, 20, 8), 400)
+
+        call_command('refresh_revenue_summary', stdout=out)
+
+        self.assertIn(
+            'Successfully refreshed the revenue summary since 2019-01-14',
+            out.getvalue()
+        )
+        self.assertEqual(
+            RevenueSummary.objects.get(date=date(2019, 1, 20)).revenue,
+            400,
+        )
+        self.assertEqual(
+            RevenueSummary.objects.filter(
+                date=date(2019, 1, 10),
+                quantity=99,
+            ).count(),
+            2,
+        )
+
+        call_command('refresh_revenue_summary', '--full', stdout=out)
+
+        self.assertFalse(
+            RevenueSummary.objects.filter(quantity=99).exists()
+        )
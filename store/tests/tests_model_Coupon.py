@@ -43,3 +43,56 @@ class CouponTests(APITestCase):
         )
 
         self.assertEqual(str(coupon), "12345678")
+
+    def test_applicability(self):
+        """
+        Ensure that the flattened applicability of a coupon follows changes
+        made to its applicable products, from both sides of the relations.
+        """
+        package = Package.objects.create(
+            name="basic_package",
+            details="10 reservations package",
+            available=True,
+            price=50,
+            reservations=10,
+        )
+        package_key = str(self.package_type.id)
+
+        self.assertEqual(
+            self.coupon.applicability['product_types'],
+            [self.package_type.id],
+        )
+        self.assertEqual(
+            self.coupon.applicability['products'][package_key],
+            [],
+        )
+
+        self.coupon.applicable_packages.add(package)
+        self.coupon.refresh_from_db()
+        self.assertEqual(
+            self.coupon.applicability['products'][package_key],
+            [package.id],
+        )
+
+        package.applicable_coupons.clear()
+        self.coupon.refresh_from_db()
+        self.assertEqual(
+            self.coupon.applicability['products'][package_key],
+            [],
+        )
+
+        package.applicable_coupons.add(self.coupon)
+        self.coupon.refresh_from_db()
+        self.assertEqual(
+            self.coupon.applicability['products'][package_key],
+            [package.id],
+        )
+
+        self.coupon.applicable_packages.remove(package)
+        self.coupon.applicable_product_types.clear()
+        self.coupon.refresh_from_db()
+        self.assertEqual(
+            self.coupon.applicability['products'][package_key],
+            [],
+        )
+        self.assertEqual(self.coupon.applicability['product_types'], [])
@@ -12,6 +12,7 @@ from blitz_api.factories import UserFactory
 from workplace.models import TimeSlot, Period
 
 from ..models import Order, OrderLine, Package
+from ..services import update_order_totals
 
 TAX = settings.LOCAL_SETTINGS['SELLING_TAX']
 
@@ -77,10 +78,30 @@ class OrderTests(APITestCase):
 
         self.assertEqual(str(order), '1')
 
-    # def test_properties(self):
-    #     """
-    #     Ensure that the property methods returns a valid value.
-    #     """
-    #     total_cost = decimal.Decimal(str(999 * 400 + 999 * 400 * TAX), 2)
-    #     self.assertEqual(self.order.total_ticket, 2 * 3)
-    #     self.assertEqual(self.order.total_cost, total_cost)
+    def test_totals(self):
+        """
+        Ensure that the totals of an order are computed from its lines.
+        """
+        OrderLine.objects.create(
+            order=self.order,
+            quantity=1,
+            content_type=self.package_type,
+            object_id=1,
+            cost=390,
+            coupon_real_value=10,
+        )
+
+        update_order_totals(self.order)
+        self.order.refresh_from_db()
+
+        self.assertEqual(self.order.subtotal, 390)
+        self.assertEqual(self.order.discount, 10)
+        self.assertEqual(
+            self.order.tax,
+            round(decimal.Decimal(390 * TAX), 2),
+        )
+        self.assertEqual(
+            self.order.total,
+            round(decimal.Decimal(390 + 390 * TAX), 2),
+        )
+        self.assertEqual(self.order.ticket_total, 2 * 3)
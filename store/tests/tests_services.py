@@ -1,7 +1,14 @@
 import json
+import pytz
 import responses
 
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.test.utils import override_settings
 
 from rest_framework import status
@@ -11,19 +18,28 @@ from blitz_api.factories import UserFactory
 
 from .paysafe_sample_responses import (UNKNOWN_EXCEPTION,
                                        SAMPLE_INVALID_PAYMENT_TOKEN,
-                                       SAMPLE_PROFILE_RESPONSE,)
+                                       SAMPLE_PROFILE_RESPONSE,
+                                       SAMPLE_REFUND_RESPONSE,)
 
 from ..exceptions import PaymentAPIError
-from ..models import PaymentProfile
+from ..models import (Coupon, CouponUser, Order, OrderLine, Package,
+                      PaymentProfile, Refund, )
 from ..services import (charge_payment,
                         get_external_payment_profile,
                         create_external_payment_profile,
                         update_external_card,
                         delete_external_card,
-                        create_external_card,)
+                        create_external_card,
+                        create_coupons,
+                        get_refund_amount,
+                        redeem_coupon,
+                        send_refund,
+                        update_refunded_totals,)
 
 User = get_user_model()
 
+LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
+
 PAYMENT_TOKEN = "CIgbMO3P1j7HUiy"
 SINGLE_USE_TOKEN = "ASDG3e3gs3vrBTR"
 
@@ -160,6 +176,53 @@ class ServicesTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(json.loads(response.content), SAMPLE_PROFILE_RESPONSE)
 
+    @responses.activate
+    def test_send_refund(self):
+        """
+        Ensure that a recorded refund is sent once, with a reference derived
+        from the refund.
+        """
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds",
+            json=SAMPLE_REFUND_RESPONSE,
+            status=200
+        )
+        order = Order.objects.create(
+            user=self.user,
+            transaction_date=datetime.now(LOCAL_TIMEZONE),
+            authorization_id=1,
+            settlement_id=1,
+        )
+        order_line = OrderLine.objects.create(
+            order=order,
+            quantity=1,
+            content_type=ContentType.objects.get_for_model(User),
+            object_id=self.user.id,
+            cost=100,
+        )
+        refund = Refund.objects.create(
+            orderline=order_line,
+            refund_date=datetime.now(LOCAL_TIMEZONE),
+            amount=Decimal('114.98'),
+        )
+
+        send_refund(refund.id)
+        send_refund(refund.id)
+
+        refund.refresh_from_db()
+
+        self.assertEqual(refund.refund_id, SAMPLE_REFUND_RESPONSE['id'])
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(
+            json.loads(responses.calls[0].request.body),
+            {
+                'merchantRefNum': "refund-{0}".format(refund.id),
+                'amount': 11498,
+            }
+        )
+
     @responses.activate
     def test_unknown_external_api_exception(self):
         """
@@ -291,3 +354,190 @@ class ServicesTests(APITestCase):
             get_external_payment_profile,
             self.payment_profile.external_api_id
         )
+
+
+class RefundServicesTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.order = Order.objects.create(
+            user=self.user,
+            transaction_date=datetime.now(LOCAL_TIMEZONE),
+            authorization_id=1,
+            settlement_id=1,
+        )
+        self.order_line = OrderLine.objects.create(
+            order=self.order,
+            quantity=1,
+            content_type=ContentType.objects.get_for_model(User),
+            object_id=self.user.id,
+            cost=100,
+        )
+
+    def test_get_refund_amount(self):
+        """
+        Ensure that the refund rate and taxes are applied and that the amount
+        and its taxes are rounded to the cent.
+        """
+        self.assertEqual(
+            get_refund_amount(self.order_line, Decimal(100)),
+            (Decimal('100.00'), Decimal('14.98')),
+        )
+        self.assertEqual(
+            get_refund_amount(self.order_line, Decimal(100), 50),
+            (Decimal('50.00'), Decimal('7.49')),
+        )
+        self.assertEqual(
+            get_refund_amount(self.order_line, Decimal(100), 0),
+            (Decimal(0), Decimal(0)),
+        )
+
+    def test_get_refund_amount_capped(self):
+        """
+        Ensure that an order line is never refunded more than its cost minus
+        what was already refunded, unless its cost is unknown, and that the
+        taxes of a capped amount are never negative.
+        """
+        self.order_line.refunded_total = Decimal('100.00')
+
+        self.assertEqual(
+            get_refund_amount(self.order_line, Decimal(100)),
+            (Decimal('13.03'), Decimal('1.95')),
+        )
+
+        self.order_line.refunded_total = Decimal('200.00')
+
+        self.assertEqual(
+            get_refund_amount(self.order_line, Decimal(100)),
+            (Decimal(0), Decimal(0)),
+        )
+
+        self.order_line.cost = 0
+
+        self.assertEqual(
+            get_refund_amount(self.order_line, Decimal(100)),
+            (Decimal('100.00'), Decimal('14.98')),
+        )
+
+    def test_update_refunded_totals(self):
+        """
+        Ensure that refunded totals are the sum of the refunds of each order
+        line, computed with a single query.
+        """
+        other_order_line = OrderLine.objects.create(
+            order=self.order,
+            quantity=1,
+            content_type=ContentType.objects.get_for_model(User),
+            object_id=self.user.id,
+            cost=100,
+        )
+        for amount in (Decimal('10.50'), Decimal('20.25')):
+            Refund.objects.create(
+                orderline=self.order_line,
+                refund_date=datetime.now(LOCAL_TIMEZONE),
+                amount=amount,
+            )
+
+        with self.assertNumQueries(1):
+            update_refunded_totals(
+                [self.order_line.id, other_order_line.id]
+            )
+
+        self.order_line.refresh_from_db()
+        other_order_line.refresh_from_db()
+
+        self.assertEqual(self.order_line.refunded_total, Decimal('30.75'))
+        self.assertEqual(other_order_line.refunded_total, Decimal(0))
+
+
+class CouponServicesTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.coupon = Coupon.objects.create(
+            code="ABCD1234",
+            start_time=LOCAL_TIMEZONE.localize(datetime(2000, 1, 15, 8)),
+            end_time=LOCAL_TIMEZONE.localize(datetime(2130, 1, 15, 8)),
+            value=10,
+            max_use_per_user=2,
+            max_use=3,
+            owner=self.user,
+        )
+
+    def test_redeem_coupon(self):
+        """
+        Ensure that a use is recorded until the per-user limit is reached.
+        """
+        self.assertTrue(redeem_coupon(self.coupon, self.user))
+        self.assertTrue(redeem_coupon(self.coupon, self.user))
+        self.assertFalse(redeem_coupon(self.coupon, self.user))
+
+        coupon_user = CouponUser.objects.get(
+            coupon=self.coupon,
+            user=self.user,
+        )
+        self.assertEqual(coupon_user.uses, 2)
+
+    def test_create_coupons_atomic(self):
+        """
+        Ensure that no coupon is kept if recording their relations or their
+        history fails.
+        """
+        package = Package.objects.create(
+            name="package",
+            price=40,
+            reservations=10,
+            available=True,
+        )
+        coupon_data = {
+            'start_time': self.coupon.start_time,
+            'end_time': self.coupon.end_time,
+            'value': 10,
+            'max_use_per_user': 1,
+            'max_use': 1,
+            'owner': self.user,
+        }
+
+        with mock.patch(
+                'simple_history.manager.HistoryManager.bulk_history_create',
+                side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                create_coupons(
+                    coupon_data, {'applicable_packages': [package]}, 3,
+                )
+
+        self.assertEqual(Coupon.objects.count(), 1)
+
+        coupons = create_coupons(
+            coupon_data, {'applicable_packages': [package]}, 3,
+        )
+
+        self.assertEqual(len(coupons), 3)
+        for coupon in coupons:
+            self.assertEqual(list(coupon.applicable_packages.all()), [package])
+
+    def test_redeem_coupon_max_use(self):
+        """
+        Ensure that a use is refused once the global limit is reached.
+        """
+        CouponUser.objects.create(coupon=self.coupon, user=self.user, uses=2)
+
+        self.assertTrue(redeem_coupon(self.coupon, self.user2))
+        self.assertFalse(redeem_coupon(self.coupon, self.user2))
+
+        coupon_user = CouponUser.objects.get(
+            coupon=self.coupon,
+            user=self.user2,
+        )
+        self.assertEqual(coupon_user.uses, 1)
+
+    def test_redeem_coupon_unlimited(self):
+        """
+        Ensure that a limit of 0 means unlimited uses.
+        """
+        self.coupon.max_use = 0
+        self.coupon.max_use_per_user = 0
+
+        for i in range(5):
+            self.assertTrue(redeem_coupon(self.coupon, self.user))
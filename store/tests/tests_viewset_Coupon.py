@@ -10,14 +10,17 @@ from unittest import mock
 
 from django.conf import settings
 from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 
 from blitz_api.factories import UserFactory, AdminFactory
-from blitz_api.models import AcademicLevel
-from blitz_api.services import remove_translation_fields
+from blitz_api.models import AcademicLevel, ScheduledTask
+from blitz_api.services import (remove_translation_fields,
+                                run_scheduled_tasks, )
 from workplace.models import TimeSlot, Period, Workplace
 from retirement.models import Retirement
 
@@ -407,12 +410,60 @@ class CouponTests(APITestCase):
 
         self.assertEqual(
             response.status_code,
-            status.HTTP_204_NO_CONTENT,
+            status.HTTP_202_ACCEPTED,
             response.content,
         )
 
+        task = ScheduledTask.objects.get(
+            id=json.loads(response.content)['task'],
+        )
+        self.assertEqual(task.name, 'coupon_notification')
+        self.assertEqual(len(mail.outbox), 0)
+
+        run_scheduled_tasks()
+
         self.assertEqual(len(mail.outbox), 2)
 
+    def test_notify_email_for_coupon_batch(self):
+        """
+        Ensure that every address gets a single copy of the notification and
+        that messages are rendered once and sent through a shared connection.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        data = {
+            "email_list": [
+                "fake{0}@fake.com".format(i) for i in range(150)
+            ] + ["fake0@fake.com"]
+        }
+
+        with mock.patch(
+                'store.services.render_to_string',
+                return_value='message') as render, \
+                mock.patch(
+                    'store.services.get_connection',
+                    wraps=mail.get_connection) as get_connection:
+            response = self.client.post(
+                reverse(
+                    'coupon-notify',
+                    kwargs={'pk': 1},
+                ),
+                data,
+                format='json',
+            )
+            run_scheduled_tasks()
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_202_ACCEPTED,
+            response.content,
+        )
+
+        self.assertEqual(len(mail.outbox), 150)
+        self.assertEqual(mail.outbox[0].to, ["fake0@fake.com"])
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(get_connection.call_count, 2)
+
     def test_notify_email_for_coupon_owner(self):
         """
         Ensure that a coupon owner can notify a list of emails.
@@ -437,10 +488,18 @@ class CouponTests(APITestCase):
 
         self.assertEqual(
             response.status_code,
-            status.HTTP_204_NO_CONTENT,
+            status.HTTP_202_ACCEPTED,
             response.content,
         )
 
+        task = ScheduledTask.objects.get(
+            id=json.loads(response.content)['task'],
+        )
+        self.assertEqual(task.name, 'coupon_notification')
+        self.assertEqual(len(mail.outbox), 0)
+
+        run_scheduled_tasks()
+
         self.assertEqual(len(mail.outbox), 2)
 
     def test_notify_email_for_coupon_random_user(self):
@@ -610,7 +669,7 @@ class CouponTests(APITestCase):
             "owner": "http://testserver/users/1",
         }
         with mock.patch(
-                'store.serializers.random.choices', return_value="ABCDEFGH"):
+                'store.services.random.choices', return_value="ABCDEFGH"):
             response = self.client.post(
                 reverse('coupon-list'),
                 data,
@@ -667,6 +726,99 @@ class CouponTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_batch_create(self):
+        """
+        Ensure we can create many coupons with unique codes at once.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        data = {
+            "count": 20,
+            "applicable_product_types": [
+                "package"
+            ],
+            "applicable_retirements": [
+                "http://testserver/retirement/retirements/" +
+                str(self.retirement.id)
+            ],
+            "value": "13.00",
+            "start_time": "2019-01-06T15:11:05-05:00",
+            "end_time": "2020-01-06T15:11:06-05:00",
+            "max_use": 100,
+            "max_use_per_user": 2,
+            "details": "Any package for clients",
+            "owner": "http://testserver/users/1",
+        }
+
+        response = self.client.post(
+            reverse('coupon-batch-create'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            response.content,
+        )
+
+        response_data = json.loads(response.content)
+
+        self.assertEqual(response_data['count'], 20)
+        self.assertEqual(len(set(response_data['codes'])), 20)
+
+        coupons = Coupon.objects.filter(code__in=response_data['codes'])
+
+        self.assertEqual(coupons.count(), 20)
+        for coupon in coupons:
+            self.assertEqual(
+                list(coupon.applicable_product_types.all()),
+                [self.package_type],
+            )
+            self.assertEqual(
+                list(coupon.applicable_retirements.all()),
+                [self.retirement],
+            )
+            self.assertEqual(
+                coupon.applicability['products'][
+                    str(ContentType.objects.get_for_model(Retirement).id)
+                ],
+                [self.retirement.id],
+            )
+            self.assertEqual(coupon.history.count(), 1)
+
+    def test_batch_create_without_permission(self):
+        """
+        Ensure we can't create many coupons if user has no permission.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        data = {
+            "count": 20,
+            "value": "13.00",
+            "start_time": "2019-01-06T15:11:05-05:00",
+            "end_time": "2020-01-06T15:11:06-05:00",
+            "max_use": 100,
+            "max_use_per_user": 2,
+            "details": "Any package for clients",
+            "owner": "http://testserver/users/1",
+        }
+
+        response = self.client.post(
+            reverse('coupon-batch-create'),
+            data,
+            format='json',
+        )
+
+        content = {
+            'detail': 'You do not have permission to perform this action.'
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Coupon.objects.count(), 2)
+
     def test_create_missing_field(self):
         """
         Ensure we can't create a coupon when required field are missing.
@@ -1104,6 +1256,7 @@ class CouponTests(APITestCase):
                     'next_user_notified': 0,
                     'notification_interval': '1 00:00:00',
                     'pictures': [],
+                    'pictures_srcset': [],
                     'place_name': '',
                     'places_remaining': 400,
                     'postal_code': '123 456',
@@ -1143,6 +1296,7 @@ class CouponTests(APITestCase):
                         'longitude': None,
                         'name': 'random_workplace',
                         'pictures': [],
+                        'pictures_srcset': [],
                         'place_name': '',
                         'postal_code': '123 456',
                         'seats': 40,
@@ -1165,6 +1319,72 @@ class CouponTests(APITestCase):
         self.coupon.applicable_packages.set([])
         self.coupon.applicable_memberships.set([])
 
+    def test_list_compact(self):
+        """
+        Ensure that applicable products are only represented by their id and
+        name in compact mode, with a number of queries that doesn't depend on
+        the number of coupons.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        self.coupon.applicable_retirements.set([
+            self.retirement,
+        ])
+        self.coupon.applicable_timeslots.set([
+            self.time_slot,
+        ])
+        self.coupon2.applicable_packages.set([
+            self.package,
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('coupon-list') + '?compact=true',
+                format='json',
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            data['results'][0]['applicable_retirements'],
+            [{'id': self.retirement.id, 'name': 'mega_retirement'}],
+        )
+        self.assertEqual(
+            data['results'][0]['applicable_timeslots'],
+            [{'id': self.time_slot.id, 'name': 'morning_time_slot'}],
+        )
+        self.assertEqual(
+            data['results'][1]['applicable_packages'],
+            [{'id': self.package.id, 'name': 'extreme_package'}],
+        )
+        self.assertEqual(data['results'][1]['applicable_memberships'], [])
+
+        coupon_queries = len(queries)
+
+        Coupon.objects.create(
+            value=13,
+            code="NEWCOUPO",
+            start_time="2019-01-06T15:11:05-05:00",
+            end_time="2020-01-06T15:11:06-05:00",
+            max_use=100,
+            max_use_per_user=2,
+            owner=self.admin,
+        ).applicable_retirements.set([self.retirement])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(
+                reverse('coupon-list') + '?compact=true',
+                format='json',
+            )
+
+        self.assertEqual(len(queries), coupon_queries)
+
+        self.coupon.applicable_retirements.set([])
+        self.coupon.applicable_timeslots.set([])
+        self.coupon2.applicable_packages.set([])
+
     def test_list_as_admin(self):
         """
         Ensure we can list all coupons as an admin.
@@ -1312,6 +1532,7 @@ class CouponTests(APITestCase):
                 'next_user_notified': 0,
                 'notification_interval': '1 00:00:00',
                 'pictures': [],
+                'pictures_srcset': [],
                 'place_name': '',
                 'places_remaining': 400,
                 'postal_code': '123 456',
@@ -1351,6 +1572,7 @@ class CouponTests(APITestCase):
                     'longitude': None,
                     'name': 'random_workplace',
                     'pictures': [],
+                    'pictures_srcset': [],
                     'place_name': '',
                     'postal_code': '123 456',
                     'seats': 40,
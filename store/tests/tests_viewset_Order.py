@@ -9,7 +9,8 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.core import mail
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
@@ -33,7 +34,7 @@ from .paysafe_sample_responses import (SAMPLE_PROFILE_RESPONSE,
 
 
 from ..models import (Package, Order, OrderLine, Membership, PaymentProfile,
-                      Coupon, CouponUser, )
+                      Coupon, CouponUser, RevenueSummary, )
 
 User = get_user_model()
 
@@ -284,6 +285,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 50.0,
+                'refunded_total': 0.0,
             }, {
                 'content_type': 'package',
                 'id': 3,
@@ -294,6 +296,7 @@ class OrderTests(APITestCase):
                 'coupon': "ABCD1234",
                 'coupon_real_value': 10.0,
                 'cost': 2 * self.package.price - 10,
+                'refunded_total': 0.0,
             }, {
                 'content_type': 'timeslot',
                 'id': 4,
@@ -304,6 +307,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 0.0,
+                'refunded_total': 0.0,
             }, {
                 'content_type': 'retirement',
                 'id': 5,
@@ -314,6 +318,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 199.0,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/2',
@@ -321,6 +326,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '319.00',
+            'discount': '10.00',
+            'tax': '47.77',
+            'total': '366.77',
+            'ticket_total': 1,
         }
 
         self.assertEqual(response_data, content)
@@ -338,7 +348,8 @@ class OrderTests(APITestCase):
             admin.membership_end,
             FIXED_TIME.date() + self.membership.duration
         )
-        admin.tickets = 1
+        User.objects.filter(pk=admin.pk).update(tickets=1)
+        admin.refresh_from_db(fields=['tickets'])
         admin.membership = None
         admin.save()
 
@@ -398,6 +409,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 0.0,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/2',
@@ -405,6 +417,11 @@ class OrderTests(APITestCase):
             'authorization_id': '0',
             'settlement_id': '0',
             'reference_number': '0',
+            'subtotal': '0.00',
+            'discount': '0.00',
+            'tax': '0.00',
+            'total': '0.00',
+            'ticket_total': 1,
         }
 
         self.assertEqual(response_data, content)
@@ -413,7 +430,8 @@ class OrderTests(APITestCase):
         admin.refresh_from_db()
 
         self.assertEqual(admin.tickets, 0)
-        admin.tickets = 1
+        User.objects.filter(pk=admin.pk).update(tickets=1)
+        admin.refresh_from_db(fields=['tickets'])
         admin.membership = None
         admin.save()
 
@@ -471,6 +489,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 0.0,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/2',
@@ -478,6 +497,11 @@ class OrderTests(APITestCase):
             'authorization_id': '0',
             'settlement_id': '0',
             'reference_number': '0',
+            'subtotal': '0.00',
+            'discount': '0.00',
+            'tax': '0.00',
+            'total': '0.00',
+            'ticket_total': 1,
         }
 
         self.assertEqual(response_data, content)
@@ -486,7 +510,8 @@ class OrderTests(APITestCase):
         admin.refresh_from_db()
 
         self.assertEqual(admin.tickets, 0)
-        admin.tickets = 1
+        User.objects.filter(pk=admin.pk).update(tickets=1)
+        admin.refresh_from_db(fields=['tickets'])
         admin.membership = None
         admin.save()
 
@@ -561,7 +586,8 @@ class OrderTests(APITestCase):
         admin = self.admin
         admin.refresh_from_db()
 
-        admin.tickets = 1
+        User.objects.filter(pk=admin.pk).update(tickets=1)
+        admin.refresh_from_db(fields=['tickets'])
         admin.membership = None
         admin.save()
 
@@ -1089,6 +1115,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 199.0,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/1',
@@ -1096,6 +1123,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '199.00',
+            'discount': '0.00',
+            'tax': '29.80',
+            'total': '228.80',
+            'ticket_total': 0,
         }
 
         self.assertEqual(response_data, content)
@@ -1158,6 +1190,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 199.0,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/1',
@@ -1165,6 +1198,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '199.00',
+            'discount': '0.00',
+            'tax': '29.80',
+            'total': '228.80',
+            'ticket_total': 0,
         }
 
         self.assertEqual(response_data, content)
@@ -1253,8 +1291,8 @@ class OrderTests(APITestCase):
         """
         self.client.force_authenticate(user=self.admin)
 
-        self.admin.tickets = 0
-        self.admin.save()
+        User.objects.filter(pk=self.admin.pk).update(tickets=0)
+        self.admin.refresh_from_db(fields=['tickets'])
 
         responses.add(
             responses.POST,
@@ -1300,8 +1338,8 @@ class OrderTests(APITestCase):
         self.assertEqual(admin.tickets, 0)
         self.assertEqual(admin.membership, None)
 
-        self.admin.tickets = 1
-        self.admin.save()
+        User.objects.filter(pk=self.admin.pk).update(tickets=1)
+        self.admin.refresh_from_db(fields=['tickets'])
 
     @responses.activate
     def test_create_with_invalid_payment_token(self):
@@ -1418,6 +1456,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 2 * self.package.price,
+                'refunded_total': 0.0,
             }, {
                 'content_type': 'timeslot',
                 'id': 3,
@@ -1428,6 +1467,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 0.0,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/1',
@@ -1435,6 +1475,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '80.00',
+            'discount': '0.00',
+            'tax': '11.98',
+            'total': '91.98',
+            'ticket_total': 1,
         }
 
         self.assertEqual(response_data, content)
@@ -1442,8 +1487,8 @@ class OrderTests(APITestCase):
         user = self.user
         user.refresh_from_db()
         self.assertEqual(user.tickets, self.package.reservations * 2)
-        user.tickets = 1
-        user.save()
+        User.objects.filter(pk=user.pk).update(tickets=1)
+        user.refresh_from_db(fields=['tickets'])
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
@@ -1508,6 +1553,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 50.0,
+                'refunded_total': 0.0,
             }, {
                 'content_type': 'package',
                 'id': 3,
@@ -1518,6 +1564,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 2 * self.package.price,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/2',
@@ -1525,6 +1572,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '130.00',
+            'discount': '0.00',
+            'tax': '19.47',
+            'total': '149.47',
+            'ticket_total': 0,
         }
 
         self.assertEqual(json.loads(response.content), content)
@@ -1534,7 +1586,8 @@ class OrderTests(APITestCase):
 
         self.assertEqual(admin.tickets, self.package.reservations * 2 + 1)
         self.assertEqual(admin.membership, self.membership)
-        admin.tickets = 1
+        User.objects.filter(pk=admin.pk).update(tickets=1)
+        admin.refresh_from_db(fields=['tickets'])
         admin.membership = None
         admin.save()
 
@@ -1796,6 +1849,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 50.0,
+                'refunded_total': 0.0,
             }, {
                 'content_type': 'package',
                 'id': 3,
@@ -1806,9 +1860,15 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 2 * self.package.price,
+                'refunded_total': 0.0,
             }],
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '130.00',
+            'discount': '0.00',
+            'tax': '19.47',
+            'total': '149.47',
+            'ticket_total': 0,
             'transaction_date': response_data['transaction_date'],
             'url': 'http://testserver/orders/3',
             'user': 'http://testserver/users/2',
@@ -1822,7 +1882,8 @@ class OrderTests(APITestCase):
         self.assertEqual(admin.tickets, self.package.reservations * 2 + 1)
         self.assertEqual(admin.membership, self.membership)
 
-        admin.tickets = 1
+        User.objects.filter(pk=admin.pk).update(tickets=1)
+        admin.refresh_from_db(fields=['tickets'])
         admin.membership = None
         admin.save()
 
@@ -1981,6 +2042,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '0.00',
+            'discount': '0.00',
+            'tax': '0.00',
+            'total': '0.00',
+            'ticket_total': 0,
             'order_lines': [{
                 'content_type': 'package',
                 'id': 1,
@@ -1990,7 +2056,8 @@ class OrderTests(APITestCase):
                 'url': 'http://testserver/order_lines/1',
                 'coupon': None,
                 'coupon_real_value': 0.0,
-                'cost': 99 * self.package.price
+                'cost': 99 * self.package.price,
+                'refunded_total': 0.0
             }],
         }
 
@@ -2053,6 +2120,11 @@ class OrderTests(APITestCase):
                 'authorization_id': '1',
                 'settlement_id': '1',
                 'reference_number': '751',
+                'subtotal': '0.00',
+                'discount': '0.00',
+                'tax': '0.00',
+                'total': '0.00',
+                'ticket_total': 0,
                 'order_lines': [{
                     'content_type': 'package',
                     'id': 1,
@@ -2063,6 +2135,7 @@ class OrderTests(APITestCase):
                     'coupon': None,
                     'coupon_real_value': 0.0,
                     'cost': self.package.price,
+                    'refunded_total': 0.0,
                 }],
                 'url': 'http://testserver/orders/1',
                 'user': 'http://testserver/users/1',
@@ -2096,6 +2169,11 @@ class OrderTests(APITestCase):
                 'authorization_id': '1',
                 'settlement_id': '1',
                 'reference_number': '751',
+                'subtotal': '0.00',
+                'discount': '0.00',
+                'tax': '0.00',
+                'total': '0.00',
+                'ticket_total': 0,
                 'order_lines': [{
                     'content_type': 'package',
                     'id': 1,
@@ -2106,6 +2184,7 @@ class OrderTests(APITestCase):
                     'coupon': None,
                     'coupon_real_value': 0.0,
                     'cost': self.package.price,
+                    'refunded_total': 0.0,
                 }],
                 'url': 'http://testserver/orders/1',
                 'user': 'http://testserver/users/1',
@@ -2115,6 +2194,11 @@ class OrderTests(APITestCase):
                 'authorization_id': '2',
                 'settlement_id': '2',
                 'reference_number': '751',
+                'subtotal': '0.00',
+                'discount': '0.00',
+                'tax': '0.00',
+                'total': '0.00',
+                'ticket_total': 0,
                 'order_lines': [],
                 'url': 'http://testserver/orders/2',
                 'user': 'http://testserver/users/2',
@@ -2164,6 +2248,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '0.00',
+            'discount': '0.00',
+            'tax': '0.00',
+            'total': '0.00',
+            'ticket_total': 0,
             'order_lines': [{
                 'content_type': 'package',
                 'id': 1,
@@ -2174,6 +2263,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': self.package.price,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/1',
             'user': 'http://testserver/users/1',
@@ -2223,6 +2313,11 @@ class OrderTests(APITestCase):
             'authorization_id': '1',
             'settlement_id': '1',
             'reference_number': '751',
+            'subtotal': '0.00',
+            'discount': '0.00',
+            'tax': '0.00',
+            'total': '0.00',
+            'ticket_total': 0,
             'order_lines': [{
                 'content_type': 'package',
                 'id': 1,
@@ -2233,6 +2328,7 @@ class OrderTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': self.package.price,
+                'refunded_total': 0.0,
             }],
             'url': 'http://testserver/orders/1',
             'user': 'http://testserver/users/1',
@@ -2262,6 +2358,146 @@ class OrderTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_revenue(self):
+        """
+        Ensure that an admin can get the revenue summed by period and product
+        type.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        package_type = ContentType.objects.get_for_model(Package)
+        membership_type = ContentType.objects.get_for_model(Membership)
+        for day, content_type in ((1, package_type), (20, package_type),
+                                  (20, membership_type)):
+            RevenueSummary.objects.create(
+                date=datetime(2019, 1, day).date(),
+                content_type=content_type,
+                object_id=1,
+                quantity=1,
+                revenue=100,
+                tax=15,
+            )
+        RevenueSummary.objects.create(
+            date=datetime(2019, 2, 1).date(),
+            content_type=package_type,
+            object_id=1,
+            refunds=50,
+        )
+
+        response = self.client.get(
+            reverse('order-revenue'),
+            {
+                'period': 'month',
+                'group_by': 'product_type',
+                'end_date': '2019-01-31',
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        content = [{
+            'period': '2019-01-01',
+            'product_type': 'membership',
+            'quantity': 1,
+            'revenue': '100.00',
+            'discount': '0.00',
+            'tax': '15.00',
+            'refunds': '0.00',
+        }, {
+            'period': '2019-01-01',
+            'product_type': 'package',
+            'quantity': 2,
+            'revenue': '200.00',
+            'discount': '0.00',
+            'tax': '30.00',
+            'refunds': '0.00',
+        }]
+
+        self.assertEqual(json.loads(response.content), content)
+
+    def test_revenue_by_workplace(self):
+        """
+        Ensure that the revenue can be summed by week and workplace.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        timeslot_type = ContentType.objects.get_for_model(TimeSlot)
+        package_type = ContentType.objects.get_for_model(Package)
+        # 2019-01-07 is a monday
+        for day, content_type, object_id in (
+                (7, timeslot_type, self.time_slot.id),
+                (13, timeslot_type, self.time_slot_no_seats.id),
+                (13, package_type, self.package.id),
+                (14, timeslot_type, self.time_slot.id),
+                (16, timeslot_type, self.time_slot.id)):
+            RevenueSummary.objects.create(
+                date=datetime(2019, 1, day).date(),
+                content_type=content_type,
+                object_id=object_id,
+                quantity=1,
+                revenue=10,
+            )
+
+        response = self.client.get(
+            reverse('order-revenue'),
+            {
+                'period': 'week',
+                'group_by': 'workplace',
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        entries = [
+            (entry['period'], entry['workplace'], entry['quantity'])
+            for entry in json.loads(response.content)
+        ]
+
+        self.assertCountEqual(entries, [
+            ('2019-01-07', self.workplace.id, 1),
+            ('2019-01-07', None, 1),
+            ('2019-01-07', self.workplace_no_seats.id, 1),
+            ('2019-01-14', self.workplace.id, 2),
+        ])
+
+    def test_revenue_invalid_dates(self):
+        """
+        Ensure that the start of the report must be before its end.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.get(
+            reverse('order-revenue'),
+            {
+                'start_date': '2019-02-01',
+                'end_date': '2019-01-01',
+            },
+        )
+
+        content = {
+            'end_date': ['End date must be later than start_date.']
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revenue_without_permission(self):
+        """
+        Ensure that users can't get the revenue.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('order-revenue'))
+
+        content = {
+            'detail': 'You do not have permission to perform this action.'
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_validate_coupon(self):
         """
         Ensure that we can validate a coupon before creating an order.
@@ -2315,6 +2551,40 @@ class OrderTests(APITestCase):
 
         self.assertEqual(response_data, content)
 
+    def test_validate_coupon_no_writes(self):
+        """
+        Ensure that validating a coupon doesn't write to the database.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        data = {
+            'order_lines': [{
+                'content_type': 'package',
+                'object_id': 1,
+                'quantity': 2,
+            }],
+            'coupon': "ABCD1234",
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('order-validate-coupon'),
+                data,
+                format='json',
+            )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            response.content,
+        )
+
+        writes = [
+            query['sql'] for query in queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+        self.assertEqual(writes, [])
+
     def test_validate_coupon_full_discount(self):
         """
         Ensure that we can validate a coupon with 100% discount.
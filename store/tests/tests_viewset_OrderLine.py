@@ -111,6 +111,7 @@ class OrderLineTests(APITestCase):
             'coupon': None,
             'coupon_real_value': 0.0,
             'cost': 2 * self.package.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/3'
         }
 
@@ -239,6 +240,7 @@ class OrderLineTests(APITestCase):
             'coupon': None,
             'coupon_real_value': 0.0,
             'cost': 2 * self.package.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/3'
         }
 
@@ -273,6 +275,7 @@ class OrderLineTests(APITestCase):
             'order': 'http://testserver/orders/1',
             'quantity': 1,
             'cost': self.membership.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/3'
         }
 
@@ -401,6 +404,7 @@ class OrderLineTests(APITestCase):
             'coupon': None,
             'coupon_real_value': 0.0,
             'cost': 99 * self.package.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/1'
         }
 
@@ -440,6 +444,7 @@ class OrderLineTests(APITestCase):
             'coupon': None,
             'coupon_real_value': 0.0,
             'cost': 9 * self.package.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/1'
         }
 
@@ -537,6 +542,7 @@ class OrderLineTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': self.package.price,
+                'refunded_total': 0.0,
                 'url': 'http://testserver/order_lines/1'
             }]
         }
@@ -571,6 +577,7 @@ class OrderLineTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': self.package.price,
+                'refunded_total': 0.0,
                 'url': 'http://testserver/order_lines/1'
             }, {
                 'content_type': 'package',
@@ -581,6 +588,7 @@ class OrderLineTests(APITestCase):
                 'coupon': None,
                 'coupon_real_value': 0.0,
                 'cost': 99 * self.package.price,
+                'refunded_total': 0.0,
                 'url': 'http://testserver/order_lines/2'
             }]
         }
@@ -629,6 +637,7 @@ class OrderLineTests(APITestCase):
             'coupon': None,
             'coupon_real_value': 0.0,
             'cost': self.package.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/1'
         }
 
@@ -677,6 +686,7 @@ class OrderLineTests(APITestCase):
             'coupon': None,
             'coupon_real_value': 0.0,
             'cost': self.package.price,
+            'refunded_total': 0.0,
             'url': 'http://testserver/order_lines/1'
         }
 
@@ -1,6 +1,8 @@
 import simple_history
 from modeltranslation.translator import TranslationOptions, register
 
+from blitz_api.history import BufferedHistoricalRecords
+
 from . import models
 
 
@@ -20,5 +22,9 @@ class PackageTranslationOptions(TranslationOptions):
     )
 
 
-simple_history.register(models.Membership, inherit=True)
-simple_history.register(models.Package, inherit=True)
+simple_history.register(
+    models.Membership, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.Package, inherit=True, records_class=BufferedHistoricalRecords
+)
@@ -3,6 +3,7 @@ import pytz
 from datetime import datetime
 
 from django.conf import settings
+from django.db.models import Prefetch
 from django.http import Http404, HttpResponse
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -13,7 +14,9 @@ from rest_framework.decorators import action, permission_classes
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
-from blitz_api.services import ExportPagination
+from blitz_api.services import (ExportPagination, prefetch_generic_objects,
+                                schedule_task, )
+from blitz_api.cache import CachedResponseMixin
 
 from .exceptions import PaymentAPIError
 from .models import (Package, Membership, Order, OrderLine, PaymentProfile,
@@ -22,8 +25,8 @@ from .permissions import IsOwner
 from .resources import (MembershipResource, PackageResource, OrderResource,
                         OrderLineResource, CustomPaymentResource,
                         CouponResource, CouponUserResource, RefundResource, )
-from .services import (delete_external_card, validate_coupon_for_order,
-                       notify_for_coupon, )
+from .services import (delete_external_card, evaluate_coupon,
+                       get_revenue_report, )
 
 from . import serializers, permissions
 
@@ -31,7 +34,7 @@ from . import serializers, permissions
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
 
-class MembershipViewSet(viewsets.ModelViewSet):
+class MembershipViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given membership.
@@ -45,6 +48,11 @@ class MembershipViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.MembershipSerializer
     queryset = Membership.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'store.Membership',
+        'store.OrderLine',
+        'blitz_api.AcademicLevel',
+    )
     filter_fields = {
         'duration': ['exact', 'gte', 'lte'],
         'academic_levels': ['exact', 'isnull'],
@@ -94,7 +102,7 @@ class MembershipViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class PackageViewSet(viewsets.ModelViewSet):
+class PackageViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given package.
@@ -108,6 +116,11 @@ class PackageViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.PackageSerializer
     queryset = Package.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'store.Package',
+        'store.Membership',
+        'store.OrderLine',
+    )
     filter_fields = {
         'reservations': ['exact', 'gte', 'lte'],
         'exclusive_memberships': ['exact', 'isnull'],
@@ -237,15 +250,39 @@ class OrderViewSet(viewsets.ModelViewSet):
         ])
         return response
 
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def revenue(self, request):
+        """
+        This custom action returns the revenue, discounts, taxes and refunds
+        of the store, read from the revenue summary.
+
+        Query parameters (all optional):
+            start_date, end_date: date range of the report (included).
+            period: "day" (default), "week" or "month".
+            group_by: "product_type", "product" or "workplace".
+            product_type: only report sales of this type of product.
+
+        NOTE: The summary is refreshed by the refresh_revenue_summary
+            management command. Sales made since its last run are missing.
+        """
+        serializer = serializers.RevenueReportSerializer(
+            data=request.query_params,
+        )
+
+        serializer.is_valid(raise_exception=True)
+
+        entries = get_revenue_report(**serializer.validated_data)
+
+        return Response(
+            serializers.RevenueReportEntrySerializer(entries, many=True).data
+        )
+
     @action(
         methods=['post'], detail=False, permission_classes=[IsAuthenticated])
     def validate_coupon(self, request, pk=None):
         """
         This validates if a coupon can be used in an order.
-        It has to create temporary objects to be able to use querysets.
-        Temporary objects are then deleted.
-
-        This is not the best way to do it and it could be improved.
+        The order is evaluated in memory: nothing is written to the database.
         """
         serializer = serializers.OrderSerializer(
             data=request.data,
@@ -260,26 +297,12 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response(error, status=status.HTTP_400_BAD_REQUEST)
         orderlines = serializer.validated_data.pop('order_lines', None)
         coupon = serializer.validated_data.pop('coupon', None)
-        serializer.validated_data.pop('payment_token', None)
-        serializer.validated_data.pop('single_use_token', None)
-        order = Order(
-            **serializer.validated_data,
-            transaction_date=timezone.now(),
-            user=request.user,
-        )
-        order.save()
-
-        orderline_list = []
-        for idx, orderline in enumerate(orderlines):
-            orderline_list.append(
-                OrderLine(
-                    **orderline,
-                    order=order,
-                )
-            )
-            orderline_list[idx].save()
 
-        response = validate_coupon_for_order(coupon, order)
+        orderline_list = [
+            OrderLine(**orderline) for orderline in orderlines
+        ]
+
+        response = evaluate_coupon(coupon, request.user, orderline_list)
         response['orderline'] = serializers.OrderLineSerializerNoOrder(
             response['orderline'],
             context={'request': request}
@@ -290,9 +313,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         response['orderline'].pop('coupon', None)
         response['orderline'].pop('coupon_real_value', None)
         response['orderline'].pop('cost', None)
-        order.delete()
-        for orderline in orderline_list:
-            orderline.delete()
+        response['orderline'].pop('refunded_total', None)
         if response['valid_use']:
             response.pop('valid_use', None)
             response.pop('error', None)
@@ -305,8 +326,18 @@ class OrderViewSet(viewsets.ModelViewSet):
         the currently authenticated user is an admin (is_staff).
         """
         if self.request.user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=self.request.user.id)
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(user=self.request.user.id)
+        return queryset.prefetch_related(
+            Prefetch(
+                'order_lines',
+                queryset=OrderLine.objects.select_related(
+                    'content_type',
+                    'coupon',
+                ),
+            ),
+        )
 
 
 class OrderLineViewSet(viewsets.ModelViewSet):
@@ -344,14 +375,37 @@ class OrderLineViewSet(viewsets.ModelViewSet):
         ])
         return response
 
+    def list(self, request, *args, **kwargs):
+        """
+        Same as the default list, with the products of the page fetched with
+        one query per type of product.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(
+                prefetch_generic_objects(page),
+                many=True,
+            )
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(
+            prefetch_generic_objects(queryset),
+            many=True,
+        )
+        return Response(serializer.data)
+
     def get_queryset(self):
         """
         This viewset should return owned order lines except if
         the currently authenticated user is an admin (is_staff).
         """
         if self.request.user.is_staff:
-            return OrderLine.objects.all()
-        return OrderLine.objects.filter(order__user=self.request.user)
+            queryset = OrderLine.objects.all()
+        else:
+            queryset = OrderLine.objects.filter(order__user=self.request.user)
+        return queryset.select_related('content_type', 'coupon')
 
 
 class CustomPaymentViewSet(viewsets.ModelViewSet):
@@ -419,6 +473,27 @@ class CouponViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated, permissions.IsAdminOrReadOnly)
     filter_fields = '__all__'
 
+    # Relations used by the representation of coupons. Products are
+    # expanded with their own relations unless the compact mode is used.
+    prefetch_compact = (
+        'applicable_product_types',
+        'users',
+        'applicable_retirements',
+        'applicable_timeslots',
+        'applicable_packages',
+        'applicable_memberships',
+    )
+    prefetch_full = (
+        'applicable_retirements__pictures',
+        'applicable_retirements__users',
+        'applicable_retirements__exclusive_memberships',
+        'applicable_timeslots__users',
+        'applicable_timeslots__period__workplace__pictures',
+        'applicable_timeslots__period__workplace__volunteers',
+        'applicable_packages__exclusive_memberships',
+        'applicable_memberships__academic_levels',
+    )
+
     @action(detail=False, permission_classes=[IsAdminUser])
     def export(self, request):
         # Use custom paginator (by page, min/max 1000 objects/page)
@@ -439,6 +514,28 @@ class CouponViewSet(viewsets.ModelViewSet):
         ])
         return response
 
+    @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
+    def batch_create(self, request):
+        """
+        This custom action allows an admin to create many coupons sharing the
+        same settings at once. Each coupon gets a unique random code.
+
+        Takes the same parameters as the creation of a single coupon, except
+        the code, and the number of coupons to create in "count".
+
+        The response contains the number of coupons created and their codes.
+        """
+        serializer = serializers.BatchCouponSerializer(
+            data=request.data,
+            context=self.get_serializer_context(),
+        )
+
+        serializer.is_valid(raise_exception=True)
+
+        report = serializer.save()
+
+        return Response(report, status=status.HTTP_201_CREATED)
+
     @action(methods=['post'], detail=True, permission_classes=[IsOwner])
     def notify(self, request, pk=None):
         """
@@ -447,6 +544,9 @@ class CouponViewSet(viewsets.ModelViewSet):
 
         We're using a DRF serializer field on-the-fly here to validate the
         email list.
+
+        The emails are sent in the background by a scheduled task, whose id is
+        returned.
         """
         email_list_data = request.data.get('email_list', None)
 
@@ -474,14 +574,15 @@ class CouponViewSet(viewsets.ModelViewSet):
                 "email_list": [str(msg) for msg in err.detail]
             })
 
-        for email in email_list:
-            # Notify every user in the list
-            notify_for_coupon(
-                email,
-                self.get_object(),
-            )
+        # The emails are sent by the scheduled task
+        task = schedule_task(
+            'coupon_notification',
+            timezone.now(),
+            coupon_id=self.get_object().pk,
+            email_list=email_list,
+        )
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response({'task': task.id}, status=status.HTTP_202_ACCEPTED)
 
     def get_queryset(self):
         """
@@ -489,8 +590,15 @@ class CouponViewSet(viewsets.ModelViewSet):
         the currently authenticated user is an admin (is_staff).
         """
         if self.request.user.is_staff:
-            return Coupon.objects.all()
-        return Coupon.objects.filter(owner=self.request.user)
+            queryset = Coupon.objects.all()
+        else:
+            queryset = Coupon.objects.filter(owner=self.request.user)
+
+        if self.action in ('retrieve', 'list'):
+            queryset = queryset.prefetch_related(*self.prefetch_compact)
+            if not serializers.is_compact(self.request):
+                queryset = queryset.prefetch_related(*self.prefetch_full)
+        return queryset
 
     def destroy(self, request, *args, **kwargs):
         try:
@@ -0,0 +1,24 @@
+# Generated by Django 2.0.8 on 2026-10-18 22:08
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workplace', '0022_workplace_volunteers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalpicture',
+            name='derivatives',
+            field=jsonfield.fields.JSONField(blank=True, default=dict, editable=False, verbose_name='Derivatives'),
+        ),
+        migrations.AddField(
+            model_name='picture',
+            name='derivatives',
+            field=jsonfield.fields.JSONField(blank=True, default=dict, editable=False, verbose_name='Derivatives'),
+        ),
+    ]
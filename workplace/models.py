@@ -1,13 +1,14 @@
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
-from django.utils.html import format_html
 from django.contrib.auth import get_user_model
 
+from jsonfield import JSONField
 from safedelete.models import SafeDeleteModel
 
-from simple_history.models import HistoricalRecords
+from blitz_api.history import BufferedHistoricalRecords
 
-from blitz_api.models import Address
+from blitz_api.models import Address, DirtyFieldsMixin
+from blitz_api.services import PictureMixin
 
 User = get_user_model()
 
@@ -47,7 +48,7 @@ class Workplace(Address, SafeDeleteModel):
         return self.name
 
 
-class Picture(models.Model):
+class Picture(PictureMixin, DirtyFieldsMixin, models.Model):
     """Represents pictures representing a workplace"""
 
     class Meta:
@@ -73,15 +74,13 @@ class Picture(models.Model):
         upload_to='workplaces'
     )
 
-    # Needed to display in the admin panel
-    def picture_tag(self):
-        return format_html(
-            '<img href="{0}" src="{0}" height="150" />'
-            .format(self.picture.url)
-        )
-
-    picture_tag.allow_tags = True
-    picture_tag.short_description = 'Picture'
+    # Resized copies of the picture, see blitz_api.services.PictureMixin
+    derivatives = JSONField(
+        verbose_name=_("Derivatives"),
+        blank=True,
+        default=dict,
+        editable=False,
+    )
 
     # History is registered in translation.py
     # history = HistoricalRecords()
@@ -199,7 +198,7 @@ class TimeSlot(SafeDeleteModel):
         return str(self.start_time) + " - " + str(self.end_time)
 
 
-class Reservation(SafeDeleteModel):
+class Reservation(DirtyFieldsMixin, SafeDeleteModel):
     """Represents a user registration to a TimeSlot"""
 
     CANCELATION_REASON = (
@@ -240,7 +239,7 @@ class Reservation(SafeDeleteModel):
         default=False,
     )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     def __str__(self):
         return str(self.user)
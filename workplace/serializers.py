@@ -2,9 +2,6 @@ from copy import copy
 
 from datetime import datetime
 
-from dateutil.parser import parse
-from dateutil.rrule import rrule, DAILY
-
 import pytz
 
 from rest_framework import serializers, status
@@ -14,23 +11,25 @@ from rest_framework.validators import UniqueValidator
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
-from django.db import transaction
-from django.db.models import F
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from blitz_api.serializers import UserSerializer
-from blitz_api.services import (remove_translation_fields,
-                                check_if_translated_field,)
+from blitz_api.serializers import DirectUploadTokenField, UserSerializer
+from blitz_api import history
+from blitz_api.services import (TranslatedSerializerMixin,
+                                check_if_translated_field,
+                                bulk_credit_tickets,)
 
 from .models import Workplace, Picture, Period, TimeSlot, Reservation
 from .fields import TimezoneField
+from .services import create_timeslots, generate_timeslot_occurrences
 
 User = get_user_model()
 
 
-class WorkplaceSerializer(serializers.HyperlinkedModelSerializer):
+class WorkplaceSerializer(TranslatedSerializerMixin,
+                          serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     timezone = TimezoneField(
         required=False,
@@ -73,6 +72,9 @@ class WorkplaceSerializer(serializers.HyperlinkedModelSerializer):
     # picture urls. This works but is not as clean as it could be.
     # Note: this is a read-only field so it isn't used for Workplace creation.
     pictures = serializers.SerializerMethodField()
+    # Resized copies of each picture, in the same order as "pictures", to be
+    # used as the srcset of the images.
+    pictures_srcset = serializers.SerializerMethodField()
 
     def get_pictures(self, obj):
         request = self.context['request']
@@ -81,6 +83,12 @@ class WorkplaceSerializer(serializers.HyperlinkedModelSerializer):
         ]
         return [request.build_absolute_uri(url) for url in picture_urls]
 
+    def get_pictures_srcset(self, obj):
+        request = self.context['request']
+        return [
+            picture.get_srcset(request) for picture in obj.pictures.all()
+        ]
+
     def validate(self, attr):
         err = {}
         if not check_if_translated_field('name', attr):
@@ -105,12 +113,6 @@ class WorkplaceSerializer(serializers.HyperlinkedModelSerializer):
             raise serializers.ValidationError(err)
         return super(WorkplaceSerializer, self).validate(attr)
 
-    def to_representation(self, instance):
-        data = super(WorkplaceSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
-
     class Meta:
         model = Workplace
         exclude = ('deleted',)
@@ -132,18 +134,19 @@ class WorkplaceSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class PictureSerializer(serializers.HyperlinkedModelSerializer):
+class PictureSerializer(TranslatedSerializerMixin,
+                        serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
+    srcset = serializers.SerializerMethodField(
+        help_text=_("URLs of resized copies of the picture, by width."),
+    )
 
-    def to_representation(self, instance):
-        data = super(PictureSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
+    def get_srcset(self, obj):
+        return obj.get_srcset(self.context['request'])
 
     class Meta:
         model = Picture
-        fields = '__all__'
+        exclude = ('derivatives',)
         extra_kwargs = {
             'workplace': {
                 'help_text': _("Workplace represented by the picture.")
@@ -157,7 +160,26 @@ class PictureSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class PeriodSerializer(serializers.HyperlinkedModelSerializer):
+class PictureUploadSerializer(PictureSerializer):
+    upload_token = DirectUploadTokenField(
+        Picture._meta.get_field('picture'),
+        write_only=True,
+        help_text=_("Token returned when the upload was prepared."),
+    )
+
+    def create(self, validated_data):
+        validated_data['picture'] = validated_data.pop('upload_token')
+        return super(PictureUploadSerializer, self).create(validated_data)
+
+    class Meta(PictureSerializer.Meta):
+        extra_kwargs = dict(
+            PictureSerializer.Meta.extra_kwargs,
+            picture={'read_only': True},
+        )
+
+
+class PeriodSerializer(TranslatedSerializerMixin,
+                       serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     force_delete = serializers.BooleanField(
         required=False,
@@ -249,12 +271,6 @@ class PeriodSerializer(serializers.HyperlinkedModelSerializer):
 
         return attrs
 
-    def to_representation(self, instance):
-        data = super(PeriodSerializer, self).to_representation(instance)
-        if self.context['request'].user.is_staff:
-            return data
-        return remove_translation_fields(data)
-
     class Meta:
         model = Period
         exclude = ('deleted',)
@@ -280,7 +296,9 @@ class PeriodSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class TimeSlotSerializer(serializers.HyperlinkedModelSerializer):
+class TimeSlotSerializer(TranslatedSerializerMixin,
+                         serializers.HyperlinkedModelSerializer):
+    translation_fields_for_staff = False
     id = serializers.ReadOnlyField()
     places_remaining = serializers.SerializerMethodField()
     reservations = serializers.SerializerMethodField()
@@ -424,7 +442,7 @@ class TimeSlotSerializer(serializers.HyperlinkedModelSerializer):
 
         return attrs
 
-    @transaction.atomic()
+    @history.atomic()
     def update(self, instance, validated_data):
         """
         If it is an update operation, we check if users will be affected by
@@ -439,13 +457,16 @@ class TimeSlotSerializer(serializers.HyperlinkedModelSerializer):
                 reservation_cancel = instance.reservations.filter(
                     is_active=True
                 )
-                affected_users = User.objects.filter(
-                    reservations__in=reservation_cancel
-                )
-
                 reservations_cancel_copy = copy(reservation_cancel)
 
-                affected_users.update(tickets=F('tickets') + 1)
+                # A user has at most one active reservation per timeslot
+                bulk_credit_tickets(
+                    {
+                        user_id: 1 for user_id in
+                        reservation_cancel.values_list('user_id', flat=True)
+                    },
+                    'timeslot_modified',
+                )
                 reservation_cancel.update(
                     is_active=False,
                     cancelation_reason='TM',  # TimeSlot modified
@@ -492,8 +513,7 @@ class TimeSlotSerializer(serializers.HyperlinkedModelSerializer):
         is_staff = self.context['request'].user.is_staff
         if self.context['view'].action == 'retrieve' and is_staff:
             self.fields['users'] = UserSerializer(many=True)
-        data = super(TimeSlotSerializer, self).to_representation(instance)
-        return remove_translation_fields(data)
+        return super(TimeSlotSerializer, self).to_representation(instance)
 
     class Meta:
         model = TimeSlot
@@ -537,6 +557,28 @@ class BatchTimeSlotSerializer(serializers.HyperlinkedModelSerializer):
             min_value=0
         )
     )
+    dry_run = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text=_(
+            "Only report what would be created. Nothing is saved."
+        ),
+    )
+    skip_conflicts = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text=_(
+            "Ignore dates overlapping an existing timeslot instead of "
+            "aborting the whole batch."
+        ),
+    )
+    batch_size = serializers.IntegerField(
+        required=False,
+        default=500,
+        min_value=1,
+        max_value=5000,
+        help_text=_("Number of timeslots inserted per database query."),
+    )
 
     def validate_weekdays(self, weekdays):
         """
@@ -592,71 +634,61 @@ class BatchTimeSlotSerializer(serializers.HyperlinkedModelSerializer):
                 'start_date': [_("Start date must be earlier than end_date.")],
             })
 
-        time_list = TimeSlot.objects.filter(
-            period=validated_data['period']
-        ).values_list('start_time', 'end_time')
-
-        timeslot_data = {
-            'period': validated_data['period'],
-        }
+        # Every timeslot starts and ends on the same day
+        if start_time >= end_time:
+            raise serializers.ValidationError({
+                'end_time': [_("End time must be later than start_time.")],
+                'start_time': [_("Start time must be earlier than end_time.")],
+            })
 
-        timeslot_data_list = list()
-
-        # Create a list of start times for timeslots
-        # Naive datetimes are used to avoid problems with DST (not handled by
-        # rrule)
-        timeslot_start_dates = list(
-            rrule(
-                freq=DAILY,
-                dtstart=aware_start.replace(tzinfo=None),
-                until=aware_end.replace(tzinfo=None),
-                byweekday=validated_data['weekdays'],
-            )
-        )
+        validated_data['timezone'] = tz
+        validated_data['aware_start'] = aware_start
+        validated_data['aware_end'] = aware_end
 
-        # Create a list of end times for timeslots
-        # Naive datetimes are used to avoid problems with DST (not handled by
-        # rrule)
-        timeslot_end_dates = list(
-            rrule(
-                freq=DAILY,
-                dtstart=aware_start.replace(
-                    hour=aware_end.hour,
-                    minute=aware_end.minute,
-                    second=aware_end.second,
-                    tzinfo=None,
-                ),
-                until=aware_end.replace(tzinfo=None),
-                byweekday=validated_data['weekdays'],
-            )
-        )
+        return validated_data
 
-        # For every start/end times in the list built by rrule, we add the
-        # timezone information and create the timeslot using that timezone-
-        # aware datetime. This will be automatically converted to correct UTC
-        # time by Django.
-        for start, end in zip(timeslot_start_dates, timeslot_end_dates):
-            timeslot_data['start_time'] = tz.localize(start)
-            timeslot_data['end_time'] = tz.localize(end)
-            new_timeslot = TimeSlot(**timeslot_data)
-            timeslot_data_list.append(new_timeslot)
+    def create(self, validated_data):
+        """
+        Streams the generated timeslots through a conflict check and inserts
+        them by batches.
 
-        for duration in time_list:
-            for timeslot in timeslot_data_list:
-                start = timeslot.start_time
-                end = timeslot.end_time
-                if max(duration[0], start) < min(duration[1], end):
-                    raise serializers.ValidationError({
-                        'non_field_errors': _(
-                            "An existing timeslot overlaps with the provided "
-                            "start_time and end_time."
-                        ),
-                    })
+        Returns a report of the operation.
+        """
+        # The occurrences are generated lazily: the whole batch is never
+        # held in memory.
+        occurrences = generate_timeslot_occurrences(
+            validated_data['start_date'],
+            validated_data['end_date'],
+            validated_data['start_time'],
+            validated_data['end_time'],
+            validated_data['weekdays'],
+            validated_data['timezone'],
+        )
 
-        return timeslot_data_list
+        with history.atomic():
+            try:
+                created, conflicts = create_timeslots(
+                    validated_data['period'],
+                    occurrences,
+                    validated_data['aware_start'],
+                    validated_data['aware_end'],
+                    validated_data['batch_size'],
+                    dry_run=validated_data['dry_run'],
+                    skip_conflicts=validated_data['skip_conflicts'],
+                )
+            except ValueError:
+                raise serializers.ValidationError({
+                    'non_field_errors': [_(
+                        "An existing timeslot overlaps with the provided "
+                        "start_time and end_time."
+                    )],
+                })
 
-    def create(self, validated_data):
-        return TimeSlot.objects.bulk_create(validated_data)
+        return {
+            'dry_run': validated_data['dry_run'],
+            'created': created,
+            'conflicts': conflicts,
+        }
 
     def save(self, **kwargs):
         return self.create(self.validated_data)
@@ -0,0 +1,214 @@
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+from itertools import islice
+
+from dateutil.rrule import rrule, DAILY
+
+from django.db.models import Count, Q
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from blitz_api.services import get_cached_analytics, get_rate
+
+from .models import Reservation, TimeSlot
+
+
+def generate_timeslot_occurrences(start_date, end_date, start_time, end_time,
+                                  weekdays, tz):
+    """
+    Lazily yields (start, end) timezone-aware datetimes for every day between
+    start_date and end_date (inclusively) that falls on one of the weekdays.
+
+    Occurrences are yielded in ascending order of start time.
+
+    Naive datetimes are used to build the recurrence to avoid problems with
+    DST (not handled by rrule). Timezone information is added afterward so
+    that every timeslot keeps the same local wall-clock time.
+    """
+    occurrences = rrule(
+        freq=DAILY,
+        dtstart=datetime.combine(start_date, start_time),
+        until=datetime.combine(end_date, end_time),
+        byweekday=weekdays,
+    )
+    for start in occurrences:
+        end = datetime.combine(start.date(), end_time)
+        yield tz.localize(start), tz.localize(end)
+
+
+def find_timeslot_conflicts(occurrences, existing_timeslots):
+    """
+    Sorted merge of two streams of time intervals.
+
+    occurrences:        iterable of (start, end) sorted by start
+    existing_timeslots: iterable of (id, start, end) sorted by start
+
+    Yields (start, end, conflicting_ids) for every occurrence. The
+    conflicting_ids list is empty if the occurrence doesn't overlap an
+    existing timeslot.
+
+    Each stream is walked only once: existing timeslots are added to a small
+    window when they start before the end of the current occurrence and are
+    dropped from it as soon as they end before the current occurrence starts.
+    """
+    existing_timeslots = iter(existing_timeslots)
+    next_existing = next(existing_timeslots, None)
+    window = list()
+
+    for start, end in occurrences:
+        while next_existing is not None and next_existing[1] < end:
+            window.append(next_existing)
+            next_existing = next(existing_timeslots, None)
+        window = [item for item in window if item[2] > start]
+        yield start, end, [item[0] for item in window]
+
+
+def create_timeslots(period, occurrences, window_start, window_end,
+                     batch_size, dry_run=False, skip_conflicts=False):
+    """
+    Creates timeslots in a period from a stream of (start, end) occurrences.
+
+    period:         Period model instance
+    occurrences:    iterable of (start, end) sorted by start
+    window_start:   datetime before which no occurrence starts
+    window_end:     datetime after which no occurrence ends
+    batch_size:     number of timeslots inserted per query
+    dry_run:        if True, nothing is written to the database
+    skip_conflicts: if True, occurrences overlapping an existing timeslot are
+                    ignored. Otherwise, the first conflict stops the process.
+
+    Returns a tuple (created, conflicts) where "created" is the number of
+    timeslots created (or that would be created on a dry run) and "conflicts"
+    is a list of dicts describing every overlapping occurrence.
+
+    Raises ValueError on the first conflict if skip_conflicts and dry_run are
+    both False. The caller is responsible for the transaction.
+    """
+    # Only existing timeslots overlapping the window can conflict. They are
+    # fetched once, as light tuples, before any insertion is made.
+    existing_timeslots = list(
+        TimeSlot.objects.filter(
+            period=period,
+            start_time__lt=window_end,
+            end_time__gt=window_start,
+        ).order_by('start_time').values_list('id', 'start_time', 'end_time')
+    )
+
+    created = 0
+    conflicts = list()
+
+    def accepted_timeslots():
+        for start, end, conflicting_ids in find_timeslot_conflicts(
+                occurrences, existing_timeslots):
+            if conflicting_ids:
+                conflicts.append({
+                    'start_time': start,
+                    'end_time': end,
+                    'conflicting_timeslots': conflicting_ids,
+                })
+                if not (skip_conflicts or dry_run):
+                    raise ValueError(conflicts[-1])
+                continue
+            yield TimeSlot(period=period, start_time=start, end_time=end)
+
+    timeslots = accepted_timeslots()
+    while True:
+        batch = list(islice(timeslots, batch_size))
+        if not batch:
+            break
+        if not dry_run:
+            TimeSlot.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+
+    return created, conflicts
+
+
+def compute_workplace_occupancy(start_time, end_time, period):
+    """
+    Returns the occupancy of workplaces for timeslots starting between
+    start_time and end_time, by time bucket: a dict of
+    {first day of bucket: list of entries by workplace}.
+
+    Uses one grouped query for the timeslots, one for the reservations and
+    one for the cancelations.
+    """
+    now = timezone.now()
+    bucket = Trunc('start_time', period)
+    timeslots = TimeSlot.objects.filter(
+        start_time__gte=start_time,
+        start_time__lt=end_time,
+        period__workplace__isnull=False,
+    )
+
+    entries = OrderedDict()
+    rows = timeslots.annotate(bucket=bucket).values(
+        'bucket',
+        'period__workplace',
+        'period__workplace__name',
+        'period__workplace__seats',
+    ).annotate(timeslots=Count('id')).order_by('bucket', 'period__workplace')
+    for row in rows:
+        entries[(row['bucket'], row['period__workplace'])] = {
+            'workplace': row['period__workplace'],
+            'name': row['period__workplace__name'],
+            'timeslots': row['timeslots'],
+            'capacity': row['period__workplace__seats'] * row['timeslots'],
+            'reservations': 0,
+            'attended': 0,
+            'past_reservations': 0,
+            'cancelations': {},
+        }
+
+    reservations = Reservation.objects.filter(
+        timeslot__in=timeslots,
+    ).annotate(
+        bucket=Trunc('timeslot__start_time', period),
+    ).order_by()
+    active = Q(is_active=True)
+    past = Q(is_active=True, timeslot__end_time__lt=now)
+    rows = reservations.values(
+        'bucket', 'timeslot__period__workplace',
+    ).annotate(
+        active=Count('id', filter=active),
+        past=Count('id', filter=past),
+        attended=Count('id', filter=past & Q(is_present=True)),
+    )
+    for row in rows:
+        entry = entries[(row['bucket'], row['timeslot__period__workplace'])]
+        entry['reservations'] = row['active']
+        entry['past_reservations'] = row['past']
+        entry['attended'] = row['attended']
+
+    rows = reservations.filter(is_active=False).values(
+        'bucket', 'timeslot__period__workplace', 'cancelation_reason',
+    ).annotate(count=Count('id'))
+    for row in rows:
+        entry = entries[(row['bucket'], row['timeslot__period__workplace'])]
+        reason = row['cancelation_reason'] or ''
+        entry['cancelations'][reason] = row['count']
+
+    occupancy = defaultdict(list)
+    for (bucket, workplace), entry in entries.items():
+        entry['fill_rate'] = get_rate(
+            entry['reservations'], entry['capacity'],
+        )
+        entry['no_show_rate'] = get_rate(
+            entry['past_reservations'] - entry['attended'],
+            entry['past_reservations'],
+        )
+        occupancy[timezone.localtime(bucket).date()].append(entry)
+    return occupancy
+
+
+def get_workplace_occupancy(start_date, end_date, period='month'):
+    """
+    Returns the occupancy of workplaces between two dates (included) by
+    time bucket, cached per bucket.
+    """
+    return get_cached_analytics(
+        'workplace_occupancy',
+        start_date,
+        end_date,
+        period,
+        compute_workplace_occupancy,
+    )
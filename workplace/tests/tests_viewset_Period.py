@@ -590,10 +590,10 @@ class PeriodTests(APITestCase):
         self.reservation.save()
         self.reservation.refresh_from_db()
         reservation_2.delete()
-        self.user.tickets = 0
-        self.user.save()
-        self.admin.tickets = 0
-        self.admin.save()
+        User.objects.filter(pk=self.user.pk).update(tickets=0)
+        self.user.refresh_from_db(fields=['tickets'])
+        User.objects.filter(pk=self.admin.pk).update(tickets=0)
+        self.admin.refresh_from_db(fields=['tickets'])
 
     def test_delete_with_reservations_no_force(self):
         """
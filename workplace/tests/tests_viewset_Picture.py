@@ -9,7 +9,8 @@ from django.contrib.auth import get_user_model
 from django.test import override_settings
 
 from blitz_api.factories import UserFactory, AdminFactory
-from blitz_api.services import remove_translation_fields
+from blitz_api.services import (remove_translation_fields,
+                                run_scheduled_tasks, )
 
 from ..models import Workplace, Picture
 
@@ -85,6 +86,7 @@ class PictureTests(APITestCase):
             'id': 2,
             'name': 'random_picture',
             'picture': 'http://testserver/media/workplaces/' + fname,
+            'srcset': {},
             'url': 'http://testserver/pictures/2',
             'workplace': 'http://testserver/workplaces/1'
         }
@@ -96,6 +98,17 @@ class PictureTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+        # The copies are made by a scheduled task
+        run_scheduled_tasks()
+
+        self.assertEqual(
+            Picture.objects.get(pk=2).get_srcset(),
+            {
+                '200w': '/media/workplaces/' +
+                fname.replace('.png', '_200w.webp'),
+            },
+        )
+
     def test_create_without_permission(self):
         """
         Ensure we can't create a picture if user has no permission.
@@ -223,6 +236,7 @@ class PictureTests(APITestCase):
             'name_en': 'new_picture',
             'name_fr': None,
             'picture': 'http://testserver/media/workplaces/' + fname,
+            'srcset': {},
             'url': 'http://testserver/pictures/1',
             'workplace': 'http://testserver/workplaces/1'
         }
@@ -231,6 +245,17 @@ class PictureTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        # The copies are made by a scheduled task
+        run_scheduled_tasks()
+
+        self.assertEqual(
+            Picture.objects.get(pk=1).get_srcset(),
+            {
+                '200w': '/media/workplaces/' +
+                fname.replace('.png', '_200w.webp'),
+            },
+        )
+
     def test_delete(self):
         """
         Ensure we can delete a picture.
@@ -264,6 +289,7 @@ class PictureTests(APITestCase):
                 'id': 1,
                 'name': 'random_picture',
                 'picture': 'http://testserver' + self.picture.picture.url,
+                'srcset': {},
                 'url': 'http://testserver/pictures/1',
                 'workplace': 'http://testserver/workplaces/1'
             }]
@@ -289,6 +315,7 @@ class PictureTests(APITestCase):
             'id': 1,
             'name': 'random_picture',
             'picture': 'http://testserver' + self.picture.picture.url,
+            'srcset': {},
             'url': 'http://testserver/pictures/1',
             'workplace': 'http://testserver/workplaces/1'
         }
@@ -314,3 +341,126 @@ class PictureTests(APITestCase):
         self.assertEqual(json.loads(response.content), content)
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload(self):
+        """
+        Ensure we can upload a picture file straight to the storage, then
+        create the picture from it.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('picture-upload'),
+            {'filename': 'new picture.png'},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        upload = json.loads(response.content)
+        key = upload['fields']['key']
+
+        self.assertRegex(key, r'^workplaces/[0-9a-f]{32}/new_picture\.png$')
+
+        data = dict(upload['fields'], file=self.picture_file)
+
+        response = self.client.post(upload['url'], data)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        data = {
+            'name': "uploaded_picture",
+            'workplace': reverse('workplace-detail', args=[self.workplace.id]),
+            'upload_token': upload['token'],
+        }
+
+        response = self.client.post(
+            reverse('picture-complete-upload'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        content = json.loads(response.content)
+
+        self.assertEqual(
+            content['picture'],
+            'http://testserver/media/' + key,
+        )
+        self.assertEqual(content['srcset'], {})
+
+        run_scheduled_tasks()
+
+        self.assertEqual(
+            list(Picture.objects.get(pk=content['id']).get_srcset()),
+            ['200w'],
+        )
+        self.assertEqual(
+            Picture.objects.get(pk=content['id']).picture.name,
+            key,
+        )
+
+    def test_upload_invalid_file(self):
+        """
+        Ensure we can't prepare the upload of a file that isn't an image.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('picture-upload'),
+            {'filename': 'document.txt'},
+            format='json',
+        )
+
+        content = {'filename': ['Only image files can be uploaded.']}
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_without_permission(self):
+        """
+        Ensure we can't prepare an upload if user has no permission.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(
+            reverse('picture-upload'),
+            {'filename': 'picture.png'},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_complete_upload_file_not_sent(self):
+        """
+        Ensure we can't create a picture if its file wasn't uploaded.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('picture-upload'),
+            {'filename': 'picture.png'},
+            format='json',
+        )
+
+        data = {
+            'name': "uploaded_picture",
+            'workplace': reverse('workplace-detail', args=[self.workplace.id]),
+            'upload_token': json.loads(response.content)['token'],
+        }
+
+        response = self.client.post(
+            reverse('picture-complete-upload'),
+            data,
+            format='json',
+        )
+
+        content = {
+            'upload_token': ['Invalid or expired upload, or file not sent.'],
+        }
+
+        self.assertEqual(json.loads(response.content), content)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
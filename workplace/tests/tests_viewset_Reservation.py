@@ -192,6 +192,7 @@ class ReservationTests(APITestCase):
                     'longitude': None,
                     'name': 'Blitz',
                     'pictures': [],
+                    'pictures_srcset': [],
                     'postal_code': '123 456',
                     'seats': 40,
                     'state_province': 'Random state',
@@ -369,6 +370,7 @@ class ReservationTests(APITestCase):
                     'longitude': None,
                     'name': 'Blitz2',
                     'pictures': [],
+                    'pictures_srcset': [],
                     'postal_code': '123 456',
                     'seats': 1,
                     'state_province': 'Random state',
@@ -189,6 +189,7 @@ class TimeSlotTests(APITestCase):
                 'longitude': None,
                 'name': 'Blitz',
                 'pictures': [],
+                'pictures_srcset': [],
                 'postal_code': '123 456',
                 'seats': 40,
                 'state_province': 'Random state',
@@ -531,6 +532,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -611,6 +613,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -700,6 +703,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -866,6 +870,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -960,6 +965,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -1052,10 +1058,10 @@ class TimeSlotTests(APITestCase):
         self.reservation.save()
         self.reservation.refresh_from_db()
         reservation_2.delete()
-        self.user.tickets = 1
-        self.user.save()
-        self.admin.tickets = 1
-        self.admin.save()
+        User.objects.filter(pk=self.user.pk).update(tickets=1)
+        self.user.refresh_from_db(fields=['tickets'])
+        User.objects.filter(pk=self.admin.pk).update(tickets=1)
+        self.admin.refresh_from_db(fields=['tickets'])
 
     def test_delete_with_reservations_no_force(self):
         """
@@ -1158,6 +1164,7 @@ class TimeSlotTests(APITestCase):
                     "longitude": None,
                     "name": "Blitz2",
                     "pictures": [],
+                    "pictures_srcset": [],
                     "postal_code": "123 456",
                     "seats": 40,
                     "state_province": "Random state",
@@ -1222,6 +1229,7 @@ class TimeSlotTests(APITestCase):
                     "longitude": None,
                     "name": "Blitz",
                     "pictures": [],
+                    "pictures_srcset": [],
                     "postal_code": "123 456",
                     "seats": 40,
                     "state_province": "Random state",
@@ -1252,6 +1260,7 @@ class TimeSlotTests(APITestCase):
                     "longitude": None,
                     "name": "Blitz2",
                     "pictures": [],
+                    "pictures_srcset": [],
                     "postal_code": "123 456",
                     "seats": 40,
                     "state_province": "Random state",
@@ -1316,6 +1325,7 @@ class TimeSlotTests(APITestCase):
                     "longitude": None,
                     "name": "Blitz",
                     "pictures": [],
+                    "pictures_srcset": [],
                     "postal_code": "123 456",
                     "seats": 40,
                     "state_province": "Random state",
@@ -1393,6 +1403,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz2",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -1501,6 +1512,7 @@ class TimeSlotTests(APITestCase):
                 "longitude": None,
                 "name": "Blitz",
                 "pictures": [],
+                "pictures_srcset": [],
                 "postal_code": "123 456",
                 "seats": 40,
                 "state_province": "Random state",
@@ -1736,6 +1748,95 @@ class TimeSlotTests(APITestCase):
 
         self.assertEqual(json.loads(response.content), content)
 
+    def test_batch_create_skip_conflicts(self):
+        """
+        Ensure that an admin can batch create timeslots while ignoring the
+        dates overlapping existing timeslots. Conflicts are reported.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        data = {
+            "period": reverse(
+                'period-detail', args=[self.period_active.id]
+            ),
+            "start_date": "2130-01-14",
+            "end_date": "2130-01-16",
+            "start_time": "17:00:00",
+            "end_time": "19:00:00",
+            "weekdays": [0, 1, 2, 3, 4, 5, 6],
+            "skip_conflicts": True,
+            "batch_size": 1,
+        }
+
+        response = self.client.post(
+            reverse('timeslot-batch-create'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            response.content,
+        )
+
+        response_data = json.loads(response.content)
+
+        self.assertEqual(response_data['dry_run'], False)
+        self.assertEqual(response_data['created'], 2)
+        self.assertEqual(len(response_data['conflicts']), 1)
+        self.assertEqual(
+            response_data['conflicts'][0]['conflicting_timeslots'],
+            [self.time_slot_active.id],
+        )
+
+        self.assertEqual(
+            TimeSlot.objects.filter(period=self.period_active).count(),
+            3,
+        )
+
+    def test_batch_create_dry_run(self):
+        """
+        Ensure that a dry run reports what would be created without creating
+        anything, even if conflicts are found.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        data = {
+            "period": reverse(
+                'period-detail', args=[self.period_active.id]
+            ),
+            "start_date": "2130-01-14",
+            "end_date": "2130-01-16",
+            "start_time": "17:00:00",
+            "end_time": "19:00:00",
+            "weekdays": [0, 1, 2, 3, 4, 5, 6],
+            "dry_run": True,
+        }
+
+        response = self.client.post(
+            reverse('timeslot-batch-create'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            response.content,
+        )
+
+        response_data = json.loads(response.content)
+
+        self.assertEqual(response_data['dry_run'], True)
+        self.assertEqual(response_data['created'], 2)
+        self.assertEqual(len(response_data['conflicts']), 1)
+
+        self.assertEqual(
+            TimeSlot.objects.filter(period=self.period_active).count(),
+            1,
+        )
+
     def test_batch_create_bad_dates(self):
         """
         Ensure that an admin can't batch create when dates do not respect
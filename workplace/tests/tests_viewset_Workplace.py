@@ -1,18 +1,25 @@
 import json
+import pytz
+
+from datetime import datetime
 
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from django.urls import reverse
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
 from blitz_api.factories import UserFactory, AdminFactory
 from blitz_api.services import remove_translation_fields
 
-from ..models import Workplace
+from ..models import Period, Reservation, TimeSlot, Workplace
 
 User = get_user_model()
 
+LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
+
 
 class WorkplaceTests(APITestCase):
 
@@ -74,6 +81,7 @@ class WorkplaceTests(APITestCase):
             'longitude': None,
             'name': 'random_workplace',
             'pictures': [],
+            'pictures_srcset': [],
             'seats': 40,
             'timezone': "America/Montreal",
             'place_name': '',
@@ -268,6 +276,7 @@ class WorkplaceTests(APITestCase):
             'state_province': 'Random_State',
             'name': 'new_workplace',
             'pictures': [],
+            'pictures_srcset': [],
             'seats': 200,
             'timezone': 'America/Montreal',
             'place_name': '',
@@ -324,6 +333,7 @@ class WorkplaceTests(APITestCase):
                 'state_province': 'Random_State',
                 'name': 'Blitz',
                 'pictures': [],
+                'pictures_srcset': [],
                 'seats': 40,
                 'timezone': 'America/Montreal',
                 'place_name': '',
@@ -362,6 +372,7 @@ class WorkplaceTests(APITestCase):
             'state_province': 'Random_State',
             'name': 'Blitz',
             'pictures': [],
+            'pictures_srcset': [],
             'seats': 40,
             'place_name': '',
             'timezone': 'America/Montreal',
@@ -390,3 +401,100 @@ class WorkplaceTests(APITestCase):
         self.assertEqual(json.loads(response.content), content)
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_occupancy(self):
+        """
+        Ensure that admins can get the occupancy of workplaces by month.
+        """
+        cache.clear()
+        self.client.force_authenticate(user=self.admin)
+
+        period = Period.objects.create(
+            name="random_period",
+            workplace=self.workplace,
+            start_date=LOCAL_TIMEZONE.localize(datetime(2018, 1, 1)),
+            end_date=LOCAL_TIMEZONE.localize(datetime(2018, 2, 28)),
+            price=3,
+            is_active=True,
+        )
+        timeslots = [
+            TimeSlot.objects.create(
+                name="evening_time_slot",
+                period=period,
+                price=3,
+                start_time=LOCAL_TIMEZONE.localize(datetime(2018, month, 8)),
+                end_time=LOCAL_TIMEZONE.localize(datetime(2018, month, 9)),
+            ) for month in (1, 1, 2)
+        ]
+        Reservation.objects.create(
+            user=self.admin,
+            timeslot=timeslots[0],
+            is_active=True,
+            is_present=True,
+        )
+        Reservation.objects.create(
+            user=self.user,
+            timeslot=timeslots[1],
+            is_active=True,
+        )
+        Reservation.objects.create(
+            user=self.user,
+            timeslot=timeslots[2],
+            is_active=False,
+            cancelation_reason='U',
+        )
+
+        response = self.client.get(
+            reverse('workplace-occupancy'),
+            {'start_date': '2018-01-01', 'end_date': '2018-02-28'},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        content = [{
+            'period': '2018-01-01',
+            'workplace': self.workplace.id,
+            'name': 'Blitz',
+            'timeslots': 2,
+            'capacity': 80,
+            'reservations': 2,
+            'attended': 1,
+            'past_reservations': 2,
+            'cancelations': {},
+            'fill_rate': 0.025,
+            'no_show_rate': 0.5,
+        }, {
+            'period': '2018-02-01',
+            'workplace': self.workplace.id,
+            'name': 'Blitz',
+            'timeslots': 1,
+            'capacity': 40,
+            'reservations': 0,
+            'attended': 0,
+            'past_reservations': 0,
+            'cancelations': {'U': 1},
+            'fill_rate': 0.0,
+            'no_show_rate': None,
+        }]
+
+        self.assertEqual(json.loads(response.content), content)
+
+        # Closed buckets are read from the cache
+        with self.assertNumQueries(0):
+            self.client.get(
+                reverse('workplace-occupancy'),
+                {'start_date': '2018-01-01', 'end_date': '2018-02-28'},
+            )
+
+    def test_occupancy_without_permission(self):
+        """
+        Ensure that users can't get the occupancy of workplaces.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(
+            reverse('workplace-occupancy'),
+            {'start_date': '2018-01-01', 'end_date': '2018-02-28'},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
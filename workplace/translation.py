@@ -1,6 +1,8 @@
 import simple_history
 from modeltranslation.translator import TranslationOptions, register
 
+from blitz_api.history import BufferedHistoricalRecords
+
 from . import models
 
 
@@ -32,7 +34,15 @@ class TimeSlotTranslationOptions(TranslationOptions):
     fields = ('name', )
 
 
-simple_history.register(models.Workplace, inherit=True)
-simple_history.register(models.Picture, inherit=True)
-simple_history.register(models.Period, inherit=True)
-simple_history.register(models.TimeSlot, inherit=True)
+simple_history.register(
+    models.Workplace, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.Picture, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.Period, inherit=True, records_class=BufferedHistoricalRecords
+)
+simple_history.register(
+    models.TimeSlot, inherit=True, records_class=BufferedHistoricalRecords
+)
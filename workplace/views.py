@@ -1,5 +1,6 @@
 import pytz
 
+from collections import Counter
 from copy import copy
 
 from datetime import datetime
@@ -16,20 +17,25 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail as django_send_mail
-from django.db import transaction
-from django.db.models import F, Q
+from django.db.models import Q
 from django.http import HttpResponse
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from blitz_api.exceptions import MailServiceError
-from blitz_api.services import send_mail, ExportPagination
+from blitz_api import history
+from blitz_api.cache import CachedResponseMixin
+from blitz_api.serializers import (AnalyticsQuerySerializer,
+                                   ImageUploadSerializer)
+from blitz_api.services import (send_mail, ExportPagination,
+                                bulk_credit_tickets, create_direct_upload,)
 
 from .models import Workplace, Picture, Period, TimeSlot, Reservation
 from .resources import (WorkplaceResource, PeriodResource, TimeSlotResource,
                         ReservationResource)
 
+from .services import get_workplace_occupancy
 from . import serializers, permissions
 
 User = get_user_model()
@@ -37,7 +43,7 @@ User = get_user_model()
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
 
-class WorkplaceViewSet(viewsets.ModelViewSet):
+class WorkplaceViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given workplace.
@@ -49,8 +55,12 @@ class WorkplaceViewSet(viewsets.ModelViewSet):
     Create a new workplace instance.
     """
     serializer_class = serializers.WorkplaceSerializer
-    queryset = Workplace.objects.all()
+    queryset = Workplace.objects.prefetch_related('pictures')
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'workplace.Workplace',
+        'workplace.Picture',
+    )
     filter_fields = '__all__'
     ordering = ('name',)
 
@@ -74,6 +84,24 @@ class WorkplaceViewSet(viewsets.ModelViewSet):
         ])
         return response
 
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def occupancy(self, request):
+        """
+        This custom action returns, by time bucket and workplace, the
+        capacity, the number of active reservations, the fill rate, the
+        attendance, the no-show rate and the number of cancelations by
+        reason.
+
+        Query parameters:
+            start_date, end_date: date range of the report (included).
+            period: "day" or "month" (default).
+        """
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+
+        serializer.is_valid(raise_exception=True)
+
+        return Response(get_workplace_occupancy(**serializer.validated_data))
+
 
 class PictureViewSet(viewsets.ModelViewSet):
     """
@@ -96,8 +124,44 @@ class PictureViewSet(viewsets.ModelViewSet):
         'workplace',
     }
 
+    @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
+    def upload(self, request):
+        """
+        This custom action prepares the upload of a picture file straight to
+        the media storage, without going through the API.
+
+        The returned "fields", followed by the file as "file", are POSTed as
+        a multipart form to the returned "url". The picture is then created
+        with the complete_upload action and the returned "token".
+        """
+        serializer = ImageUploadSerializer(data=request.data)
+
+        serializer.is_valid(raise_exception=True)
+
+        return Response(create_direct_upload(
+            Picture._meta.get_field('picture'),
+            serializer.validated_data['filename'],
+            request,
+        ))
+
+    @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
+    def complete_upload(self, request):
+        """
+        This custom action creates a picture from a file uploaded as
+        prepared by the upload action, given as "upload_token".
+        """
+        serializer = serializers.PictureUploadSerializer(
+            data=request.data,
+            context=self.get_serializer_context(),
+        )
+
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class PeriodViewSet(viewsets.ModelViewSet):
+
+class PeriodViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given period.
@@ -111,6 +175,11 @@ class PeriodViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.PeriodSerializer
     queryset = Period.objects.all()
     permission_classes = (permissions.IsAdminOrReadOnly,)
+    cache_models = (
+        'workplace.Period',
+        'workplace.TimeSlot',
+        'workplace.Reservation',
+    )
     filter_fields = '__all__'
     ordering = ('name',)
 
@@ -180,27 +249,23 @@ class PeriodViewSet(viewsets.ModelViewSet):
         reservation_cancel = Reservation.objects.filter(
             timeslot__period=instance, is_active=True
         )
-        affected_users = User.objects.filter(
-            reservations__in=reservation_cancel
-        )
 
-        with transaction.atomic():
+        with history.atomic():
             reservations_cancel_copy = copy(reservation_cancel)
 
             # The sequence is important here because the Queryset are
             # dynamically changing when doing update(). If the
             # `reservation_cancel` queryset objects are updated first, the
             # queryset will become empty since it was filtered using
-            # "is_active=True". That would lead to an empty `affected_users`
-            # queryset.
+            # "is_active=True".
             #
-            # For-loop required to handle duplicates (if user has multiple
-            # reservations that must be canceled).
-            # user.update(tickets=F('tickets') + 1)
-            for user in affected_users:
-                User.objects.filter(
-                    email=user.email
-                ).update(tickets=F('tickets') + 1)  # Increment tickets
+            # A Counter is used to handle duplicates (if user has multiple
+            # reservations that must be canceled): one ticket is refunded
+            # per reservation.
+            bulk_credit_tickets(
+                Counter(reservation_cancel.values_list('user_id', flat=True)),
+                'period_deleted',
+            )
             reservation_cancel.update(
                 is_active=False,
                 cancelation_reason='TD',  # Period deleted
@@ -316,7 +381,18 @@ class TimeSlotViewSet(viewsets.ModelViewSet):
             2019-11-25 and 2019-12-25 if those dates are within the period
             date range.
 
-        Process will abort if a conflict arise.
+        Optional parameters:
+            dry_run: if true, nothing is created. The response describes
+                what would have been created.
+            skip_conflicts: if true, dates overlapping an existing timeslot
+                are ignored and reported instead of aborting the process.
+            batch_size: number of timeslots inserted per query.
+
+        Process will abort if a conflict arise, unless "skip_conflicts" or
+        "dry_run" is set.
+
+        The response contains the number of timeslots created and the list
+        of conflicting dates with the IDs of the overlapping timeslots.
         """
         serializer = serializers.BatchTimeSlotSerializer(
             data=request.data
@@ -324,24 +400,12 @@ class TimeSlotViewSet(viewsets.ModelViewSet):
 
         serializer.is_valid(raise_exception=True)
 
-        serializer.save()
+        report = serializer.save()
+
+        if report['dry_run']:
+            return Response(report, status=status.HTTP_200_OK)
 
-        # The following commented code grabs the newly created timeslots and
-        #  returns them in the request.
-        #
-        # data = serializer.save()
-        # data = serializers.TimeSlotSerializer(
-        #     data,
-        #     many=True,
-        #     context={
-        #         'request': request,
-        #         'view': self
-        #     },
-        # ).data
-        #
-        # return Response(data, status=status.HTTP_201_CREATED)
-
-        return Response(status=status.HTTP_201_CREATED)
+        return Response(report, status=status.HTTP_201_CREATED)
 
     def filter_queryset(self, queryset):
         """
@@ -389,27 +453,23 @@ class TimeSlotViewSet(viewsets.ModelViewSet):
         reservation_cancel = instance.reservations.filter(
             is_active=True
         )
-        affected_users = User.objects.filter(
-            reservations__in=reservation_cancel
-        )
 
-        with transaction.atomic():
+        with history.atomic():
             reservations_cancel_copy = copy(reservation_cancel)
 
             # The sequence is important here because the Queryset are
             # dynamically changing when doing update(). If the
             # `reservation_cancel` queryset objects are updated first, the
             # queryset will become empty since it was filtered using
-            # "is_active=True". That would lead to an empty `affected_users`
-            # queryset.
+            # "is_active=True".
             #
-            # For-loop required to handle duplicates (if user has multiple
-            # reservations that must be canceled).
-            # user.update(tickets=F('tickets') + 1)
-            for user in affected_users:
-                User.objects.filter(
-                    email=user.email
-                ).update(tickets=F('tickets') + 1)  # Increment tickets
+            # A Counter is used to handle duplicates (if user has multiple
+            # reservations that must be canceled): one ticket is refunded
+            # per reservation.
+            bulk_credit_tickets(
+                Counter(reservation_cancel.values_list('user_id', flat=True)),
+                'timeslot_deleted',
+            )
 
             reservation_cancel.update(
                 is_active=False,